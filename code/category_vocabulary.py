@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+import json
+import numpy as np
+import pandas as pd
+
+VOCABULARY_FILENAME = 'category_vocabulary.json'
+
+CATEGORICAL_COLUMNS = ['pickup_year', 'pickup_time_class']
+
+
+class CategoryVocabulary(object):
+    '''
+    the sorted categories of every categorical column, learned from the training data and saved as json,
+    so train, test and live data are encoded frame by frame (or chunk by chunk) into the same columns.
+    one-hot columns are named like pd.get_dummies (`pickup_year_2012`), unknown categories are all zeros,
+    ordinal codes are the category index, unknown categories get get_unknown_code()
+    '''
+
+    def __init__(self, categories=None):
+        self.__categories = dict()
+        for column, values in (categories or dict()).items():
+            self.__categories[column] = sorted(values)
+
+    def get_columns(self):
+        return list(self.__categories.keys())
+
+    def get_categories(self, column):
+        return self.__categories[column]
+
+    def fit(self, data_frame, columns=CATEGORICAL_COLUMNS):
+        '''
+        add the categories seen in `data_frame`, can be called once per chunk, absent columns are skipped
+        '''
+        for column in columns:
+            if column not in data_frame.columns:
+                continue
+            values = set(self.__categories.get(column, []))
+            values.update(pd.unique(data_frame[column].dropna()).tolist())
+            self.__categories[column] = sorted(values)
+        return self
+
+    def get_feature_names(self, column, encoding='one_hot'):
+        if encoding == 'ordinal':
+            return [column]
+        return ['%s_%s' % (column, value) for value in self.__categories[column]]
+
+    def get_unknown_code(self, column):
+        return np.iinfo(self.__get_ordinal_dtype(column)).max
+
+    def get_unknown_counts(self, data_frame):
+        '''
+        :return: dict column -> number of rows whose category is not in the vocabulary, only columns with such rows
+        '''
+        unknown_counts = dict()
+        for column in self.get_columns():
+            if column not in data_frame.columns:
+                continue
+            _, known = self.__get_codes(column, data_frame[column].values)
+            if not known.all():
+                unknown_counts[column] = int((~known).sum())
+        return unknown_counts
+
+    def transform(self, data_frame, encoding='one_hot'):
+        '''
+        replace the categorical columns of the vocabulary found in `data_frame` by uint8 one-hot columns,
+        appended in vocabulary order, or by ordinal codes in place
+        '''
+        for column in self.get_columns():
+            if column not in data_frame.columns:
+                continue
+            values = data_frame[column].values
+            codes, known = self.__get_codes(column, values)
+            if encoding == 'ordinal':
+                dtype = self.__get_ordinal_dtype(column)
+                data_frame[column] = np.where(known, codes, np.iinfo(dtype).max).astype(dtype)
+                continue
+            if encoding != 'one_hot':
+                raise ValueError('unknown encoding %s' % (encoding,))
+            one_hot = np.zeros((values.shape[0], len(self.__categories[column])), dtype=np.uint8)
+            one_hot[np.flatnonzero(known), codes[known]] = 1
+            data_frame = pd.concat([data_frame.drop(columns=column),
+                                    pd.DataFrame(one_hot, columns=self.get_feature_names(column),
+                                                 index=data_frame.index)], axis=1)
+        return data_frame
+
+    def __get_codes(self, column, values):
+        categories = np.asarray(self.__categories[column])
+        codes = np.searchsorted(categories, values)
+        known = (codes < categories.shape[0])
+        known[known] = (categories[codes[known]] == values[known])
+        return codes, known
+
+    def __get_ordinal_dtype(self, column):
+        # the largest code is reserved for unknown categories
+        return np.uint8 if len(self.__categories[column]) < np.iinfo(np.uint8).max else np.uint16
+
+    def save(self, path):
+        with open(path, 'w') as json_file:
+            json.dump(self.__categories, json_file, indent=2)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'r') as json_file:
+            return CategoryVocabulary(json.load(json_file))
@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import datetime as dt
+from trip_featurizer import TripFeaturizer
+from trip_key import encode_key_column
+
+NON_FEATURE_COLUMNS = ['key', 'fare_amount']
+
+if __name__ == '__main__':
+    # compare TripFeaturizer on the raw trips against the rows written by
+    # clean-dataset-by-sample.py + generate-dataset-for-training.py for the same keys
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--prj_dir',
+                            type=str,
+                            default='../')
+    arg_parser.add_argument('--data_dir',
+                            type=str,
+                            default='data')
+    arg_parser.add_argument('--raw_data_dir',
+                            type=str,
+                            default='raw-data')
+    arg_parser.add_argument('--train_data_dir',
+                            type=str,
+                            default='data-for-training')
+    arg_parser.add_argument('--raw_filename',
+                            type=str,
+                            default='test.csv')
+    arg_parser.add_argument('--cleaned_filename',
+                            type=str,
+                            default='cleaned_test.feather')
+    arg_parser.add_argument('--nrows',
+                            type=int,
+                            default=10000)
+    arg_parser.add_argument('--single_rows',
+                            type=int,
+                            default=1000)
+    arg_parser.add_argument('--tolerance',
+                            type=float,
+                            default=1e-9)
+    arg_parser.add_argument('--log_filename',
+                            type=str,
+                            default=None)
+    FLAGS, _ = arg_parser.parse_known_args()
+
+    raw_data_path = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.raw_data_dir, FLAGS.raw_filename)
+    train_data_dir = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.train_data_dir)
+    cleaned_data_path = os.path.join(train_data_dir, FLAGS.cleaned_filename)
+
+    LOG_FORMAT = '[%(asctime)s] [%(lineno)d] [%(levelname)s] %(message)s'
+    if FLAGS.log_filename is not None:
+        LOG_FILE_PATH = os.path.join(train_data_dir, FLAGS.log_filename)
+    else:
+        LOG_FILE_PATH = None
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=LOG_FILE_PATH)
+
+    raw_df = encode_key_column(pd.read_csv(raw_data_path, nrows=FLAGS.nrows))
+    cleaned_df = pd.read_feather(cleaned_data_path)
+    feature_names = [column for column in cleaned_df.columns if column not in NON_FEATURE_COLUMNS]
+    cleaned_df = raw_df[['key']].merge(cleaned_df, on='key', how='inner')
+    raw_df = raw_df.set_index('key').loc[cleaned_df['key']].reset_index()
+    logging.debug('%d trips with %d features', raw_df.shape[0], len(feature_names))
+
+    featurizer = TripFeaturizer(feature_names)
+    trip_columns = ['pickup_datetime', 'pickup_longitude', 'pickup_latitude',
+                    'dropoff_longitude', 'dropoff_latitude', 'passenger_count']
+    expected = cleaned_df[feature_names].values.astype(np.float64)
+
+    start_time = dt.datetime.now()
+    batch_result = featurizer.transform(*[raw_df[column].values for column in trip_columns])
+    logging.debug('transform: %s per trip', (dt.datetime.now() - start_time) / max(1, raw_df.shape[0]))
+
+    single_rows = min(FLAGS.single_rows, raw_df.shape[0])
+    trips = list(raw_df[trip_columns].head(single_rows).itertuples(index=False, name=None))
+    start_time = dt.datetime.now()
+    single_result = np.array([featurizer.transform_one(*trip) for trip in trips], dtype=np.float64)
+    logging.debug('transform_one: %s per trip', (dt.datetime.now() - start_time) / max(1, single_rows))
+
+    passed = True
+    for name, result in [('transform', batch_result), ('transform_one', single_result)]:
+        difference = np.abs(result - expected[:result.shape[0]])
+        for index, column in enumerate(feature_names):
+            if result.shape[0] > 0 and difference[:, index].max() > FLAGS.tolerance:
+                logging.error('%s %s: %d rows differ, max difference %g', name, column,
+                              (difference[:, index] > FLAGS.tolerance).sum(), difference[:, index].max())
+                passed = False
+    logging.debug('parity %s', 'passed' if passed else 'FAILED')
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import logging
+import argparse
+import numpy as np
+import datetime as dt
+from model_training import load_parameters_from_json, train_model
+from xgb_dataset import read_training_data_frame, build_train_validate_dmatrix
+from feature_dtypes import get_memory_per_row
+
+if __name__ == '__main__':
+    # compare a training file written with --narrow_dtypes against the float64 one of the same raw data:
+    # column differences, memory per row, DMatrix construction time and the rmse of a model trained on each
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--prj_dir',
+                            type=str,
+                            default='../')
+    arg_parser.add_argument('--data_dir',
+                            type=str,
+                            default='data')
+    arg_parser.add_argument('--model_dir',
+                            type=str,
+                            default='model')
+    arg_parser.add_argument('--param_filename',
+                            type=str,
+                            default='param.json')
+    arg_parser.add_argument('--float64_data_dir',
+                            type=str,
+                            default='data-for-training')
+    arg_parser.add_argument('--narrow_data_dir',
+                            type=str,
+                            default='data-for-training-narrow')
+    arg_parser.add_argument('--filename',
+                            type=str,
+                            default='cleaned_train.feather')
+    arg_parser.add_argument('--rmse_tolerance',
+                            type=float,
+                            default=1e-3)
+    arg_parser.add_argument('--log_filename',
+                            type=str,
+                            default=None)
+    FLAGS, _ = arg_parser.parse_known_args()
+
+    float64_data_path = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.float64_data_dir, FLAGS.filename)
+    narrow_data_path = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.narrow_data_dir, FLAGS.filename)
+    model_param_path = os.path.join(FLAGS.prj_dir, FLAGS.model_dir, FLAGS.param_filename)
+
+    LOG_FORMAT = '[%(asctime)s] [%(lineno)d] [%(levelname)s] %(message)s'
+    if FLAGS.log_filename is not None:
+        LOG_FILE_PATH = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.narrow_data_dir, FLAGS.log_filename)
+    else:
+        LOG_FILE_PATH = None
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=LOG_FILE_PATH)
+
+    float64_df = read_training_data_frame(float64_data_path)
+    narrow_df = read_training_data_frame(narrow_data_path)
+    if float64_df.shape[0] != narrow_df.shape[0] or set(float64_df.columns) != set(narrow_df.columns):
+        logging.error('%s and %s do not hold the same rows and columns: %s vs %s',
+                      float64_data_path, narrow_data_path, float64_df.shape, narrow_df.shape)
+        sys.exit(1)
+    narrow_df = narrow_df[float64_df.columns]
+
+    for column in float64_df.columns:
+        expected = float64_df[column].values.astype(np.float64)
+        difference = np.abs(narrow_df[column].values.astype(np.float64) - expected)
+        relative = difference / np.maximum(np.abs(expected), np.finfo(np.float32).tiny)
+        logging.debug('%s: %s -> %s, max difference %g, max relative difference %g', column,
+                      float64_df[column].dtype, narrow_df[column].dtype,
+                      np.nanmax(difference) if difference.shape[0] > 0 else 0.0,
+                      np.nanmax(relative) if relative.shape[0] > 0 else 0.0)
+    logging.debug('memory per row: %.1f bytes -> %.1f bytes',
+                  get_memory_per_row(float64_df), get_memory_per_row(narrow_df))
+
+    param = load_parameters_from_json(model_param_path)
+    rmse = dict()
+    for name, data_frame in [('float64', float64_df), ('narrow', narrow_df)]:
+        start_time = dt.datetime.now()
+        train_data, validate_data = build_train_validate_dmatrix(data_frame, param['model_param']['seed'])
+        logging.debug('%s: DMatrix built in %s', name, dt.datetime.now() - start_time)
+        start_time = dt.datetime.now()
+        _, progress_info = train_model(param, train_data, validate_data, verbose_eval=False)
+        rmse[name] = progress_info['eval']['rmse'][-1]
+        logging.debug('%s: rmse %f, trained in %s', name, rmse[name], dt.datetime.now() - start_time)
+
+    passed = abs(rmse['narrow'] - rmse['float64']) <= FLAGS.rmse_tolerance
+    logging.debug('rmse difference %g, parity %s', rmse['narrow'] - rmse['float64'], 'passed' if passed else 'FAILED')
+    sys.exit(0 if passed else 1)
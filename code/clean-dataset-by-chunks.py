@@ -2,11 +2,20 @@
 import os
 import re
 import logging
+import collections
+import multiprocessing
 import argparse
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import datetime as dt
-from pytz import timezone
+from datetime_features import extract_datetime_fields
+from dataset_io import write_parquet_chunk, parquet_chunk_is_complete, read_feather_columns
+from geofence import AIRPORT_BOXES, get_new_york_geofence
+from trip_featurizer import get_landmark_engine, append_cyclic_datetime_features, append_coordinate_features
+from trip_key import encode_key_column
+from feature_dtypes import COORDINATE_COLUMNS, narrow_data_frame
+from validation_rules import RangeRule, EqualityRule, BoundingBoxRule, ValidationRuleSet, log_rejection_counts
 
 DROP_FLAG_DEFAULT = 0
 DROP_FLAG_SELECTED = -1
@@ -16,6 +25,36 @@ DROP_FLAG_INVALID_LOCATION = 3
 DROP_FLAG_INVALID_PASSENGER = 4
 DROP_FLAG_INVALID_DATE = 5
 
+# a record gets the drop flag of the highest priority rule it breaks, e.g. an invalid passenger count
+# outranks an invalid date, records outside New York are flagged only when no other rule applies
+TEST_DROP_FLAG_RULES = [
+    EqualityRule('invalid_date', {'pickup_year': 2008}, DROP_FLAG_INVALID_DATE, priority=30),
+    EqualityRule('airport_jfk', {'airport_jfk': 1}, DROP_FLAG_SELECTED, priority=20),
+    EqualityRule('airport_lga', {'airport_lga': 1}, DROP_FLAG_SELECTED, priority=20),
+    EqualityRule('airport_ewr', {'airport_ewr': 1}, DROP_FLAG_SELECTED, priority=20),
+]
+TRAIN_DROP_FLAG_RULES = TEST_DROP_FLAG_RULES + [
+    EqualityRule('pickup_zero_location', {'pickup_longitude': 0, 'pickup_latitude': 0},
+                 DROP_FLAG_INVALID_LOCATION, priority=70),
+    EqualityRule('dropoff_zero_location', {'dropoff_longitude': 0, 'dropoff_latitude': 0},
+                 DROP_FLAG_INVALID_LOCATION, priority=70),
+    BoundingBoxRule('pickup_invalid_coordinate', 'pickup_longitude', 'pickup_latitude', (-180, 180), (-90, 90),
+                    DROP_FLAG_INVALID_VALUE, priority=60),
+    BoundingBoxRule('dropoff_invalid_coordinate', 'dropoff_longitude', 'dropoff_latitude', (-180, 180), (-90, 90),
+                    DROP_FLAG_INVALID_VALUE, priority=60),
+    RangeRule('invalid_passenger_count', 'passenger_count', 1, 8, DROP_FLAG_INVALID_PASSENGER, priority=50),
+    RangeRule('invalid_fare', 'fare_amount', low=0, flag=DROP_FLAG_INVALID_FARE, priority=40, low_inclusive=False),
+    BoundingBoxRule('pickup_out_of_new_york', 'pickup_longitude', 'pickup_latitude', (-76, -69), (37, 45),
+                    DROP_FLAG_INVALID_LOCATION, priority=10),
+    BoundingBoxRule('dropoff_out_of_new_york', 'dropoff_longitude', 'dropoff_latitude', (-76, -69), (37, 45),
+                    DROP_FLAG_INVALID_LOCATION, priority=10),
+]
+NEW_YORK_GEOFENCE = get_new_york_geofence()
+LANDMARK_ENGINE = get_landmark_engine()
+
+TEST_DROP_FLAG_RULE_SET = ValidationRuleSet(TEST_DROP_FLAG_RULES, 'drop_flag', DROP_FLAG_DEFAULT)
+TRAIN_DROP_FLAG_RULE_SET = ValidationRuleSet(TRAIN_DROP_FLAG_RULES, 'drop_flag', DROP_FLAG_DEFAULT)
+
 
 def get_chunk_files(input_path, reg_exp):
     file_list = os.listdir(input_path)
@@ -29,10 +68,12 @@ def get_chunk_files(input_path, reg_exp):
 
 def read_data_frame_from_file(input_file_path, input_data_formation=None):
     if input_data_formation == 'feather':
-        df = pd.read_feather(input_file_path, nthreads=6)
+        df = read_feather_columns(input_file_path)
     else:
         df = pd.read_csv(input_file_path)
 
+    # chunks split by pandas still hold the key strings
+    df = encode_key_column(df)
     return df
 
 
@@ -46,7 +87,10 @@ def write_data_frame_to_file(data_frame, output_file_path, output_data_formation
 def get_output_file_path(input_file_path, output_file_dir, output_data_formation=None):
     _, filename = os.path.split(input_file_path)
 
-    if output_data_formation == 'feather':
+    if output_data_formation == 'parquet':
+        # every chunk is added to one dataset directory, partitioned by pickup year and month
+        filename = 'cleaned_test.parquet' if 'test' in filename else 'cleaned_train.parquet'
+    elif output_data_formation == 'feather':
         filename_base, _ = os.path.splitext(filename)
         filename = 'cleaned_%s.feather'%(filename_base,)
     else:
@@ -56,71 +100,29 @@ def get_output_file_path(input_file_path, output_file_dir, output_data_formation
     return output_file_path
 
 
-def parse_date_time(data_frame):
-    utc_timezone = timezone('utc')
-    new_york_timezone = timezone('US/Eastern')
-    data_frame['pickup_datetime_utc'] = data_frame['pickup_datetime'].map(lambda x: utc_timezone.localize(dt.datetime.strptime(x, '%Y-%m-%d %H:%M:%S %Z')))
-    data_frame['pickup_datetime_local'] = data_frame['pickup_datetime_utc'].map(lambda x: x.astimezone(new_york_timezone))
-    data_frame['pickup_year'] = data_frame['pickup_datetime_local'].map(lambda x: x.year)
-    data_frame['pickup_month'] = data_frame['pickup_datetime_local'].map(lambda x: x.month)
-    data_frame['pickup_day'] = data_frame['pickup_datetime_local'].map(lambda x: x.day)
-    data_frame['pickup_hour'] = data_frame['pickup_datetime_local'].map(lambda x: x.hour)
-    data_frame['pickup_minute'] = data_frame['pickup_datetime_local'].map(lambda x: x.minute)
-    data_frame['pickup_second'] = data_frame['pickup_datetime_local'].map(lambda x: x.second)
-    data_frame['pickup_weekday'] = data_frame['pickup_datetime_local'].map(lambda x: x.weekday())
-
-    data_frame.loc[data_frame['pickup_year'] == 2008, 'drop_flag'] = DROP_FLAG_INVALID_DATE
-
+def parse_date_time(data_frame, narrow_dtypes=False):
+    data_frame = extract_datetime_fields(data_frame, narrow_dtypes=narrow_dtypes)
+    data_frame = append_cyclic_datetime_features(data_frame)
     return data_frame
 
 
 def extract_airport_location(data_frame):
-    # New York JohnFitzgerald Kennedy International Airport
-    data_frame['airport_jfk'] = 0
-    data_frame.loc[(data_frame['pickup_longitude'].between(-73.7841, -73.7721)) & \
-                   (data_frame['pickup_latitude'].between(40.6613, 40.6213)),'airport_jfk'] = 1
-    data_frame.loc[(data_frame['dropoff_longitude'].between(-73.7841, -73.7721)) & \
-                   (data_frame['dropoff_latitude'].between(40.6613, 40.6213)), 'airport_jfk'] = 1
-
-    # LaGuardia Airport
-    data_frame['airport_lga'] = 0
-    data_frame.loc[(data_frame['pickup_longitude'].between(-73.8870, -73.8580)) & \
-                   (data_frame['pickup_latitude'].between(40.7800, 40.7680)),'airport_lga'] = 1
-    data_frame.loc[(data_frame['dropoff_longitude'].between(-73.8870, -73.8580)) & \
-                   (data_frame['dropoff_latitude'].between(40.7800, 40.7680)), 'airport_lga'] = 1
-
-    # Newark Liberty International Airport
-    data_frame['airport_ewr'] = 0
-    data_frame.loc[(data_frame['pickup_longitude'].between(-74.192, -74.172)) & \
-                   (data_frame['pickup_latitude'].between(40.708, 40.676)),'airport_ewr'] = 1
-    data_frame.loc[(data_frame['dropoff_longitude'].between(-74.192, -74.172)) & \
-                   (data_frame['dropoff_latitude'].between(40.708, 40.676)), 'airport_ewr'] = 1
-
-    data_frame.loc[(data_frame['airport_jfk'] == 1) & (data_frame['drop_flag'] == DROP_FLAG_DEFAULT), 'drop_flag'] = DROP_FLAG_SELECTED
-    data_frame.loc[(data_frame['airport_lga'] == 1) & (data_frame['drop_flag'] == DROP_FLAG_DEFAULT), 'drop_flag'] = DROP_FLAG_SELECTED
-    data_frame.loc[(data_frame['airport_ewr'] == 1) & (data_frame['drop_flag'] == DROP_FLAG_DEFAULT), 'drop_flag'] = DROP_FLAG_SELECTED
-
+    pickup_zone = NEW_YORK_GEOFENCE.locate(data_frame['pickup_longitude'].values,
+                                           data_frame['pickup_latitude'].values)
+    dropoff_zone = NEW_YORK_GEOFENCE.locate(data_frame['dropoff_longitude'].values,
+                                            data_frame['dropoff_latitude'].values)
+    for name, _, _ in AIRPORT_BOXES:
+        zone_id = NEW_YORK_GEOFENCE.get_zone_id(name)
+        data_frame['airport_' + name] = ((pickup_zone == zone_id) | (dropoff_zone == zone_id)).astype(int)
     return data_frame
 
 
-def clean_invalid_records(data_frame):
-    if 'fare_amount' in data_frame.columns:
-        data_frame.loc[data_frame['fare_amount'] <= 0, 'drop_flag'] = DROP_FLAG_INVALID_FARE
-
-    data_frame.loc[~data_frame['passenger_count'].between(1, 8),
-                   'drop_flag'] = DROP_FLAG_INVALID_PASSENGER
-
-    data_frame.loc[~data_frame['pickup_latitude'].between(-90, 90), 'drop_flag'] = DROP_FLAG_INVALID_VALUE
-    data_frame.loc[~data_frame['pickup_longitude'].between(-180, 180), 'drop_flag'] = DROP_FLAG_INVALID_VALUE
-    data_frame.loc[~data_frame['dropoff_latitude'].between(-90, 90), 'drop_flag'] = DROP_FLAG_INVALID_VALUE
-    data_frame.loc[~data_frame['dropoff_longitude'].between(-180, 180), 'drop_flag'] = DROP_FLAG_INVALID_VALUE
-
-    data_frame.loc[(data_frame['pickup_longitude'] == 0) & (data_frame['pickup_latitude'] == 0),
-                   'drop_flag'] = DROP_FLAG_INVALID_LOCATION
-    data_frame.loc[(data_frame['dropoff_longitude'] == 0) & (data_frame['dropoff_latitude'] == 0),
-                   'drop_flag'] = DROP_FLAG_INVALID_LOCATION
-
-    return data_frame
+def set_drop_flag(data_frame, is_test):
+    '''
+    :return: (data_frame, number of records flagged by every rule)
+    '''
+    rule_set = TEST_DROP_FLAG_RULE_SET if is_test else TRAIN_DROP_FLAG_RULE_SET
+    return rule_set.apply(data_frame)
 
 
 def calculate_distance(data_frame):
@@ -185,15 +187,73 @@ def set_order_cancelled_flag(data_frame):
     return data_frame
 
 
-def clean_records_out_of_new_york(data_frame):
-    outlier = ~data_frame['pickup_latitude'].between(37, 45)
-    outlier |= ~data_frame['pickup_longitude'].between(-76, -69)
-    outlier |= ~data_frame['dropoff_latitude'].between(37, 45)
-    outlier |= ~data_frame['dropoff_longitude'].between(-76, -69)
+def get_chunk_name(file):
+    chunk_name, _ = os.path.splitext(file)
+    return chunk_name
 
-    data_frame.loc[outlier & (data_frame['drop_flag'] == DROP_FLAG_DEFAULT), 'drop_flag'] = DROP_FLAG_INVALID_LOCATION
 
-    return data_frame
+def output_file_is_complete(output_file_path, output_data_formation=None, chunk_name=None):
+    if output_data_formation == 'parquet':
+        return parquet_chunk_is_complete(output_file_path, chunk_name)
+    if not os.path.exists(output_file_path):
+        return False
+    if output_data_formation == 'feather':
+        try:
+            pd.read_feather(output_file_path, columns=['drop_flag'])
+        except Exception:
+            return False
+    return True
+
+
+def clean_data_frame(data_frame, is_test, narrow_dtypes=False):
+    '''
+    :param narrow_dtypes: keep the columns in the float32 / small integer dtypes of feature_dtypes.NARROW_DTYPES
+    '''
+    if narrow_dtypes:
+        data_frame = narrow_data_frame(data_frame, exclude=COORDINATE_COLUMNS)
+    data_frame = add_drop_flag_column(data_frame)
+    data_frame = parse_date_time(data_frame, narrow_dtypes)
+    data_frame = set_weekend_flag(data_frame)
+    data_frame = set_weekday_rush_hour_flag(data_frame)
+    data_frame = set_night_flag(data_frame)
+    data_frame = set_order_cancelled_flag(data_frame)
+    data_frame = extract_airport_location(data_frame)
+    data_frame = calculate_distance(data_frame)
+    data_frame, rejection_counts = set_drop_flag(data_frame, is_test)
+    # the features of DataCleaner.parse_coordinate, the drop flag rules above need the coordinates in degree
+    data_frame = append_coordinate_features(data_frame, LANDMARK_ENGINE, NEW_YORK_GEOFENCE)
+    if narrow_dtypes:
+        data_frame = narrow_data_frame(data_frame)
+    return data_frame, rejection_counts
+
+
+def clean_chunk_file(file, data_dir, input_data_formation=None, output_data_formation=None, narrow_dtypes=False):
+    '''
+    clean one chunk file, the output is written to a hidden temporary file first and renamed
+    afterwards, so an existing output file is always a complete one
+    :return: (file, number of rows, elapsed time, number of records flagged by every drop flag rule)
+    '''
+    start_time = dt.datetime.now()
+    file_path = os.path.join(data_dir, file)
+    output_file_path = get_output_file_path(file_path, data_dir, output_data_formation)
+    output_dir, output_filename = os.path.split(output_file_path)
+    temp_file_path = os.path.join(output_dir, '.%s.tmp' % (output_filename,))
+
+    df = read_data_frame_from_file(file_path, input_data_formation)
+    logging.debug('cleaning %s' % (file_path,))
+    df, rejection_counts = clean_data_frame(df, 'test' in file, narrow_dtypes)
+    if output_data_formation == 'parquet':
+        # sorted by time, so the row groups of a month cover disjoint time ranges
+        df = df.sort_values('pickup_datetime_utc', kind='stable')
+        write_parquet_chunk(pa.Table.from_pandas(df, preserve_index=False), output_file_path, get_chunk_name(file))
+    else:
+        write_data_frame_to_file(df, temp_file_path, output_data_formation)
+        os.replace(temp_file_path, output_file_path)
+    return file, df.shape[0], dt.datetime.now() - start_time, rejection_counts
+
+
+def clean_chunk_file_worker(args):
+    return clean_chunk_file(*args)
 
 
 if __name__ == '__main__':
@@ -218,6 +278,13 @@ if __name__ == '__main__':
     arg_parser.add_argument('--output_data_formation',
                             type=str,
                             default='feather')
+    arg_parser.add_argument('--num_workers',
+                            type=int,
+                            default=1)
+    arg_parser.add_argument('--overwrite',
+                            action='store_true')
+    arg_parser.add_argument('--narrow_dtypes',
+                            action='store_true')
     FLAGS, _ = arg_parser.parse_known_args()
 
     start_time = dt.datetime.now()
@@ -232,22 +299,33 @@ if __name__ == '__main__':
     logging.debug(chunk_files)
     # chunk_files=['chunk_011_train.feather', 'test.feather']
     # chunk_files=['test.feather']
+    pending_files = []
     for file in chunk_files:
-        file_path = os.path.join(data_dir, file)
-        output_file_path = get_output_file_path(file_path, data_dir, FLAGS.output_data_formation)
-        df = read_data_frame_from_file(file_path, FLAGS.input_data_formation)
-        logging.debug('cleaning %s'%(file_path,))
-        df = add_drop_flag_column(df)
-        df = parse_date_time(df)
-        df = set_weekend_flag(df)
-        df = set_weekday_rush_hour_flag(df)
-        df = set_night_flag(df)
-        df = set_order_cancelled_flag(df)
-        df = extract_airport_location(df)
-        df = calculate_distance(df)
-        if 'test' not in file:
-            df = clean_invalid_records(df)
-            df = clean_records_out_of_new_york(df)
-        write_data_frame_to_file(df, output_file_path, FLAGS.output_data_formation)
-        end_time = dt.datetime.now()
-        logging.debug('done in %s'%(end_time-start_time,))
+        output_file_path = get_output_file_path(os.path.join(data_dir, file), data_dir, FLAGS.output_data_formation)
+        if not FLAGS.overwrite and output_file_is_complete(output_file_path, FLAGS.output_data_formation,
+                                                           get_chunk_name(file)):
+            logging.debug('skip %s, %s already exists' % (file, output_file_path))
+        else:
+            pending_files.append(file)
+
+    tasks = [(file, data_dir, FLAGS.input_data_formation, FLAGS.output_data_formation, FLAGS.narrow_dtypes)
+             for file in pending_files]
+    total_rows = 0
+    total_rejection_counts = collections.Counter()
+    if FLAGS.num_workers > 1:
+        # every worker holds one whole chunk in memory, size num_workers accordingly
+        with multiprocessing.Pool(FLAGS.num_workers, maxtasksperchild=1) as pool:
+            results = pool.imap_unordered(clean_chunk_file_worker, tasks)
+            for index, (file, rows, elapsed, rejection_counts) in enumerate(results):
+                logging.debug('[%d/%d] %s: %d rows cleaned in %s' % (index + 1, len(tasks), file, rows, elapsed))
+                total_rows += rows
+                total_rejection_counts.update(rejection_counts)
+    else:
+        for index, task in enumerate(tasks):
+            file, rows, elapsed, rejection_counts = clean_chunk_file(*task)
+            logging.debug('[%d/%d] %s: %d rows cleaned in %s' % (index + 1, len(tasks), file, rows, elapsed))
+            total_rows += rows
+            total_rejection_counts.update(rejection_counts)
+    log_rejection_counts(total_rejection_counts, total_rows)
+    end_time = dt.datetime.now()
+    logging.debug('done in %s'%(end_time-start_time,))
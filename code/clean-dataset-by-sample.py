@@ -3,369 +3,190 @@ import logging
 import argparse
 import numpy as np
 import pandas as pd
-import datetime as dt
-import matplotlib.path as MatPltPath
+import pyarrow as pa
 from pathlib import Path
-from pytz import timezone
+from collections import OrderedDict
+from datetime_features import extract_datetime_fields
+from landmark_distance import RADIUS_EARTH
+from trip_featurizer import get_landmark_engine, append_cyclic_datetime_features, append_coordinate_features
+from geofence import get_new_york_geofence
+from trip_key import encode_key_column
+from dataset_io import ARROW_FLOAT64_COLUMNS_TYPE, iter_raw_csv_chunks, write_feather_tables, get_file_fingerprint, \
+    read_feather_columns
+from feature_dtypes import COORDINATE_COLUMNS, narrow_data_frame, get_memory_per_row
+from validation_rules import RangeRule, BoundingBoxRule, ValidationRuleSet, log_rejection_counts
 
 
 class DataCleaner(object):
 
-    def __init__(self, data_dir, raw_data_dir, processing_data_dir, training_data_dir, train_data_path, test_data_path):
+    def __init__(self, data_dir, raw_data_dir, processing_data_dir, training_data_dir, train_data_path, test_data_path,
+                 narrow_dtypes=False):
+        '''
+        :param narrow_dtypes: keep the columns in the float32 / small integer dtypes of feature_dtypes.NARROW_DTYPES
+        '''
         self.__data_dir = data_dir
         self.__raw_data_dir = raw_data_dir
         self.__processing_data_dir = processing_data_dir
         self.__training_data_dir = training_data_dir
         self.__train_data_path = train_data_path
         self.__test_data_path = test_data_path
-
-        self.__jfk_coord = {'longitude': (-73.778889 * np.pi) / 180, 'latitude': (40.639722 * np.pi) / 180}
-        self.__ewr_coord = {'longitude': (-74.168611 * np.pi)/180, 'latitude': (40.6925 * np.pi)/180}
-        self.__lga_coord = {'longitude': (-73.872611 * np.pi)/180, 'latitude': (40.77725 * np.pi)/180}
-        self.__liberty_statue_coord = {'longitude': (-74.0445 * np.pi)/180, 'latitude': (40.6892 * np.pi)/180}
-        self.__nyc_coord = {'longitude': (-74.0063889 * np.pi)/180, 'latitude': (40.7141667 * np.pi)/180}
-
-        self.__radius_earth = 6371
-        self.__manhattan_path = MatPltPath.Path(
-            [[40.698, -74.019], [40.757, -74.014], [40.881745, -73.934875],
-             [40.872186, -73.909654], [40.834051, -73.934120], [40.809238, -73.933307],
-             [40.798337, -73.927591], [40.773668, -73.941674], [40.741346, -73.966607],
-             [40.707832, -73.974694]])
+        self.__narrow_dtypes = narrow_dtypes
+
+        # jfk, ewr, lga, liberty and nyc, see trip_featurizer.LANDMARKS
+        self.__radius_earth = RADIUS_EARTH
+        self.__landmark_engine = get_landmark_engine(self.__radius_earth)
+        self.__geofence = get_new_york_geofence()
+        # the highest priority outlier rule a record breaks decides its reserved_flag
+        self.__outlier_rule_set = ValidationRuleSet([
+            RangeRule('fare_amount_outlier', 'fare_amount', 2.5, 500, flag=1, priority=1),
+            BoundingBoxRule('pickup_coordinate_outlier', 'pickup_longitude', 'pickup_latitude', (-80, -70), (35, 45),
+                            flag=2, priority=2),
+            BoundingBoxRule('dropoff_coordinate_outlier', 'dropoff_longitude', 'dropoff_latitude', (-80, -70),
+                            (35, 45), flag=2, priority=2),
+            RangeRule('passenger_count_outlier', 'passenger_count', 0, 9, flag=3, priority=3),
+        ], 'reserved_flag')
+
+    def add_landmark(self, name, longitude, latitude):
+        '''
+        register an extra landmark, parse_coordinate will generate the `<name>_dist` column for it
+        :param longitude: degree
+        :param latitude: degree
+        :return:
+        '''
+        self.__landmark_engine.register_landmark(name,
+                                                 longitude=(longitude * np.pi) / 180,
+                                                 latitude=(latitude * np.pi) / 180)
 
     def load_dataset(self, nrows=10_000_000):
-        train_stem = self.__train_data_path.stem
-        converted_train_filename = train_stem + '.feather'
-        converted_train_path = self.__processing_data_dir / converted_train_filename
+        '''
+        load the first `nrows` rows of the training csv (None for all of them) and the whole test csv,
+        the converted frames are cached as feather under a name built from the input slice and the
+        fingerprint of its bytes, a different `nrows` or changed rows never reuse a stale cache
+        '''
+        converted_train_path = self.__get_converted_path(self.__train_data_path, nrows)
         if converted_train_path.exists():
             logging.debug(f'load training dataset from {converted_train_path}')
-            self.__train_df = pd.read_feather(converted_train_path, nthreads=6)
+            self.__train_df = read_feather_columns(converted_train_path)
         else:
             logging.debug(f'load training dataset from {self.__train_data_path}')
             self.__train_df = pd.read_csv(self.__train_data_path, parse_dates=['pickup_datetime'], nrows=nrows)
+            self.__train_df = encode_key_column(self.__train_df)
             self.__train_df.to_feather(converted_train_path)
         logging.debug('done!')
 
-        test_stem = self.__test_data_path.stem
-        converted_test_filename = test_stem + '.feather'
-        converted_test_path = self.__processing_data_dir / converted_test_filename
+        converted_test_path = self.__get_converted_path(self.__test_data_path)
         if converted_test_path.exists():
             logging.debug(f'load testing dataset from {converted_test_path}')
-            self.__test_df = pd.read_feather(converted_test_path, nthreads=6)
+            self.__test_df = read_feather_columns(converted_test_path)
         else:
             logging.debug(f'load testing dataset from {self.__test_data_path}')
             self.__test_df = pd.read_csv(self.__test_data_path, parse_dates=['pickup_datetime'])
+            self.__test_df = encode_key_column(self.__test_df)
             self.__test_df.to_feather(converted_test_path)
         logging.debug('done!')
+        self.__train_df = self.__narrow_data_frame(self.__train_df, exclude=COORDINATE_COLUMNS)
+        self.__test_df = self.__narrow_data_frame(self.__test_df, exclude=COORDINATE_COLUMNS)
+        self.__log_memory_per_row()
 
-    def parse_datetime(self):
-        logging.debug('parse_datetime')
-        self.__train_df = self.__extract_datetime_fields(self.__train_df)
-        self.__test_df = self.__extract_datetime_fields(self.__test_df)
-
-        self.__train_df['pickup_days_in_year'] = self.__train_df['pickup_datetime_local'].map(self.__extract_days_in_year)
-        self.__train_df['pickup_days_sin'] = np.sin(2 * np.pi * self.__train_df['pickup_days_in_year'] / 365)
-        self.__train_df['pickup_days_cos'] = np.cos(2 * np.pi * self.__train_df['pickup_days_in_year'] / 365)
-
-        self.__test_df['pickup_days_in_year'] = self.__test_df['pickup_datetime_local'].map(self.__extract_days_in_year)
-        self.__test_df['pickup_days_sin'] = np.sin(2 * np.pi * self.__test_df['pickup_days_in_year'] / 365)
-        self.__test_df['pickup_days_cos'] = np.cos(2 * np.pi * self.__test_df['pickup_days_in_year'] / 365)
-
-        self.__train_df['pickup_seconds_in_day'] = self.__extract_seconds_in_day(self.__train_df)
-        self.__train_df['pickup_seconds_sin'] = np.sin(2 * np.pi * self.__train_df['pickup_seconds_in_day'] / 86400)
-        self.__train_df['pickup_seconds_cos'] = np.cos(2 * np.pi * self.__train_df['pickup_seconds_in_day'] / 86400)
-
-        self.__test_df['pickup_seconds_in_day'] = self.__extract_seconds_in_day(self.__test_df)
-        self.__test_df['pickup_seconds_sin'] = np.sin(2 * np.pi * self.__test_df['pickup_seconds_in_day'] / 86400)
-        self.__test_df['pickup_seconds_cos'] = np.cos(2 * np.pi * self.__test_df['pickup_seconds_in_day'] / 86400)
-
-        self.__train_df['pickup_weekday_sin'] = np.sin(2 * np.pi * self.__train_df['pickup_weekday'] / 7)
-        self.__train_df['pickup_weekday_cos'] = np.cos(2 * np.pi * self.__train_df['pickup_weekday'] / 7)
-
-        self.__test_df['pickup_weekday_sin'] = np.sin(2 * np.pi * self.__test_df['pickup_weekday'] / 7)
-        self.__test_df['pickup_weekday_cos'] = np.cos(2 * np.pi * self.__test_df['pickup_weekday'] / 7)
-
-        self.__train_df = self.__get_time_class(self.__train_df)
-        self.__test_df = self.__get_time_class(self.__test_df)
-
-    def __get_time_class(self, data_frame):
+    def __get_converted_path(self, data_path, nrows=None):
         '''
-        [0, 8): overnight - 0
-        [8, 12): morning - 1
-        [12, 16): afternoon - 2
-        [16, 20): rush-hour - 3
-        [20, 23]: night - 4
-        :param data_frame:
-        :return:
+        `<stem>.<rows>.<fingerprint>.feather`, rows is `head_<nrows>` or `all`, the fingerprint is the
+        content md5 of the bytes the slice reads: the header and the first `nrows` lines of the csv file
         '''
-        data_frame['pickup_time_class'] = 0
-        data_frame.loc[data_frame['pickup_hour'].between(0, 7), 'pickup_time_class'] = 0
-        data_frame.loc[data_frame['pickup_hour'].between(8, 11), 'pickup_time_class'] = 1
-        data_frame.loc[data_frame['pickup_hour'].between(12, 15), 'pickup_time_class'] = 2
-        data_frame.loc[data_frame['pickup_hour'].between(16, 19), 'pickup_time_class'] = 3
-        data_frame.loc[data_frame['pickup_hour'].between(20, 23), 'pickup_time_class'] = 4
-        return data_frame
-
-    def __extract_days_in_year(self, date):
-        date_delta = date - dt.datetime(year=date.year, month=1, day=1, tzinfo=date.tzinfo)
-        return date_delta.days
+        fingerprint = get_file_fingerprint(data_path, None if nrows is None else nrows + 1)[:8]
+        rows = 'all' if nrows is None else f'head_{nrows}'
+        return self.__processing_data_dir / f'{data_path.stem}.{rows}.{fingerprint}.feather'
 
-    def __extract_seconds_in_day(self, data_frame):
-        return data_frame['pickup_hour'] * 3600 + data_frame['pickup_minute'] * 60 + data_frame['pickup_second']
+    def clean_dataset_by_batches(self, batch_size=1_000_000, nrows=None):
+        '''
+        the streaming form of load_dataset + clean_outlier + parse_datetime + parse_coordinate + save_dataset:
+        the raw csv files are read in record batches of `batch_size` rows, every batch goes through the
+        same stages and is appended to the cleaned feather file, only one batch is held in memory.
+        :param nrows: rows of the training csv to clean, None for all of them
+        '''
+        for data_path, is_train in [(self.__train_data_path, True), (self.__test_data_path, False)]:
+            cleaned_path = self.__get_cleaned_path(data_path)
+            logging.debug(f'cleaning {data_path} into {cleaned_path} by batches of {batch_size} rows')
+            rejection_counts = OrderedDict()
+            raw_tables = iter_raw_csv_chunks(data_path, batch_size, column_types=ARROW_FLOAT64_COLUMNS_TYPE,
+                                             nrows=nrows if is_train else None)
+            cleaned_tables = (self.__clean_raw_table(raw_table, is_train, rejection_counts)
+                              for raw_table in raw_tables)
+            row_num = write_feather_tables(cleaned_tables, str(cleaned_path))
+            if is_train:
+                log_rejection_counts(rejection_counts, row_num)
+            logging.debug(f'{row_num} rows saved')
+
+    def __clean_raw_table(self, raw_table, is_train, rejection_counts):
+        data_frame = raw_table.to_pandas()
+        data_frame = self.__narrow_data_frame(data_frame, exclude=COORDINATE_COLUMNS)
+        if is_train:
+            data_frame, batch_rejection_counts = self.__clean_outlier_frame(data_frame)
+            for name, count in batch_rejection_counts.items():
+                rejection_counts[name] = rejection_counts.get(name, 0) + count
+        data_frame = self.__parse_datetime_frame(data_frame)
+        data_frame = self.__parse_coordinate_frame(data_frame)
+        logging.debug(f'{data_frame.shape[0]} rows cleaned, {get_memory_per_row(data_frame):.1f} bytes per row')
+        return pa.Table.from_pandas(data_frame, preserve_index=False)
 
-    def __extract_datetime_fields(self, data_frame):
-        data_frame = self.__convert_utc_to_us_eastern(data_frame)
-        data_frame['pickup_year'] = data_frame['pickup_datetime_local'].map(lambda x: x.year)
-        data_frame['pickup_month'] = data_frame['pickup_datetime_local'].map(lambda x: x.month)
-        data_frame['pickup_day'] = data_frame['pickup_datetime_local'].map(lambda x: x.day)
-        data_frame['pickup_hour'] = data_frame['pickup_datetime_local'].map(lambda x: x.hour)
-        data_frame['pickup_minute'] = data_frame['pickup_datetime_local'].map(lambda x: x.minute)
-        data_frame['pickup_second'] = data_frame['pickup_datetime_local'].map(lambda x: x.second)
-        data_frame['pickup_weekday'] = data_frame['pickup_datetime_local'].map(lambda x: x.weekday())
-        return data_frame
+    def parse_datetime(self):
+        logging.debug('parse_datetime')
+        self.__train_df = self.__parse_datetime_frame(self.__train_df)
+        self.__test_df = self.__parse_datetime_frame(self.__test_df)
+        self.__log_memory_per_row()
 
-    def __convert_utc_to_us_eastern(self, data_frame):
-        utc_timezone = timezone('utc')
-        new_york_timezone = timezone('US/Eastern')
-        data_frame['pickup_datetime_utc'] = data_frame['pickup_datetime'].map(
-            lambda x: utc_timezone.localize(x))
-        data_frame['pickup_datetime_local'] = data_frame['pickup_datetime_utc'].map(
-            lambda x: x.astimezone(new_york_timezone))
-        return data_frame
+    def __parse_datetime_frame(self, data_frame):
+        data_frame = extract_datetime_fields(data_frame, narrow_dtypes=self.__narrow_dtypes)
+        data_frame = append_cyclic_datetime_features(data_frame)
+        return self.__narrow_data_frame(data_frame, exclude=COORDINATE_COLUMNS)
 
     def parse_coordinate(self):
         logging.debug('parse_coordinate')
-        self.__train_df = self.__coordinate_is_in_mahattan(self.__train_df)
-        self.__test_df = self.__coordinate_is_in_mahattan(self.__test_df)
-
-        self.__train_df.loc[:, 'pickup_longitude'] = self.__convert_degree_to_raidus(
-            self.__train_df['pickup_longitude'])
-        self.__train_df.loc[:, 'pickup_latitude'] = self.__convert_degree_to_raidus(
-            self.__train_df['pickup_latitude'])
-        self.__train_df.loc[:, 'dropoff_longitude'] = self.__convert_degree_to_raidus(
-            self.__train_df['dropoff_longitude'])
-        self.__train_df.loc[:, 'dropoff_latitude'] = self.__convert_degree_to_raidus(
-            self.__train_df['dropoff_latitude'])
-
-        self.__test_df.loc[:, 'pickup_longitude'] = self.__convert_degree_to_raidus(
-            self.__test_df['pickup_longitude'])
-        self.__test_df.loc[:, 'pickup_latitude'] = self.__convert_degree_to_raidus(
-            self.__test_df['pickup_latitude'])
-        self.__test_df.loc[:, 'dropoff_longitude'] = self.__convert_degree_to_raidus(
-            self.__test_df['dropoff_longitude'])
-        self.__test_df.loc[:, 'dropoff_latitude'] = self.__convert_degree_to_raidus(
-            self.__test_df['dropoff_latitude'])
-
-        self.__train_df['longitude_delta'] = self.__train_df['dropoff_longitude'] - self.__train_df['pickup_longitude']
-        self.__train_df['latitude_delta'] = self.__train_df['dropoff_latitude'] - self.__train_df['pickup_latitude']
-
-        self.__test_df['longitude_delta'] = self.__test_df['dropoff_longitude'] - self.__test_df['pickup_longitude']
-        self.__test_df['latitude_delta'] = self.__test_df['dropoff_latitude'] - self.__test_df['pickup_latitude']
-
-        self.__train_df['haver_dist'] = self.__get_haversine_distance(self.__train_df)
-        self.__test_df['haver_dist'] = self.__get_haversine_distance(self.__test_df)
-
-        self.__train_df['bear_dist'] = self.__get_bearing_distance(self.__train_df)
-        self.__test_df['bear_dist'] = self.__get_bearing_distance(self.__test_df)
-
-        self.__train_df['jfk_dist'] = self.__train_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__jfk_coord['latitude'],
-                self.__jfk_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__jfk_coord['latitude'],
-                self.__jfk_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
-        self.__test_df['jfk_dist'] = self.__test_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__jfk_coord['latitude'],
-                self.__jfk_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__jfk_coord['latitude'],
-                self.__jfk_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
-
-        self.__train_df['ewr_dist'] = self.__train_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__ewr_coord['latitude'],
-                self.__ewr_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__ewr_coord['latitude'],
-                self.__ewr_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
-        self.__test_df['ewr_dist'] = self.__test_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__ewr_coord['latitude'],
-                self.__ewr_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__ewr_coord['latitude'],
-                self.__ewr_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
-
-        self.__train_df['lga_dist'] = self.__train_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__lga_coord['latitude'],
-                self.__lga_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__lga_coord['latitude'],
-                self.__lga_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
-        self.__test_df['lga_dist'] = self.__test_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__lga_coord['latitude'],
-                self.__lga_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__lga_coord['latitude'],
-                self.__lga_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
-
-        self.__train_df['liberty_dist'] = self.__train_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__liberty_statue_coord['latitude'],
-                self.__liberty_statue_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__liberty_statue_coord['latitude'],
-                self.__liberty_statue_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
-        self.__test_df['liberty_dist'] = self.__test_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__liberty_statue_coord['latitude'],
-                self.__liberty_statue_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__liberty_statue_coord['latitude'],
-                self.__liberty_statue_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
+        self.__train_df = self.__parse_coordinate_frame(self.__train_df)
+        self.__test_df = self.__parse_coordinate_frame(self.__test_df)
+        self.__log_memory_per_row()
 
-        self.__train_df['nyc_dist'] = self.__train_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__nyc_coord['latitude'],
-                self.__nyc_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__nyc_coord['latitude'],
-                self.__nyc_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
-        self.__test_df['nyc_dist'] = self.__test_df.apply(
-            lambda x:
-            self.__get_sphere_distance(
-                x['pickup_latitude'],
-                x['pickup_longitude'],
-                self.__nyc_coord['latitude'],
-                self.__nyc_coord['longitude']) +
-            self.__get_sphere_distance(
-                self.__nyc_coord['latitude'],
-                self.__nyc_coord['longitude'],
-                x['dropoff_latitude'],
-                x['dropoff_longitude']),
-            axis=1)
+    def __parse_coordinate_frame(self, data_frame):
+        data_frame = append_coordinate_features(data_frame, self.__landmark_engine, self.__geofence, self.__radius_earth)
+        return self.__narrow_data_frame(data_frame)
 
-    def __get_haversine_distance(self, data_frame):
-        return 2 * self.__radius_earth * np.arcsin(np.sqrt(np.sin(data_frame['latitude_delta'] / 2) ** 2 + np.cos(data_frame['pickup_latitude']) * np.cos(data_frame['dropoff_latitude']) * np.sin(data_frame['longitude_delta'] / 2) ** 2))
-
-    def __get_bearing_distance(self, data_frame):
-        return np.arctan2(np.sin(-data_frame['longitude_delta'] * np.cos(data_frame['dropoff_latitude'])),
-                          np.cos(data_frame['pickup_latitude'] * np.sin(data_frame['dropoff_latitude'])) - np.sin(data_frame['pickup_latitude']) * np.cos(data_frame['dropoff_latitude']) * np.cos(-data_frame['longitude_delta']))
-
-    def __get_sphere_distance(self, pickup_latitude, pickup_longitude, dropoff_latitude, dropoff_longitude):
-        lat_delta = dropoff_latitude - pickup_latitude
-        lon_delta = dropoff_longitude - pickup_longitude
-
-        return 2 * self.__radius_earth * np.arcsin(np.sqrt(np.sin(lat_delta / 2) ** 2 + np.cos(pickup_latitude) * np.cos(dropoff_latitude) * np.sin(lon_delta / 2) ** 2))
-
-    def __convert_degree_to_raidus(self, series):
-        return series / 180 * np.pi
-
-    def __point_is_in_region(self, x, y, path):
-        return path.contains_point([x, y])
-
-    def __coordinate_is_in_mahattan(self, data_frame):
-        data_frame['pickup_mha'] = np.vectorize(self.__point_is_in_region)(
-            data_frame['pickup_latitude'],
-            data_frame['pickup_longitude'],
-            self.__manhattan_path)
-        data_frame['dropoff_mha'] = np.vectorize(self.__point_is_in_region)(
-            data_frame['dropoff_latitude'],
-            data_frame['dropoff_longitude'],
-            self.__manhattan_path)
-        data_frame['mha_flag'] = data_frame['pickup_mha'] & data_frame['dropoff_mha']
-
-        data_frame['pickup_mha'] = data_frame['pickup_mha'].astype(int)
-        data_frame['dropoff_mha'] = data_frame['dropoff_mha'].astype(int)
-        data_frame['mha_flag'] = data_frame['mha_flag'].astype(int)
+    def __narrow_data_frame(self, data_frame, exclude=()):
+        if self.__narrow_dtypes:
+            data_frame = narrow_data_frame(data_frame, exclude=exclude)
         return data_frame
 
+    def __log_memory_per_row(self):
+        if self.__narrow_dtypes:
+            logging.debug('%.1f bytes per training row', get_memory_per_row(self.__train_df))
+
     def clean_outlier(self):
         '''
         0 - reserved
         1 - fare_amount outlier
         2 - coordinate outlier
         3 - passenger_count outlier
+        a record breaking several rules gets the highest flag
         :return:
         '''
-        self.__train_df['reserved_flag'] = 0
+        self.__train_df, rejection_counts = self.__clean_outlier_frame(self.__train_df)
+        log_rejection_counts(rejection_counts, self.__train_df.shape[0])
+        self.__log_memory_per_row()
+
+    def __clean_outlier_frame(self, data_frame):
+        data_frame, rejection_counts = self.__outlier_rule_set.apply(data_frame)
+        return self.__narrow_data_frame(data_frame, exclude=COORDINATE_COLUMNS), rejection_counts
 
-        self.__train_df.loc[~(self.__train_df['fare_amount'].between(2.5, 500)), 'reserved_flag'] = 1
-        self.__train_df.loc[~(self.__train_df['pickup_latitude'].between(35, 45)), 'reserved_flag'] = 2
-        self.__train_df.loc[~(self.__train_df['pickup_longitude'].between(-80, -70)), 'reserved_flag'] = 2
-        self.__train_df.loc[~(self.__train_df['dropoff_latitude'].between(35, 45)), 'reserved_flag'] = 2
-        self.__train_df.loc[~(self.__train_df['dropoff_longitude'].between(-80, -70)), 'reserved_flag'] = 2
-        self.__train_df.loc[~(self.__train_df['passenger_count'].between(0, 9)), 'reserved_flag'] = 3
+    def __get_cleaned_path(self, data_path):
+        return self.__processing_data_dir / f'cleaned_{data_path.stem}.feather'
 
     def save_dataset(self):
         logging.debug('save_dataset')
-        train_stem = self.__train_data_path.stem
-        converted_train_filename = f'cleaned_{train_stem}.feather'
-        converted_train_path = self.__processing_data_dir / converted_train_filename
+        converted_train_path = self.__get_cleaned_path(self.__train_data_path)
         logging.debug(f'saving {converted_train_path}')
         self.__train_df.to_feather(converted_train_path)
         logging.debug('done!')
 
-        test_stem = self.__test_data_path.stem
-        converted_test_filename = f'cleaned_{test_stem}.feather'
-        converted_test_path = self.__processing_data_dir / converted_test_filename
+        converted_test_path = self.__get_cleaned_path(self.__test_data_path)
         logging.debug(f'saving {converted_test_path}')
         self.__test_df.to_feather(converted_test_path)
         logging.debug('done!')
@@ -397,6 +218,16 @@ if __name__ == '__main__':
     arg_parser.add_argument('--log_file',
                             type=str,
                             default=None)
+    arg_parser.add_argument('--narrow_dtypes',
+                            action='store_true')
+    arg_parser.add_argument('--nrows',
+                            type=int,
+                            default=None)
+    arg_parser.add_argument('--streaming',
+                            action='store_true')
+    arg_parser.add_argument('--batch_size',
+                            type=int,
+                            default=1_000_000)
     FLAGS, _ = arg_parser.parse_known_args()
 
     PRJ_DIR = Path(FLAGS.prj_dir)
@@ -425,10 +256,17 @@ if __name__ == '__main__':
     logging.debug(f'LOG_FILE_PATH: {LOG_FILE_PATH}')
 
     data_cleaner = DataCleaner(DATA_DIR, RAW_DATA_DIR, PROCESSING_DATA_DIR,
-                               TRAINING_DATA_DIR, TRAIN_DATA_PATH, TEST_DATA_PATH)
-    # data_cleaner.load_dataset(nrows=100)
-    data_cleaner.load_dataset()
-    data_cleaner.clean_outlier()
-    data_cleaner.parse_datetime()
-    data_cleaner.parse_coordinate()
-    data_cleaner.save_dataset()
+                               TRAINING_DATA_DIR, TRAIN_DATA_PATH, TEST_DATA_PATH, FLAGS.narrow_dtypes)
+    if FLAGS.streaming:
+        # all rows by default, only one batch is held in memory
+        data_cleaner.clean_dataset_by_batches(FLAGS.batch_size, FLAGS.nrows)
+    else:
+        # data_cleaner.load_dataset(nrows=100)
+        if FLAGS.nrows is None:
+            data_cleaner.load_dataset()
+        else:
+            data_cleaner.load_dataset(nrows=FLAGS.nrows)
+        data_cleaner.clean_outlier()
+        data_cleaner.parse_datetime()
+        data_cleaner.parse_coordinate()
+        data_cleaner.save_dataset()
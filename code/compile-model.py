@@ -0,0 +1,82 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+import datetime as dt
+from model_training import compile_model
+from prediction import load_booster
+
+if __name__ == '__main__':
+    # compile models trained before save_model wrote `xgb_<md5>.model.npz`, and optionally compare the
+    # compiled model against Booster.predict on the rows of a feather file
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--prj_dir',
+                            type=str,
+                            default='../')
+    arg_parser.add_argument('--data_dir',
+                            type=str,
+                            default='data')
+    arg_parser.add_argument('--model_dir',
+                            type=str,
+                            default='model')
+    arg_parser.add_argument('--train_data_dir',
+                            type=str,
+                            default='data-for-training')
+    arg_parser.add_argument('--model_md5',
+                            type=str,
+                            nargs='+',
+                            default=['d15b9ea9c10a60b1693411d8335eb1ea'])
+    arg_parser.add_argument('--check_filename',
+                            type=str,
+                            default=None)
+    arg_parser.add_argument('--check_rows',
+                            type=int,
+                            default=100000)
+    arg_parser.add_argument('--tolerance',
+                            type=float,
+                            default=1e-4)
+    arg_parser.add_argument('--log_filename',
+                            type=str,
+                            default=None)
+    FLAGS, _ = arg_parser.parse_known_args()
+
+    model_dir = os.path.join(FLAGS.prj_dir, FLAGS.model_dir)
+    train_data_dir = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.train_data_dir)
+
+    LOG_FORMAT = '[%(asctime)s] [%(lineno)d] [%(levelname)s] %(message)s'
+    if FLAGS.log_filename is not None:
+        LOG_FILE_PATH = os.path.join(model_dir, FLAGS.log_filename)
+    else:
+        LOG_FILE_PATH = None
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=LOG_FILE_PATH)
+
+    check_df = None
+    if FLAGS.check_filename is not None:
+        check_df = pd.read_feather(os.path.join(train_data_dir, FLAGS.check_filename)).head(FLAGS.check_rows)
+
+    passed = True
+    for model_md5 in FLAGS.model_md5:
+        booster = load_booster(model_dir, model_md5)
+        model_compiled_path = os.path.join(model_dir, 'xgb_' + model_md5 + '.model.npz')
+        tree_ensemble = compile_model(booster, model_compiled_path)
+        logging.debug('save model: %s, %d trees', model_compiled_path, tree_ensemble.get_tree_num())
+
+        if check_df is None:
+            continue
+        features = check_df[tree_ensemble.get_feature_names()].values.astype(np.float32)
+        start_time = dt.datetime.now()
+        expected = booster.predict(xgb.DMatrix(check_df[tree_ensemble.get_feature_names()]))
+        booster_elapsed = dt.datetime.now() - start_time
+        start_time = dt.datetime.now()
+        prediction = tree_ensemble.predict(features)
+        compiled_elapsed = dt.datetime.now() - start_time
+        difference = np.abs(prediction - expected).max()
+        logging.debug('%s: %d rows, max difference %g, Booster.predict %s, compiled %s',
+                      model_md5, features.shape[0], difference, booster_elapsed, compiled_elapsed)
+        if difference > FLAGS.tolerance:
+            passed = False
+    sys.exit(0 if passed else 1)
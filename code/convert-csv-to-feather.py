@@ -3,6 +3,8 @@ import os
 import pandas as pd
 import logging
 import argparse
+from dataset_io import COLUMNS_TYPE
+from trip_key import encode_key_column
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
@@ -33,19 +35,11 @@ if __name__ == '__main__':
     train_feature_path = os.path.join(FLAGS.data_path, FLAGS.output_dir, train_filename_org+'.feather')
     test_feature_path = os.path.join(FLAGS.data_path, FLAGS.output_dir, test_filename_org+'.feather')
 
-    columns_type = {
-        'key': 'str',
-        'fare_amount': 'float32',
-        'pickup_datetime': 'str',
-        'pickup_longitude': 'float32',
-        'pickup_latitude': 'float32',
-        'dropoff_longitude': 'float32',
-        'dropoff_latitude': 'float32',
-        'passenger_count': 'uint8'
-    }
+    columns_type = dict(COLUMNS_TYPE)
     columns_key = columns_type.keys()
 
     train_df = pd.read_csv(train_csv_path, usecols=columns_key, dtype=columns_type)
+    train_df = encode_key_column(train_df)
     logging.debug(train_df.head())
     logging.debug(train_df.info())
     train_df.to_feather(train_feature_path)
@@ -55,6 +49,7 @@ if __name__ == '__main__':
     columns_key = columns_type.keys()
 
     test_df = pd.read_csv(test_csv_path, usecols=columns_key, dtype=columns_type)
+    test_df = encode_key_column(test_df)
     logging.debug(test_df.head())
     logging.debug(test_df.info())
     test_df.to_feather(test_feature_path)
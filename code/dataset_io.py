@@ -0,0 +1,322 @@
+# -*- coding:utf-8 -*-
+import os
+import pytz
+import shutil
+import hashlib
+import functools
+import pyarrow as pa
+import datetime as dt
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pa_compute
+import pyarrow.dataset as pa_dataset
+import pyarrow.feather as pa_feather
+from datetime_features import LOCAL_TIMEZONE
+from trip_key import encode_keys
+
+RAW_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+
+# pandas dtypes of the raw csv columns
+COLUMNS_TYPE = {
+    'key': 'str',
+    'fare_amount': 'float32',
+    'pickup_datetime': 'str',
+    'pickup_longitude': 'float32',
+    'pickup_latitude': 'float32',
+    'dropoff_longitude': 'float32',
+    'dropoff_latitude': 'float32',
+    'passenger_count': 'uint8'
+}
+
+# hive partitions of the cleaned parquet datasets, pickup_year=<year>/pickup_month=<month> (local time)
+PARTITION_COLUMNS = ['pickup_year', 'pickup_month']
+
+# underscore prefixed paths are skipped by the dataset readers
+PARQUET_CHUNK_MARKER_DIR = '_chunks'
+
+FINGERPRINT_BLOCK_SIZE = 8 << 20
+
+# the same schema for the arrow csv reader, `pickup_datetime` is parsed into a timestamp at ingest,
+# `key` is encoded into int64 afterwards, see encode_raw_batch_key
+ARROW_COLUMNS_TYPE = {
+    'key': pa.string(),
+    'fare_amount': pa.float32(),
+    'pickup_datetime': pa.timestamp('s'),
+    'pickup_longitude': pa.float32(),
+    'pickup_latitude': pa.float32(),
+    'dropoff_longitude': pa.float32(),
+    'dropoff_latitude': pa.float32(),
+    'passenger_count': pa.uint8()
+}
+
+# the raw columns in the dtypes pandas.read_csv gives them, for the features computed from float64 coordinates
+ARROW_FLOAT64_COLUMNS_TYPE = dict(ARROW_COLUMNS_TYPE,
+                                  fare_amount=pa.float64(),
+                                  pickup_longitude=pa.float64(),
+                                  pickup_latitude=pa.float64(),
+                                  dropoff_longitude=pa.float64(),
+                                  dropoff_latitude=pa.float64(),
+                                  passenger_count=pa.int64())
+
+
+def open_raw_csv(csv_path, block_size=64 << 20, use_threads=True, column_types=ARROW_COLUMNS_TYPE):
+    '''
+    open the raw train / test csv as a stream of typed record batches, every block of
+    `block_size` bytes is parsed and converted by the arrow thread pool
+    '''
+    read_options = pa_csv.ReadOptions(use_threads=use_threads, block_size=block_size)
+    convert_options = pa_csv.ConvertOptions(column_types=column_types,
+                                            timestamp_parsers=[RAW_DATETIME_FORMAT])
+    return pa_csv.open_csv(csv_path, read_options=read_options, convert_options=convert_options)
+
+
+def localize_raw_batch(record_batch):
+    '''
+    mark the naive `pickup_datetime` timestamps of a raw batch as UTC
+    '''
+    index = record_batch.schema.get_field_index('pickup_datetime')
+    if index < 0:
+        return record_batch
+    pickup_datetime = pa_compute.assume_timezone(record_batch.column(index), 'UTC')
+    columns = list(record_batch.columns)
+    columns[index] = pickup_datetime
+    return pa.RecordBatch.from_arrays(columns, names=record_batch.schema.names)
+
+
+def encode_raw_batch_key(record_batch):
+    '''
+    replace the `key` strings of a raw batch by their int64 codes (trip_key.encode_keys)
+    '''
+    index = record_batch.schema.get_field_index('key')
+    if index < 0:
+        return record_batch
+    columns = list(record_batch.columns)
+    columns[index] = pa.array(encode_keys(columns[index].to_numpy(zero_copy_only=False)), type=pa.int64())
+    return pa.RecordBatch.from_arrays(columns, names=record_batch.schema.names)
+
+
+def iter_raw_csv_chunks(csv_path, chunk_size, block_size=64 << 20, use_threads=True,
+                        column_types=ARROW_COLUMNS_TYPE, nrows=None):
+    '''
+    :param nrows: only the first `nrows` rows are read, None for all of them
+    :return: generator of arrow tables holding `chunk_size` rows each (the last one may be shorter)
+    '''
+    reader = open_raw_csv(csv_path, block_size=block_size, use_threads=use_threads, column_types=column_types)
+    pending_batches = []
+    pending_rows = 0
+    read_rows = 0
+    for record_batch in reader:
+        if nrows is not None:
+            if read_rows >= nrows:
+                break
+            record_batch = record_batch.slice(0, nrows - read_rows)
+        read_rows += record_batch.num_rows
+        record_batch = encode_raw_batch_key(localize_raw_batch(record_batch))
+        while pending_rows + record_batch.num_rows >= chunk_size:
+            head_rows = chunk_size - pending_rows
+            pending_batches.append(record_batch.slice(0, head_rows))
+            yield pa.Table.from_batches(pending_batches)
+            record_batch = record_batch.slice(head_rows)
+            pending_batches = []
+            pending_rows = 0
+        if record_batch.num_rows > 0:
+            pending_batches.append(record_batch)
+            pending_rows += record_batch.num_rows
+    if pending_rows > 0:
+        yield pa.Table.from_batches(pending_batches)
+
+
+def get_file_fingerprint(file_path, line_num=None):
+    '''
+    md5 of the file content, a file written again with the same bytes keeps its fingerprint. with
+    `line_num` only the first `line_num` lines are read, e.g. the header and the rows of a `nrows` slice
+    of a csv file. the content is read once per path, size, modification time and line_num in a process
+    '''
+    file_stat = os.stat(file_path)
+    return _get_content_md5(os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns, line_num)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_content_md5(file_path, size, mtime_ns, line_num=None):
+    content_md5 = hashlib.md5()
+    with open(file_path, 'rb') as file_handler:
+        for block in iter(lambda: file_handler.read(FINGERPRINT_BLOCK_SIZE), b''):
+            if line_num is not None:
+                block_line_num = block.count(b'\n')
+                if block_line_num >= line_num:
+                    end = -1
+                    for _ in range(line_num):
+                        end = block.index(b'\n', end + 1)
+                    content_md5.update(block[:end + 1])
+                    break
+                line_num -= block_line_num
+            content_md5.update(block)
+    return content_md5.hexdigest()
+
+
+def get_feather_columns(file_path):
+    with pa.memory_map(str(file_path)) as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def read_feather_columns(file_path, columns=None):
+    '''
+    read a feather file through a memory map, only `columns` (None for all of them) are loaded,
+    every column becomes its own pandas block so numeric columns without nulls are not copied again
+    '''
+    table = pa_feather.read_table(str(file_path), columns=columns, memory_map=True)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def write_feather_table(table, file_path):
+    pa_feather.write_feather(table, file_path)
+
+
+def write_feather_tables(tables, file_path):
+    '''
+    append a stream of arrow tables to one feather file, so only one table is held in memory. every
+    table is cast to the schema of the first one, the file is written under a temporary name and
+    renamed at the end, an interrupted run leaves no partial file behind
+    :return: number of rows written
+    '''
+    temp_path = '%s.tmp' % (file_path,)
+    writer = None
+    schema = None
+    row_num = 0
+    try:
+        for table in tables:
+            if writer is None:
+                schema = table.schema
+                writer = pa.ipc.new_file(temp_path, schema, options=pa.ipc.IpcWriteOptions(compression='lz4'))
+            else:
+                table = table.cast(schema)
+            writer.write_table(table)
+            row_num += table.num_rows
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(temp_path)
+        raise
+    if writer is None:
+        raise ValueError('no table to write to %s' % (file_path,))
+    writer.close()
+    os.replace(temp_path, file_path)
+    return row_num
+
+
+def iter_feather_batches(file_path, batch_size, columns=None):
+    '''
+    read a feather (arrow ipc) file through a memory map, one record batch at a time
+    :param columns: names of the columns to materialize, None for all of them
+    :return: generator of record batches holding at most `batch_size` rows each
+    '''
+    with pa.memory_map(file_path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            record_batch = reader.get_batch(index)
+            if columns is not None:
+                record_batch = record_batch.select(columns)
+            for offset in range(0, record_batch.num_rows, batch_size):
+                yield record_batch.slice(offset, batch_size)
+
+
+def parquet_chunk_is_complete(dataset_dir, chunk_name):
+    return os.path.exists(os.path.join(dataset_dir, PARQUET_CHUNK_MARKER_DIR, chunk_name))
+
+
+def write_parquet_chunk(table, dataset_dir, chunk_name, max_rows_per_group=1_000_000):
+    '''
+    add the rows of one chunk to the partitioned parquet dataset `dataset_dir` as
+    `pickup_year=<y>/pickup_month=<m>/<chunk_name>-<i>.parquet`. the files are written to a hidden
+    directory first and moved into the partitions afterwards, the chunk is marked complete at last.
+    files of a previous run of the same chunk are removed first, so a chunk can be written again
+    '''
+    marker_path = os.path.join(dataset_dir, PARQUET_CHUNK_MARKER_DIR, chunk_name)
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+    for root, _, files in os.walk(dataset_dir):
+        for file in files:
+            if file.startswith(chunk_name + '-') and file.endswith('.parquet'):
+                os.remove(os.path.join(root, file))
+
+    temp_dir = os.path.join(dataset_dir, '.%s.tmp' % (chunk_name,))
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    pa_dataset.write_dataset(table, temp_dir, format='parquet',
+                             partitioning=PARTITION_COLUMNS, partitioning_flavor='hive',
+                             basename_template=chunk_name + '-{i}.parquet',
+                             max_rows_per_group=max_rows_per_group)
+    for root, _, files in os.walk(temp_dir):
+        partition_dir = os.path.join(dataset_dir, os.path.relpath(root, temp_dir))
+        for file in files:
+            os.makedirs(partition_dir, exist_ok=True)
+            os.replace(os.path.join(root, file), os.path.join(partition_dir, file))
+    shutil.rmtree(temp_dir)
+
+    os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+    with open(marker_path, 'w') as marker_file:
+        marker_file.write('%d\n' % (table.num_rows,))
+
+
+def open_partitioned_parquet(dataset_dir):
+    return pa_dataset.dataset(dataset_dir, format='parquet', partitioning='hive')
+
+
+def get_missing_columns(dataset, columns):
+    '''
+    the dataset schema is the one of its first file, a file written by an older cleaning script would
+    only yield nulls for the columns it lacks, so the schema of every file is checked
+    :return: dict file path -> the `columns` neither in the file nor in the partitioning
+    '''
+    partition_columns = set(dataset.partitioning.schema.names) if dataset.partitioning is not None else set()
+    missing_columns = dict()
+    for fragment in dataset.get_fragments():
+        fragment_columns = set(fragment.physical_schema.names) | partition_columns
+        missing = [column for column in columns if column not in fragment_columns]
+        if missing:
+            missing_columns[fragment.path] = missing
+    return missing_columns
+
+
+def get_time_range_filter(dataset, start_datetime=None, end_datetime=None, datetime_column='pickup_datetime_utc'):
+    '''
+    :param start_datetime: first pickup time kept, naive means UTC
+    :param end_datetime: pickup times up to this one (excluded) are kept
+    :return: filter expression on the partition columns (which skips whole partitions) and on the
+             pickup time (which skips row groups by their statistics), None without time range
+    '''
+    local_timezone = pytz.timezone(LOCAL_TIMEZONE)
+    datetime_type = dataset.schema.field(datetime_column).type
+    year = pa_dataset.field('pickup_year')
+    month = pa_dataset.field('pickup_month')
+    expression = None
+    if start_datetime is not None:
+        start_datetime = _as_utc_datetime(start_datetime)
+        start_local = start_datetime.astimezone(local_timezone)
+        expression = ((year > start_local.year) | ((year == start_local.year) & (month >= start_local.month))) & \
+            (pa_dataset.field(datetime_column) >= pa.scalar(start_datetime, type=datetime_type))
+    if end_datetime is not None:
+        end_datetime = _as_utc_datetime(end_datetime)
+        end_local = end_datetime.astimezone(local_timezone)
+        end_expression = ((year < end_local.year) | ((year == end_local.year) & (month <= end_local.month))) & \
+            (pa_dataset.field(datetime_column) < pa.scalar(end_datetime, type=datetime_type))
+        expression = end_expression if expression is None else expression & end_expression
+    return expression
+
+
+def read_partitioned_parquet(dataset_dir, columns=None, start_datetime=None, end_datetime=None, max_drop_flag=None):
+    '''
+    load the rows of a partitioned parquet dataset in [start_datetime, end_datetime) with
+    `drop_flag <= max_drop_flag`, the filters are pushed down to the partitions and row groups
+    '''
+    dataset = open_partitioned_parquet(dataset_dir)
+    expression = get_time_range_filter(dataset, start_datetime, end_datetime)
+    if max_drop_flag is not None:
+        drop_flag_expression = pa_dataset.field('drop_flag') <= max_drop_flag
+        expression = drop_flag_expression if expression is None else expression & drop_flag_expression
+    table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _as_utc_datetime(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=dt.timezone.utc)
+    return value.astimezone(dt.timezone.utc)
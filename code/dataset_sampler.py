@@ -0,0 +1,215 @@
+# -*- coding:utf-8 -*-
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pa_compute
+from datetime_features import LOCAL_TIMEZONE
+from geofence import AIRPORT_BOXES, get_new_york_geofence
+
+ALLOCATIONS = ['proportional', 'equal']
+
+
+def get_year_month_strata(table, datetime_column='pickup_datetime'):
+    '''
+    :return: int64 array, `year * 100 + month` of the local pickup time, 0 for a missing time
+    '''
+    datetime_type = table.schema.field(datetime_column).type
+    local_datetime = table.column(datetime_column).cast(pa.timestamp(datetime_type.unit, tz=LOCAL_TIMEZONE))
+    strata = pa_compute.add(pa_compute.multiply(pa_compute.year(local_datetime), 100),
+                            pa_compute.month(local_datetime))
+    return strata.fill_null(0).to_numpy().astype(np.int64)
+
+
+class AirportStrata(object):
+    '''
+    1 for the trips with the pickup or the dropoff in one of the AIRPORT_BOXES, 0 for the others
+    '''
+
+    def __init__(self):
+        self.__geofence = get_new_york_geofence()
+        self.__airport_ids = [self.__geofence.get_zone_id(name) for name, _, _ in AIRPORT_BOXES]
+
+    def __call__(self, table):
+        strata = np.zeros(table.num_rows, dtype=np.int64)
+        for prefix in ['pickup', 'dropoff']:
+            zone_ids = self.__geofence.locate(_get_float_column(table, prefix + '_longitude'),
+                                              _get_float_column(table, prefix + '_latitude'))
+            strata[np.isin(zone_ids, self.__airport_ids)] = 1
+        return strata
+
+
+def _get_float_column(table, column):
+    return table.column(column).cast(pa.float64()).fill_null(np.nan).to_numpy()
+
+
+class ReservoirSampler(object):
+    '''
+    one streaming pass over tables of trips, the sample has at most `sample_size` rows and is split over the
+    strata by `allocation`: 'proportional' to the rows seen per stratum or 'equal' (strata with too few rows
+    give all of them, the rest goes to the others). every row gets a uniform random key from the seeded
+    generator in input order and a stratum gives the rows with its smallest keys, so the sample only depends
+    on the rows, their order and the seed, not on how they were split into tables.
+    'proportional' keeps the rows with the smallest keys of all strata, `oversample` more than `sample_size`
+    so the largest remainder quotas can be met. a stratum short of rows there (only likely for tiny strata)
+    gives what it has and the sample is topped up with the next smallest keys, with a warning.
+    'equal' keeps per stratum at most the largest quota the stratum can still get.
+    tables are buffered and only compacted when twice the kept rows are buffered, so memory stays bounded by
+    about twice the reservoir whatever the number of rows
+    '''
+
+    def __init__(self, sample_size, seed=0, allocation='proportional', oversample=0.05):
+        if allocation not in ALLOCATIONS:
+            raise ValueError('unknown allocation %s' % (allocation,))
+        self.__sample_size = sample_size
+        self.__allocation = allocation
+        self.__reservoir_size = sample_size + max(1000, int(np.ceil(sample_size * oversample)))
+        self.__random_state = np.random.default_rng(seed)
+        self.__row_num = 0
+        self.__stratum_counts = dict()
+        # candidate rows, compacted into the first entry of every list
+        self.__tables = []
+        self.__keys = []
+        self.__strata = []
+        self.__ordinals = []
+        self.__buffered_row_num = 0
+        # rows with a key above the threshold of their stratum (of all strata for 'proportional') can not enter
+        self.__full_strata = np.empty(0, dtype=np.int64)
+        self.__thresholds = np.empty(0, dtype=np.float64)
+        self.__threshold = np.inf
+
+    def add(self, table, strata=None):
+        '''
+        :param strata: int64 array, the stratum of every row, None puts all rows into stratum 0
+        '''
+        row_num = table.num_rows
+        keys = self.__random_state.random(row_num)
+        ordinals = np.arange(self.__row_num, self.__row_num + row_num, dtype=np.int64)
+        self.__row_num += row_num
+        if strata is None:
+            strata = np.zeros(row_num, dtype=np.int64)
+        for stratum, count in zip(*np.unique(strata, return_counts=True)):
+            self.__stratum_counts[int(stratum)] = self.__stratum_counts.get(int(stratum), 0) + int(count)
+
+        selected = np.flatnonzero(keys < self.__get_thresholds(strata))
+        if selected.shape[0] == 0:
+            return self
+        self.__tables.append(table.take(pa.array(selected)))
+        self.__keys.append(keys[selected])
+        self.__strata.append(strata[selected])
+        self.__ordinals.append(ordinals[selected])
+        self.__buffered_row_num += selected.shape[0]
+        if self.__buffered_row_num > 2 * self.__get_capacity():
+            self.__compact()
+        return self
+
+    def __get_thresholds(self, strata):
+        if self.__allocation == 'proportional':
+            return np.full(strata.shape[0], self.__threshold)
+        thresholds = np.full(strata.shape[0], np.inf)
+        if self.__full_strata.shape[0] > 0:
+            positions = np.minimum(np.searchsorted(self.__full_strata, strata), self.__full_strata.shape[0] - 1)
+            is_full = self.__full_strata[positions] == strata
+            thresholds[is_full] = self.__thresholds[positions[is_full]]
+        return thresholds
+
+    def __get_stratum_cap(self):
+        # the largest quota can only shrink as rows and strata are added, +1 for the integer division
+        if sum(self.__stratum_counts.values()) <= self.__sample_size:
+            return self.__sample_size
+        return max(self.get_quotas().values()) + 1
+
+    def __get_capacity(self):
+        if self.__allocation == 'proportional':
+            return self.__reservoir_size
+        return self.__get_stratum_cap() * len(self.__stratum_counts)
+
+    def __compact(self):
+        table = pa.concat_tables(self.__tables)
+        keys = np.concatenate(self.__keys)
+        strata = np.concatenate(self.__strata)
+        ordinals = np.concatenate(self.__ordinals)
+        if self.__allocation == 'proportional':
+            kept = np.argsort(keys, kind='stable')[:self.__reservoir_size]
+            if kept.shape[0] == self.__reservoir_size:
+                self.__threshold = keys[kept[-1]]
+        else:
+            cap = self.__get_stratum_cap()
+            order = np.lexsort((keys, strata))
+            kept = order[self.__get_ranks_in_strata(strata[order]) < cap]
+            kept_strata = strata[kept]
+            last_in_stratum = np.append(kept_strata[1:] != kept_strata[:-1], True)
+            is_full = last_in_stratum & (self.__get_ranks_in_strata(kept_strata) == cap - 1)
+            self.__full_strata = kept_strata[is_full]
+            self.__thresholds = keys[kept][is_full]
+        self.__tables = [table.take(pa.array(kept))]
+        self.__keys = [keys[kept]]
+        self.__strata = [strata[kept]]
+        self.__ordinals = [ordinals[kept]]
+        self.__buffered_row_num = kept.shape[0]
+
+    @staticmethod
+    def __get_ranks_in_strata(sorted_strata):
+        positions = np.arange(sorted_strata.shape[0])
+        is_first = np.append(True, sorted_strata[1:] != sorted_strata[:-1])
+        return positions - np.maximum.accumulate(np.where(is_first, positions, 0))
+
+    def get_stratum_counts(self):
+        '''
+        :return: dict stratum -> rows seen
+        '''
+        return dict(sorted(self.__stratum_counts.items()))
+
+    def get_quotas(self):
+        '''
+        :return: dict stratum -> rows in the sample
+        '''
+        counts = self.get_stratum_counts()
+        total = sum(counts.values())
+        if total <= self.__sample_size:
+            return counts
+        quotas = dict()
+        if self.__allocation == 'proportional':
+            # largest remainder
+            shares = {stratum: self.__sample_size * count / total for stratum, count in counts.items()}
+            for stratum, share in shares.items():
+                quotas[stratum] = int(np.floor(share))
+            remainders = sorted(shares, key=lambda stratum: quotas[stratum] - shares[stratum])
+            for stratum in remainders[:self.__sample_size - sum(quotas.values())]:
+                quotas[stratum] += 1
+        else:
+            remaining = self.__sample_size
+            strata = sorted(counts, key=lambda stratum: counts[stratum])
+            for index, stratum in enumerate(strata):
+                quotas[stratum] = min(counts[stratum], remaining // (len(strata) - index))
+                remaining -= quotas[stratum]
+        return dict(sorted(quotas.items()))
+
+    def get_sample(self):
+        '''
+        :return: arrow table of the sampled rows in input order
+        '''
+        if len(self.__tables) == 0:
+            return None
+        self.__compact()
+        keys, strata, ordinals = self.__keys[0], self.__strata[0], self.__ordinals[0]
+        quotas = self.get_quotas()
+        quota_strata = np.array(list(quotas.keys()), dtype=np.int64)
+        quota_values = np.array(list(quotas.values()), dtype=np.int64)
+        order = np.lexsort((keys, strata))
+        strata_quotas = quota_values[np.searchsorted(quota_strata, strata[order])]
+        is_selected = np.zeros(keys.shape[0], dtype=bool)
+        is_selected[order[self.__get_ranks_in_strata(strata[order]) < strata_quotas]] = True
+        shortage = min(self.__sample_size, sum(quotas.values())) - int(is_selected.sum())
+        if shortage > 0:
+            logging.warning('%d rows short of the stratum quotas, topped up with the smallest keys of the '
+                            'other strata, raise the oversample', shortage)
+            rest = np.flatnonzero(~is_selected)
+            is_selected[rest[np.argsort(keys[rest], kind='stable')[:shortage]]] = True
+        selected = np.flatnonzero(is_selected)
+        selected = selected[np.argsort(ordinals[selected], kind='stable')]
+        return self.__tables[0].take(pa.array(selected))
+
+    def log_summary(self):
+        quotas = self.get_quotas()
+        for stratum, count in self.get_stratum_counts().items():
+            logging.debug('stratum %d: %d of %d rows', stratum, quotas[stratum], count)
@@ -0,0 +1,62 @@
+# -*- coding:utf-8 -*-
+import numpy as np
+import pandas as pd
+from feature_dtypes import CALENDAR_DTYPES
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+LOCAL_TIMEZONE = 'US/Eastern'
+
+
+def parse_utc_datetime(series):
+    '''
+    parse the raw `pickup_datetime` column as a whole into a tz-aware UTC column,
+    accepts raw strings ('2009-06-15 17:26:21 UTC') as well as naive or tz-aware timestamps
+    '''
+    if pd.api.types.is_datetime64_any_dtype(series):
+        if getattr(series.dt, 'tz', None) is None:
+            return series.dt.tz_localize('UTC')
+        return series.dt.tz_convert('UTC')
+    return pd.to_datetime(series, format=DATETIME_FORMAT, utc=True)
+
+
+def decompose_local_datetime(local_values):
+    '''
+    :param local_values: naive datetime64 array holding the local wall-clock time
+    :return: dict of integer arrays, the calendar fields of every element
+    '''
+    local_values = np.asarray(local_values, dtype='datetime64[ns]')
+    years = local_values.astype('datetime64[Y]')
+    months = local_values.astype('datetime64[M]')
+    days = local_values.astype('datetime64[D]')
+
+    seconds_in_day = (local_values - days).astype('timedelta64[s]').astype(np.int64)
+    return {
+        'year': years.astype(np.int64) + 1970,
+        'month': (months - years.astype('datetime64[M]')).astype(np.int64) + 1,
+        'day': (days - months.astype('datetime64[D]')).astype(np.int64) + 1,
+        'hour': seconds_in_day // 3600,
+        'minute': seconds_in_day // 60 % 60,
+        'second': seconds_in_day % 60,
+        # 1970-01-01 is a Thursday, Monday == 0 as in datetime.weekday()
+        'weekday': (days.astype(np.int64) + 3) % 7,
+        'days_in_year': (days - years.astype('datetime64[D]')).astype(np.int64),
+        'seconds_in_day': seconds_in_day,
+    }
+
+
+def extract_datetime_fields(data_frame, datetime_column='pickup_datetime', prefix='pickup', narrow_dtypes=False):
+    '''
+    add `<prefix>_datetime_utc`, `<prefix>_datetime_local` and the integer calendar columns
+    `<prefix>_year`, `_month`, `_day`, `_hour`, `_minute`, `_second`, `_weekday`,
+    `_days_in_year`, `_seconds_in_day` (all computed on the US/Eastern local time),
+    int64 or the CALENDAR_DTYPES with `narrow_dtypes`
+    '''
+    datetime_utc = parse_utc_datetime(data_frame[datetime_column])
+    datetime_local = datetime_utc.dt.tz_convert(LOCAL_TIMEZONE)
+    data_frame[f'{prefix}_datetime_utc'] = datetime_utc
+    data_frame[f'{prefix}_datetime_local'] = datetime_local
+
+    fields = decompose_local_datetime(datetime_local.dt.tz_localize(None).values)
+    for name, values in fields.items():
+        data_frame[f'{prefix}_{name}'] = values.astype(CALENDAR_DTYPES[name]) if narrow_dtypes else values
+    return data_frame
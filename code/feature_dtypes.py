@@ -0,0 +1,84 @@
+# -*- coding:utf-8 -*-
+import logging
+import numpy as np
+
+# calendar fields of datetime_features.decompose_local_datetime
+CALENDAR_DTYPES = {
+    'year': np.uint16,
+    'month': np.uint8,
+    'day': np.uint8,
+    'hour': np.uint8,
+    'minute': np.uint8,
+    'second': np.uint8,
+    'weekday': np.uint8,
+    'days_in_year': np.uint16,
+    'seconds_in_day': np.int32,
+}
+
+# columns of the cleaned and training frames in narrow dtype mode (--narrow_dtypes), xgboost reads the
+# features as float32 anyway, coordinates and distances lose nothing the model would have seen
+NARROW_DTYPES = {
+    'fare_amount': np.float32,
+    'pickup_longitude': np.float32,
+    'pickup_latitude': np.float32,
+    'dropoff_longitude': np.float32,
+    'dropoff_latitude': np.float32,
+    'passenger_count': np.uint8,
+    'pickup_days_sin': np.float32,
+    'pickup_days_cos': np.float32,
+    'pickup_seconds_sin': np.float32,
+    'pickup_seconds_cos': np.float32,
+    'pickup_weekday_sin': np.float32,
+    'pickup_weekday_cos': np.float32,
+    'pickup_time_class': np.uint8,
+    'pickup_is_weekend': np.uint8,
+    'pickup_is_night': np.uint8,
+    'pickup_is_rush_hour': np.uint8,
+    'is_order_cancelled': np.uint8,
+    'airport_jfk': np.uint8,
+    'airport_lga': np.uint8,
+    'airport_ewr': np.uint8,
+    'pickup_mha': np.uint8,
+    'dropoff_mha': np.uint8,
+    'mha_flag': np.uint8,
+    'drop_flag': np.int8,
+    'reserved_flag': np.uint8,
+    'longitude_delta': np.float32,
+    'latitude_delta': np.float32,
+    'haver_dist': np.float32,
+    'bear_dist': np.float32,
+    'pickup_dropoff_distance': np.float32,
+    'jfk_dist': np.float32,
+    'ewr_dist': np.float32,
+    'lga_dist': np.float32,
+    'liberty_dist': np.float32,
+    'nyc_dist': np.float32,
+}
+NARROW_DTYPES.update({'pickup_' + name: dtype for name, dtype in CALENDAR_DTYPES.items()})
+
+# deltas and distances of nearby points lose most of their digits when computed from float32 coordinates,
+# the coordinates stay float64 until the coordinate features are computed
+COORDINATE_COLUMNS = ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']
+
+
+def narrow_data_frame(data_frame, dtypes=NARROW_DTYPES, exclude=()):
+    '''
+    cast the columns of `dtypes` found in `data_frame` except `exclude`, a column which should become
+    an integer one but holds NaN, fractions or values out of the range of the narrow dtype keeps its dtype
+    '''
+    for column, dtype in dtypes.items():
+        if column in exclude or column not in data_frame.columns or data_frame[column].dtype == dtype:
+            continue
+        values = data_frame[column].values
+        if np.issubdtype(dtype, np.integer) and values.shape[0] > 0:
+            # NaN != floor(NaN) as well
+            if (values.dtype.kind == 'f' and (values != np.floor(values)).any()) or \
+                    values.min() < np.iinfo(dtype).min or values.max() > np.iinfo(dtype).max:
+                logging.debug('keep %s as %s, its values do not fit %s', column, values.dtype, np.dtype(dtype))
+                continue
+        data_frame[column] = values.astype(dtype)
+    return data_frame
+
+
+def get_memory_per_row(data_frame):
+    return data_frame.memory_usage(index=False, deep=True).sum() / max(data_frame.shape[0], 1)
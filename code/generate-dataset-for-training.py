@@ -4,6 +4,21 @@ import re
 import logging
 import argparse
 import pandas as pd
+import datetime as dt
+from dataset_io import get_feather_columns, read_feather_columns, open_partitioned_parquet, read_partitioned_parquet, \
+    get_missing_columns
+from category_vocabulary import CategoryVocabulary, CATEGORICAL_COLUMNS, VOCABULARY_FILENAME
+
+FEATURE_COLUMNS = ['key', 'pickup_longitude', 'pickup_latitude',
+                   'dropoff_longitude', 'dropoff_latitude', 'passenger_count',
+                   'pickup_year', 'pickup_days_sin',
+                   'pickup_days_cos', 'pickup_seconds_sin', 'pickup_seconds_cos',
+                   'pickup_weekday_sin', 'pickup_weekday_cos', 'pickup_time_class',
+                   'haver_dist', 'bear_dist', 'mha_flag',
+                   'jfk_dist', 'ewr_dist', 'lga_dist', 'liberty_dist', 'nyc_dist']
+
+# columns read besides the features, used by drop_outlier_records
+FLAG_COLUMNS = ['fare_amount', 'reserved_flag', 'drop_flag']
 
 
 def get_cleaned_file_list(directory, input_is_feather):
@@ -20,41 +35,92 @@ def get_cleaned_file_list(directory, input_is_feather):
     return data_file_list
 
 
-def get_data_frame(file_path, input_is_feather):
+def get_data_frame(file_path, input_is_feather, columns=FEATURE_COLUMNS + FLAG_COLUMNS):
+    '''
+    load only the feature and flag columns, the cleaned files hold many intermediate ones
+    '''
     if input_is_feather:
-        df = pd.read_feather(file_path)
+        file_columns = get_feather_columns(file_path)
+        df = read_feather_columns(file_path, [column for column in columns if column in file_columns])
     else:
-        df = pd.read_csv(file_path)
+        df = pd.read_csv(file_path, usecols=lambda column: column in columns)
     return df
 
 
-def select_feature_columns(data_frame):
-    columns_to_keep = ['key', 'pickup_longitude', 'pickup_latitude',
-                       'dropoff_longitude', 'dropoff_latitude', 'passenger_count',
-                       'pickup_year', 'pickup_days_sin',
-                       'pickup_days_cos', 'pickup_seconds_sin', 'pickup_seconds_cos',
-                       'pickup_weekday_sin', 'pickup_weekday_cos', 'pickup_time_class',
-                       'haver_dist', 'bear_dist', 'mha_flag',
-                       'jfk_dist', 'ewr_dist', 'lga_dist', 'liberty_dist', 'nyc_dist']
+def get_parquet_data_frame(dataset_dir, start_datetime=None, end_datetime=None, max_drop_flag=None):
+    '''
+    load the feature and flag columns of the pickups in [start_datetime, end_datetime), only the
+    partitions and row groups which may hold such rows are read
+    '''
+    dataset = open_partitioned_parquet(dataset_dir)
+    required_columns = FEATURE_COLUMNS if max_drop_flag is None else FEATURE_COLUMNS + ['drop_flag']
+    missing_columns = get_missing_columns(dataset, required_columns)
+    if missing_columns:
+        path, columns = next(iter(missing_columns.items()))
+        raise ValueError('%d files of %s miss feature columns, e.g. %s has no %s, clean the chunks again with '
+                         '--overwrite' % (len(missing_columns), dataset_dir, path, ', '.join(columns)))
+    dataset_columns = dataset.schema.names
+    return read_partitioned_parquet(dataset_dir,
+                                    [column for column in FEATURE_COLUMNS + FLAG_COLUMNS if column in dataset_columns],
+                                    start_datetime, end_datetime, max_drop_flag)
+
+
+def check_feature_columns(columns, source):
+    '''
+    raise ValueError when `columns` miss any of FEATURE_COLUMNS, e.g. a file of an older cleaning script
+    '''
+    missing_columns = [column for column in FEATURE_COLUMNS if column not in columns]
+    if missing_columns:
+        raise ValueError('%s has no feature column %s' % (source, ', '.join(missing_columns)))
+
+
+def select_feature_columns(data_frame, source='data frame'):
+    check_feature_columns(data_frame.columns, source)
+    columns_to_keep = list(FEATURE_COLUMNS)
     if 'fare_amount'in data_frame.columns:
         columns_to_keep.append('fare_amount')
-    data_frame = data_frame.filter(columns_to_keep)
+    data_frame = data_frame[columns_to_keep]
     return data_frame
 
 
 def drop_outlier_records(data_frame):
-    data_frame = data_frame[data_frame['reserved_flag'] == 0]
+    if 'reserved_flag' in data_frame.columns:
+        data_frame = data_frame[data_frame['reserved_flag'] == 0]
+    if 'drop_flag' in data_frame.columns:
+        # DROP_FLAG_DEFAULT (0) and DROP_FLAG_SELECTED (-1) are kept
+        data_frame = data_frame[data_frame['drop_flag'] <= 0]
     return data_frame
 
 
-def process_dummy_feature(train_df, test_df):
-    merged_df = pd.concat([train_df, test_df], ignore_index=True, copy=False, sort=False)
-
-    dummy_columns = ['pickup_year', 'pickup_time_class']
-    merged_df = pd.get_dummies(merged_df, columns=dummy_columns)
-    train_df = merged_df[merged_df['key'].isin(train_df['key'])]
-    test_df = merged_df[merged_df['key'].isin(test_df['key'])]
-    return train_df, test_df
+def get_category_vocabulary(vocabulary_path, train_data_frame_list, load_existing=False):
+    '''
+    learn the vocabulary from the training frames (a generator of frames works, one chunk at a time) and
+    save it at `vocabulary_path`. with `load_existing` a vocabulary already there is loaded instead
+    '''
+    if load_existing and os.path.exists(vocabulary_path):
+        logging.debug('load category vocabulary: %s', vocabulary_path)
+        return CategoryVocabulary.load(vocabulary_path)
+    vocabulary = CategoryVocabulary()
+    for data_frame in train_data_frame_list:
+        vocabulary.fit(data_frame)
+    vocabulary.save(vocabulary_path)
+    logging.debug('save category vocabulary: %s', vocabulary_path)
+    return vocabulary
+
+
+def encode_categories(vocabulary, data_frame, source, is_train):
+    '''
+    categories missing from the vocabulary are encoded as all zeros, which is an error for training data
+    (the vocabulary was learned from other data) and only logged for test data
+    '''
+    unknown_counts = vocabulary.get_unknown_counts(data_frame)
+    if unknown_counts:
+        message = '%s has categories missing from the vocabulary: %s' % (
+            source, ', '.join('%s (%d rows)' % (column, count) for column, count in unknown_counts.items()))
+        if is_train:
+            raise ValueError(message + ', the vocabulary must be learned from these rows or a superset of them')
+        logging.warning(message)
+    return vocabulary.transform(data_frame)
 
 
 def write_data_frame(data_frame, file_path, output_is_feather):
@@ -88,6 +154,17 @@ if __name__ == '__main__':
     arg_parser.add_argument('--log_filename',
                             type=str,
                             default=None)
+    arg_parser.add_argument('--by_chunks',
+                            action='store_true')
+    arg_parser.add_argument('--start_date',
+                            type=str,
+                            default=None)
+    arg_parser.add_argument('--end_date',
+                            type=str,
+                            default=None)
+    arg_parser.add_argument('--vocabulary_path',
+                            type=str,
+                            default=None)
     FLAGS, _ = arg_parser.parse_known_args()
 
     train_data_dir = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.train_data_dir)
@@ -106,27 +183,69 @@ if __name__ == '__main__':
     logging.debug('INPUT_FORMATION_IS_FEATHER=%s', INPUT_FORMATION_IS_FEATHER)
     logging.debug('OUTPUT_FORMATION_IS_FEATHER=%s', OUTPUT_FORMATION_IS_FEATHER)
 
-    df_for_train = pd.read_feather(os.path.join(process_data_dir, 'cleaned_train.feather'))
-    df_for_test = pd.read_feather(os.path.join(process_data_dir, 'cleaned_test.feather'))
-
-    logging.debug(df_for_train.shape)
-    logging.debug(df_for_train.columns)
-    logging.debug(df_for_train.dtypes)
-
-    df_for_train = drop_outlier_records(df_for_train)
-    df_for_train = select_feature_columns(df_for_train)
-    df_for_test = select_feature_columns(df_for_test)
-    df_for_train, df_for_test = process_dummy_feature(df_for_train, df_for_test)
-
-    output_file_path = os.path.join(train_data_dir, 'cleaned_train.feather')
-    write_data_frame(df_for_train, output_file_path, OUTPUT_FORMATION_IS_FEATHER)
-    logging.debug('save file: %s', output_file_path)
-
-    output_file_path = os.path.join(train_data_dir, 'cleaned_test.feather')
-    write_data_frame(df_for_test, output_file_path, OUTPUT_FORMATION_IS_FEATHER)
-    logging.debug('save file: %s', output_file_path)
-
-    logging.debug(df_for_train.shape)
-    logging.debug(df_for_train.columns)
-    logging.debug(df_for_test.shape)
-    logging.debug(df_for_test.columns)
\ No newline at end of file
+    # the vocabulary is learned again from the training rows, unless --vocabulary_path names one to reuse,
+    # e.g. to give every time slice of the parquet dataset the same columns
+    if FLAGS.vocabulary_path is not None:
+        vocabulary_path = FLAGS.vocabulary_path
+    else:
+        vocabulary_path = os.path.join(train_data_dir, VOCABULARY_FILENAME)
+    LOAD_VOCABULARY = FLAGS.vocabulary_path is not None
+
+    if FLAGS.by_chunks:
+        # every cleaned chunk is turned into one training chunk on its own, see train-model.py --external_memory
+        chunk_files = [file for file in get_cleaned_file_list(process_data_dir, INPUT_FORMATION_IS_FEATHER)
+                       if 'chunk' in file or 'test' in file]
+        # the categories of all training chunks, only the categorical columns are read
+        vocabulary = get_category_vocabulary(
+            vocabulary_path,
+            (drop_outlier_records(get_data_frame(os.path.join(process_data_dir, file), INPUT_FORMATION_IS_FEATHER,
+                                                 CATEGORICAL_COLUMNS + FLAG_COLUMNS))
+             for file in chunk_files if 'test' not in file),
+            LOAD_VOCABULARY)
+        for file in chunk_files:
+            df = get_data_frame(os.path.join(process_data_dir, file), INPUT_FORMATION_IS_FEATHER)
+            if 'test' not in file:
+                df = drop_outlier_records(df)
+            df = select_feature_columns(df, file)
+            df = encode_categories(vocabulary, df, file, 'test' not in file)
+
+            output_file_path = os.path.join(train_data_dir, file)
+            write_data_frame(df, output_file_path, OUTPUT_FORMATION_IS_FEATHER)
+            logging.debug('save file: %s %s', output_file_path, df.shape)
+    else:
+        if FLAGS.input_data_formation == 'parquet':
+            # training rows in [start_date, end_date) UTC, see clean-dataset-by-chunks.py
+            start_datetime = None if FLAGS.start_date is None else dt.datetime.strptime(FLAGS.start_date, '%Y-%m-%d')
+            end_datetime = None if FLAGS.end_date is None else dt.datetime.strptime(FLAGS.end_date, '%Y-%m-%d')
+            # DROP_FLAG_DEFAULT (0) and DROP_FLAG_SELECTED (-1) are kept, as in drop_outlier_records
+            df_for_train = get_parquet_data_frame(os.path.join(process_data_dir, 'cleaned_train.parquet'),
+                                                  start_datetime, end_datetime, max_drop_flag=0)
+            df_for_test = get_parquet_data_frame(os.path.join(process_data_dir, 'cleaned_test.parquet'))
+        else:
+            df_for_train = get_data_frame(os.path.join(process_data_dir, 'cleaned_train.feather'), True)
+            df_for_test = get_data_frame(os.path.join(process_data_dir, 'cleaned_test.feather'), True)
+
+        logging.debug(df_for_train.shape)
+        logging.debug(df_for_train.columns)
+        logging.debug(df_for_train.dtypes)
+
+        df_for_train = drop_outlier_records(df_for_train)
+        df_for_train = select_feature_columns(df_for_train, 'cleaned train data')
+        df_for_test = select_feature_columns(df_for_test, 'cleaned test data')
+        # learned from the training rows only, the test rows are encoded on their own
+        vocabulary = get_category_vocabulary(vocabulary_path, [df_for_train], LOAD_VOCABULARY)
+        df_for_train = encode_categories(vocabulary, df_for_train, 'cleaned train data', True)
+        df_for_test = encode_categories(vocabulary, df_for_test, 'cleaned test data', False)
+
+        output_file_path = os.path.join(train_data_dir, 'cleaned_train.feather')
+        write_data_frame(df_for_train, output_file_path, OUTPUT_FORMATION_IS_FEATHER)
+        logging.debug('save file: %s', output_file_path)
+
+        output_file_path = os.path.join(train_data_dir, 'cleaned_test.feather')
+        write_data_frame(df_for_test, output_file_path, OUTPUT_FORMATION_IS_FEATHER)
+        logging.debug('save file: %s', output_file_path)
+
+        logging.debug(df_for_train.shape)
+        logging.debug(df_for_train.columns)
+        logging.debug(df_for_test.shape)
+        logging.debug(df_for_test.columns)
\ No newline at end of file
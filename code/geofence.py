@@ -0,0 +1,251 @@
+# -*- coding:utf-8 -*-
+import json
+import math
+import numpy as np
+
+# (latitude, longitude) vertices, the Manhattan region of DataCleaner
+MANHATTAN_POLYGON = [
+    [40.698, -74.019], [40.757, -74.014], [40.881745, -73.934875],
+    [40.872186, -73.909654], [40.834051, -73.934120], [40.809238, -73.933307],
+    [40.798337, -73.927591], [40.773668, -73.941674], [40.741346, -73.966607],
+    [40.707832, -73.974694]]
+
+# (name, (min longitude, max longitude), (min latitude, max latitude)) in degree
+AIRPORT_BOXES = [
+    # New York John F. Kennedy International Airport
+    ('jfk', (-73.7841, -73.7721), (40.6213, 40.6613)),
+    # LaGuardia Airport
+    ('lga', (-73.8870, -73.8580), (40.7680, 40.7800)),
+    # Newark Liberty International Airport
+    ('ewr', (-74.192, -74.172), (40.676, 40.708)),
+]
+
+OUTSIDE_ZONE = -1
+
+
+class GeofenceIndex(object):
+    '''
+    named zones, each made of one or more rings of (longitude, latitude) vertices in degree, a point is
+    in a zone when it is inside an odd number of its rings (even-odd rule, so holes are rings as well).
+    zone ids are the registration order, a point in several zones gets the smallest id.
+    the bounding box of all zones is cut into square cells of `cell_size` degree: a cell entirely inside
+    a zone answers for all its points, only the points of cells crossed by a zone border are tested
+    against the rings of those zones, so the cost grows with the border cells and not with the zones
+    '''
+
+    def __init__(self, cell_size=0.005):
+        self.__cell_size = float(cell_size)
+        self.__names = []
+        self.__rings = []
+        self.__index = None
+
+    def add_zone(self, name, rings):
+        '''
+        :param rings: list of rings, a ring is a list of (longitude, latitude) vertices
+        :return: zone id
+        '''
+        if name in self.__names:
+            raise ValueError(f'zone {name} is already registered')
+        rings = [np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings]
+        if len(rings) == 0 or any(ring.shape[0] < 3 for ring in rings):
+            raise ValueError(f'zone {name} needs rings of at least 3 vertices')
+        self.__names.append(name)
+        self.__rings.append(rings)
+        self.__index = None
+        return len(self.__names) - 1
+
+    def add_box(self, name, longitude_range, latitude_range):
+        (west, east), (south, north) = sorted(longitude_range), sorted(latitude_range)
+        return self.add_zone(name, [[(west, south), (east, south), (east, north), (west, north)]])
+
+    def get_zone_names(self):
+        return self.__names
+
+    def get_zone_id(self, name):
+        return self.__names.index(name)
+
+    def locate(self, longitude, latitude):
+        '''
+        :param longitude: array of longitudes in degree
+        :param latitude: array of latitudes in degree
+        :return: int32 array of zone ids, OUTSIDE_ZONE for the points in no zone (and NaN coordinates)
+        '''
+        index = self.__get_index()
+        longitude = np.asarray(longitude, dtype=np.float64)
+        latitude = np.asarray(latitude, dtype=np.float64)
+        zone = np.full(longitude.shape, OUTSIDE_ZONE, dtype=np.int32)
+        if index is None:
+            return zone
+
+        cell = self.__get_cell(index, longitude, latitude)
+        in_grid = np.flatnonzero(cell >= 0)
+        cell = cell[in_grid]
+        zone[in_grid] = index['cell_zone'][cell]
+
+        # (point, candidate zone) pairs of the points in border cells, ordered by decreasing zone id so the
+        # smallest containing zone is assigned last
+        starts, ends = index['candidate_offsets'][cell], index['candidate_offsets'][cell + 1]
+        counts = ends - starts
+        pair_point = np.repeat(in_grid, counts)
+        pair_candidate = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        pair_zone = index['candidates'][pair_candidate]
+        order = np.argsort(-pair_zone, kind='stable')
+        pair_point, pair_zone = pair_point[order], pair_zone[order]
+        bounds = np.flatnonzero(np.diff(pair_zone)) + 1
+        for points, zone_ids in zip(np.split(pair_point, bounds), np.split(pair_zone, bounds)):
+            if points.shape[0] == 0:
+                continue
+            inside = self.__points_are_in_zone(zone_ids[0], longitude[points], latitude[points])
+            zone[points[inside]] = zone_ids[0]
+        return zone
+
+    def locate_one(self, longitude, latitude):
+        '''
+        locate() for a single point in plain python
+        '''
+        index = self.__get_index()
+        if index is None:
+            return OUTSIDE_ZONE
+        column = (longitude - index['west']) / self.__cell_size
+        row = (latitude - index['south']) / self.__cell_size
+        if not (0 <= column < index['columns'] and 0 <= row < index['rows']):
+            return OUTSIDE_ZONE
+        cell = int(row) * index['columns'] + int(column)
+        start, end = index['candidate_offsets'][cell], index['candidate_offsets'][cell + 1]
+        for zone_id in sorted(index['candidates'][start:end].tolist()):
+            if self.__point_is_in_zone(zone_id, longitude, latitude):
+                return zone_id
+        return int(index['cell_zone'][cell])
+
+    def __get_cell(self, index, longitude, latitude):
+        column = np.floor((longitude - index['west']) / self.__cell_size)
+        row = np.floor((latitude - index['south']) / self.__cell_size)
+        in_grid = (column >= 0) & (column < index['columns']) & (row >= 0) & (row < index['rows'])
+        cell = np.full(longitude.shape, -1, dtype=np.int64)
+        cell[in_grid] = row[in_grid].astype(np.int64) * index['columns'] + column[in_grid].astype(np.int64)
+        return cell
+
+    def __get_index(self):
+        if self.__index is None and len(self.__names) > 0:
+            self.__index = self.__build_index()
+        return self.__index
+
+    def __build_index(self):
+        vertices = np.concatenate([ring for rings in self.__rings for ring in rings])
+        west, south = vertices.min(axis=0)
+        east, north = vertices.max(axis=0)
+        columns = int(math.floor((east - west) / self.__cell_size)) + 1
+        rows = int(math.floor((north - south) / self.__cell_size)) + 1
+
+        cell_zone = np.full(rows * columns, OUTSIDE_ZONE, dtype=np.int32)
+        border_cells = []
+        # from the largest zone id down, so a cell covered by several zones keeps the smallest one
+        for zone_id in reversed(range(len(self.__names))):
+            border = self.__get_border_cells(self.__rings[zone_id], west, south, columns, rows)
+            zone_vertices = np.concatenate(self.__rings[zone_id])
+            first_column, first_row = np.floor((zone_vertices.min(axis=0) - (west, south)) / self.__cell_size)
+            last_column, last_row = np.floor((zone_vertices.max(axis=0) - (west, south)) / self.__cell_size)
+            column, row = np.meshgrid(np.arange(int(first_column), min(int(last_column), columns - 1) + 1),
+                                      np.arange(int(first_row), min(int(last_row), rows - 1) + 1))
+            cell = (row * columns + column).ravel()
+            # a cell no border passes through is entirely inside or outside, its center tells which
+            cell = cell[~np.isin(cell, border)]
+            center_longitude = west + (cell % columns + 0.5) * self.__cell_size
+            center_latitude = south + (cell // columns + 0.5) * self.__cell_size
+            cell_zone[cell[self.__points_are_in_zone(zone_id, center_longitude, center_latitude)]] = zone_id
+            border_cells.append((zone_id, border))
+
+        # a border cell only needs the exact test for zones with a smaller id than the one covering it
+        candidate_cells, candidate_zones = [], []
+        for zone_id, border in border_cells:
+            covering_zone = cell_zone[border]
+            border = border[(covering_zone == OUTSIDE_ZONE) | (covering_zone > zone_id)]
+            candidate_cells.append(border)
+            candidate_zones.append(np.full(border.shape, zone_id, dtype=np.int32))
+        candidate_cells = np.concatenate(candidate_cells)
+        candidate_zones = np.concatenate(candidate_zones)
+        order = np.argsort(candidate_cells, kind='stable')
+        candidate_offsets = np.zeros(rows * columns + 1, dtype=np.int64)
+        np.cumsum(np.bincount(candidate_cells, minlength=rows * columns), out=candidate_offsets[1:])
+        return {'west': west, 'south': south, 'columns': columns, 'rows': rows, 'cell_zone': cell_zone,
+                'candidate_offsets': candidate_offsets, 'candidates': candidate_zones[order]}
+
+    def __get_border_cells(self, rings, west, south, columns, rows):
+        '''
+        :return: sorted cell numbers of the cells crossed by any edge of the rings
+        '''
+        cells = set()
+        margin = 1e-9
+        for ring in rings:
+            x = (ring[:, 0] - west) / self.__cell_size
+            y = (ring[:, 1] - south) / self.__cell_size
+            for x1, y1, x2, y2 in zip(x, y, np.roll(x, -1), np.roll(y, -1)):
+                if x1 > x2:
+                    x1, y1, x2, y2 = x2, y2, x1, y1
+                first_column = max(int(math.floor(x1 - margin)), 0)
+                last_column = min(int(math.floor(x2 + margin)), columns - 1)
+                for column in range(first_column, last_column + 1):
+                    # the part of the edge inside this column of cells
+                    if x2 > x1:
+                        left, right = max(column, x1), min(column + 1, x2)
+                        y_left = y1 + (y2 - y1) * (left - x1) / (x2 - x1)
+                        y_right = y1 + (y2 - y1) * (right - x1) / (x2 - x1)
+                    else:
+                        y_left, y_right = y1, y2
+                    first_row = max(int(math.floor(min(y_left, y_right) - margin)), 0)
+                    last_row = min(int(math.floor(max(y_left, y_right) + margin)), rows - 1)
+                    cells.update(row * columns + column for row in range(first_row, last_row + 1))
+        return np.array(sorted(cells), dtype=np.int64)
+
+    def __points_are_in_zone(self, zone_id, longitude, latitude):
+        inside = np.zeros(longitude.shape, dtype=bool)
+        for ring in self.__rings[zone_id]:
+            x2, y2 = ring[-1]
+            for x1, y1 in ring:
+                if y1 != y2:
+                    crossing = (y1 > latitude) != (y2 > latitude)
+                    inside ^= crossing & (longitude < (x2 - x1) * (latitude - y1) / (y2 - y1) + x1)
+                x2, y2 = x1, y1
+        return inside
+
+    def __point_is_in_zone(self, zone_id, longitude, latitude):
+        inside = False
+        for ring in self.__rings[zone_id]:
+            x2, y2 = ring[-1]
+            for x1, y1 in ring.tolist():
+                if (y1 > latitude) != (y2 > latitude) and \
+                        longitude < (x2 - x1) * (latitude - y1) / (y2 - y1) + x1:
+                    inside = not inside
+                x2, y2 = x1, y1
+        return inside
+
+
+def read_geojson_zones(file_path, name_property='zone'):
+    '''
+    :param file_path: GeoJSON FeatureCollection of Polygon / MultiPolygon features, e.g. the NYC taxi zones
+    :return: list of (name, rings), ready for GeofenceIndex.add_zone()
+    '''
+    with open(file_path) as file:
+        collection = json.load(file)
+    zones = []
+    for feature in collection['features']:
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            rings = geometry['coordinates']
+        elif geometry['type'] == 'MultiPolygon':
+            rings = [ring for polygon in geometry['coordinates'] for ring in polygon]
+        else:
+            raise ValueError(f'unsupported geometry {geometry["type"]}')
+        zones.append((str(feature['properties'][name_property]), [[vertex[:2] for vertex in ring] for ring in rings]))
+    return zones
+
+
+def get_new_york_geofence(cell_size=0.005):
+    '''
+    :return: GeofenceIndex of the airports (ids in the order of AIRPORT_BOXES) and `manhattan`
+    '''
+    geofence = GeofenceIndex(cell_size)
+    for name, longitude_range, latitude_range in AIRPORT_BOXES:
+        geofence.add_box(name, longitude_range, latitude_range)
+    geofence.add_zone('manhattan', [[(longitude, latitude) for latitude, longitude in MANHATTAN_POLYGON]])
+    return geofence
@@ -0,0 +1,78 @@
+# -*- coding:utf-8 -*-
+import numpy as np
+
+RADIUS_EARTH = 6371
+
+
+class LandmarkDistanceEngine(object):
+    '''
+    pickup -> landmark -> dropoff great-circle distances for a registry of landmarks,
+    computed over whole coordinate arrays (radians) instead of row by row.
+    '''
+
+    def __init__(self, radius_earth=RADIUS_EARTH, block_size=1_000_000):
+        self.__radius_earth = radius_earth
+        self.__block_size = block_size
+        self.__names = []
+        self.__longitudes = []
+        self.__latitudes = []
+
+    def register_landmark(self, name, longitude, latitude):
+        '''
+        :param name: column prefix, the distance column is named `<name>_dist`
+        :param longitude: landmark longitude in radians
+        :param latitude: landmark latitude in radians
+        :return:
+        '''
+        if name in self.__names:
+            raise ValueError(f'landmark {name} is already registered')
+        self.__names.append(name)
+        self.__longitudes.append(longitude)
+        self.__latitudes.append(latitude)
+
+    def get_column_names(self):
+        return [f'{name}_dist' for name in self.__names]
+
+    def compute(self, pickup_latitude, pickup_longitude, dropoff_latitude, dropoff_longitude):
+        '''
+        :return: array of shape (n_rows, n_landmarks), one column per registered landmark
+        '''
+        pickup_latitude = np.asarray(pickup_latitude, dtype=np.float64)
+        pickup_longitude = np.asarray(pickup_longitude, dtype=np.float64)
+        dropoff_latitude = np.asarray(dropoff_latitude, dtype=np.float64)
+        dropoff_longitude = np.asarray(dropoff_longitude, dtype=np.float64)
+
+        landmark_latitude = np.asarray(self.__latitudes, dtype=np.float64)
+        landmark_longitude = np.asarray(self.__longitudes, dtype=np.float64)
+        landmark_latitude_cos = np.cos(landmark_latitude)
+
+        n_rows = pickup_latitude.shape[0]
+        result = np.empty((n_rows, len(self.__names)), dtype=np.float64)
+        # rows are processed by blocks so the (rows x landmarks) temporaries stay bounded
+        for start in range(0, n_rows, self.__block_size):
+            stop = min(start + self.__block_size, n_rows)
+            result[start:stop] = \
+                self.__get_sphere_distance(pickup_latitude[start:stop, None],
+                                           pickup_longitude[start:stop, None],
+                                           landmark_latitude, landmark_longitude, landmark_latitude_cos) + \
+                self.__get_sphere_distance(dropoff_latitude[start:stop, None],
+                                           dropoff_longitude[start:stop, None],
+                                           landmark_latitude, landmark_longitude, landmark_latitude_cos)
+        return result
+
+    def append_distance_columns(self, data_frame):
+        distance = self.compute(data_frame['pickup_latitude'].values,
+                                data_frame['pickup_longitude'].values,
+                                data_frame['dropoff_latitude'].values,
+                                data_frame['dropoff_longitude'].values)
+        for index, column in enumerate(self.get_column_names()):
+            data_frame[column] = distance[:, index]
+        return data_frame
+
+    def __get_sphere_distance(self, latitude, longitude, landmark_latitude, landmark_longitude,
+                              landmark_latitude_cos):
+        lat_delta = landmark_latitude - latitude
+        lon_delta = landmark_longitude - longitude
+
+        return 2 * self.__radius_earth * np.arcsin(np.sqrt(
+            np.sin(lat_delta / 2) ** 2 + np.cos(latitude) * landmark_latitude_cos * np.sin(lon_delta / 2) ** 2))
@@ -1,8 +1,8 @@
 # -*- coding:utf-8 -*-
 import os
-import pandas as pd
 import logging
 import argparse
+from dataset_io import read_feather_columns
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
@@ -19,9 +19,13 @@ if __name__ == '__main__':
     arg_parser.add_argument('--test_data',
                             type=str,
                             default='test.feather')
+    arg_parser.add_argument('--columns',
+                            type=str,
+                            nargs='*',
+                            default=None)
     FLAGS, _ = arg_parser.parse_known_args()
 
     train_file_path = os.path.join(FLAGS.data_path, FLAGS.input_dir, FLAGS.train_data)
     logging.debug(train_file_path)
-    train_df = pd.read_feather(train_file_path)
+    train_df = read_feather_columns(train_file_path, FLAGS.columns)
     logging.debug(train_df.info())
\ No newline at end of file
@@ -0,0 +1,220 @@
+# -*- coding:utf-8 -*-
+import os
+import copy
+import json
+import fcntl
+import hashlib
+import itertools
+import shutil
+import logging
+import threading
+import numpy as np
+import xgboost as xgb
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.model_selection import KFold
+from tree_evaluator import parse_model_json
+
+HISTORY_FILENAME = 'history.records'
+
+# settings which only change how fast a model is trained, not the model itself
+IGNORED_MODEL_PARAMS = ['nthread', 'silent', 'verbosity']
+
+_history_lock = threading.Lock()
+# the folds of cross_validate are sliced from one DMatrix one at a time
+_dmatrix_slice_lock = threading.Lock()
+
+
+def load_parameters_from_json(model_param_path):
+    with open(model_param_path, 'r') as json_file:
+        param = json.load(json_file)
+    return param
+
+
+def get_model_md5(param, data_fingerprint, feature_columns, extra=None):
+    '''
+    content hash identifying a model: the parameters (without the settings that cannot change the
+    result, see IGNORED_MODEL_PARAMS), the training data fingerprint and the feature list
+    '''
+    model_param = {name: value for name, value in param['model_param'].items() if name not in IGNORED_MODEL_PARAMS}
+    identity = dict(param)
+    identity['model_param'] = model_param
+    content = json.dumps({'param': identity,
+                          'data': data_fingerprint,
+                          'features': list(feature_columns),
+                          'extra': extra}, sort_keys=True)
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def add_vocabulary_to_extra(extra, vocabulary_path):
+    '''
+    the same data encoded with another category vocabulary gives other one-hot columns, so the categories
+    are part of the model identity
+    :return: `extra` of get_model_md5 with the categories of `vocabulary_path`, unchanged without such a file
+    '''
+    if vocabulary_path is None or not os.path.exists(vocabulary_path):
+        return extra
+    with open(vocabulary_path, 'r') as json_file:
+        categories = json.load(json_file)
+    return dict(extra or dict(), vocabulary=categories)
+
+
+def archive_parameters(param, model_dir, json_md5_str):
+    '''
+    save the parameter set as `param_<md5>.json`, an existing archive is left untouched
+    '''
+    archive_json_path = os.path.join(model_dir, 'param_' + json_md5_str + '.json')
+    if not os.path.exists(archive_json_path):
+        with open(archive_json_path, 'w') as json_file:
+            json.dump(param, json_file, indent=2)
+    return archive_json_path
+
+
+def read_history_records(model_dir):
+    '''
+    :return: dict md5 -> local rmse of the latest record of every md5 in history.records
+    '''
+    history = dict()
+    log_file_path = os.path.join(model_dir, HISTORY_FILENAME)
+    if not os.path.exists(log_file_path):
+        return history
+    with open(log_file_path, 'r') as file_handler:
+        for line in file_handler:
+            fields = line.split()
+            # TIMESTAMP is written as `date time`
+            if len(fields) < 4:
+                continue
+            try:
+                history[fields[2]] = float(fields[3])
+            except ValueError:
+                continue
+    return history
+
+
+def model_exists(model_dir, json_md5_str):
+    return os.path.exists(os.path.join(model_dir, 'xgb_'+json_md5_str+'.model'))
+
+
+def expand_parameter_grid(base_param, grid):
+    '''
+    :param base_param: parameter set in the param.json layout
+    :param grid: candidate lists in the same layout, e.g. {"model_param": {"max_depth": [6, 8]}, "num_round": [300]}
+    :return: one parameter set per combination of the candidates
+    '''
+    keys = []
+    candidates = []
+    for section, value in grid.items():
+        if isinstance(value, dict):
+            for name, section_candidates in value.items():
+                keys.append((section, name))
+                candidates.append(section_candidates)
+        else:
+            keys.append((section, None))
+            candidates.append(value)
+
+    param_list = []
+    for combination in itertools.product(*candidates):
+        param = copy.deepcopy(base_param)
+        for (section, name), value in zip(keys, combination):
+            if name is None:
+                param[section] = value
+            else:
+                param[section][name] = value
+        param_list.append(param)
+    return param_list
+
+
+def write_history_to_file(model_dir, json_md5_str, result):
+    '''
+    append one record to history.records, safe for concurrent writers in this process (thread lock)
+    and in other processes (exclusive file lock), every record is written with a single write call
+    '''
+    log_file_path = os.path.join(model_dir, HISTORY_FILENAME)
+    content = '%s\t%s\t%f\n'%(dt.datetime.now(), json_md5_str, result)
+    with _history_lock:
+        with open(log_file_path, 'a') as file_handler:
+            fcntl.flock(file_handler, fcntl.LOCK_EX)
+            try:
+                file_handler.write(content)
+                file_handler.flush()
+            finally:
+                fcntl.flock(file_handler, fcntl.LOCK_UN)
+
+
+def train_model(param, train_data, validate_data, nthread=None, verbose_eval=True):
+    '''
+    :return: (booster, evals_result dict)
+    '''
+    model_param = dict(param['model_param'])
+    if nthread is not None:
+        model_param['nthread'] = nthread
+    progress_info = dict()
+    xgb_model = xgb.train(model_param,
+                          train_data,
+                          param['num_round'],
+                          [(validate_data, 'eval')],
+                          early_stopping_rounds=param['early_stop_rounds'],
+                          evals_result=progress_info,
+                          verbose_eval=verbose_eval)
+    return xgb_model, progress_info
+
+
+def train_fold(param, dataset, train_index, validate_index, nthread):
+    start_time = dt.datetime.now()
+    # slices only live while the fold is trained, each fold trains on DMatrix objects of its own
+    with _dmatrix_slice_lock:
+        train_data = dataset.slice(train_index)
+        validate_data = dataset.slice(validate_index)
+    _, progress_info = train_model(param, train_data, validate_data, nthread=nthread, verbose_eval=False)
+    return progress_info['eval']['rmse'][-1], dt.datetime.now() - start_time
+
+
+def cross_validate(param, dataset, fold_num=5, num_workers=1, nthread_budget=None):
+    '''
+    k-fold cross validation over one DMatrix, folds are selected by row index and trained
+    `num_workers` at a time, so peak memory grows with num_workers instead of fold_num. `dataset` itself is
+    only sliced, never trained on, so concurrent folds do not share the lazily built (and unlocked)
+    quantile / histogram index of a DMatrix, whatever the tree_method
+    :return: (mean rmse, std rmse, list of (rmse, elapsed time) per fold)
+    '''
+    if nthread_budget is None:
+        nthread_budget = os.cpu_count()
+    nthread = max(1, nthread_budget // num_workers)
+    k_fold = KFold(n_splits=fold_num, shuffle=True, random_state=param['model_param']['seed'])
+    fold_list = list(k_fold.split(np.arange(dataset.num_row())))
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        fold_result_list = list(executor.map(
+            lambda fold: train_fold(param, dataset, fold[0], fold[1], nthread), fold_list))
+    rmse_list = [rmse for rmse, _ in fold_result_list]
+    return float(np.mean(rmse_list)), float(np.std(rmse_list)), fold_result_list
+
+
+def compile_model(xgb_model, model_compiled_path):
+    '''
+    save the model in the array form of tree_evaluator.TreeEnsemble, the text dump is not used because
+    it drops the global bias and the threshold / default direction of indicator splits
+    '''
+    tree_ensemble = parse_model_json(json.loads(xgb_model.save_raw('json')))
+    tree_ensemble.save(model_compiled_path)
+    return tree_ensemble
+
+
+def save_model(xgb_model, model_dir, json_md5_str, vocabulary_path=None):
+    '''
+    :param vocabulary_path: category vocabulary of the training data, copied to `xgb_<md5>.vocabulary.json`
+    '''
+    model_path = os.path.join(model_dir, 'xgb_'+json_md5_str+'.model')
+    model_raw_path = os.path.join(model_dir, 'xgb_'+json_md5_str+'.model.raw.txt')
+    model_compiled_path = os.path.join(model_dir, 'xgb_'+json_md5_str+'.model.npz')
+    xgb_model.save_model(model_path)
+    xgb_model.dump_model(model_raw_path)
+    compile_model(xgb_model, model_compiled_path)
+    logging.debug('save model: %s', model_path)
+    logging.debug('save model: %s', model_raw_path)
+    logging.debug('save model: %s', model_compiled_path)
+    if vocabulary_path is not None and os.path.exists(vocabulary_path):
+        model_vocabulary_path = os.path.join(model_dir, 'xgb_'+json_md5_str+'.vocabulary.json')
+        shutil.copyfile(vocabulary_path, model_vocabulary_path)
+        logging.debug('save model: %s', model_vocabulary_path)
+    return model_path
@@ -1,10 +1,45 @@
 # -*- coding:utf-8 -*-
 import os
+import hashlib
 import logging
 import argparse
 import numpy as np
 import pandas as pd
 import xgboost as xgb
+import datetime as dt
+from dataset_io import iter_feather_batches, get_feather_columns, read_feather_columns
+from prediction import ModelRegistry, rank_models_by_rmse, get_inverse_rmse_weights
+from xgb_dataset import NON_FEATURE_COLUMNS
+from trip_key import decode_key_column
+
+
+def predict_by_batches(predict_function, feature_columns, test_file_path, submission_path, batch_size):
+    '''
+    score the test file batch by batch and append `key,fare_amount` rows to the submission,
+    only one batch is held in memory whatever the size of the input
+    :param predict_function: DataFrame of `feature_columns` -> predictions
+    :return: number of rows
+    '''
+    if feature_columns is None:
+        feature_columns = [column for column in get_feather_columns(test_file_path)
+                           if column not in NON_FEATURE_COLUMNS]
+
+    temp_submission_path = submission_path + '.tmp'
+    row_num = 0
+    start_time = dt.datetime.now()
+    with open(temp_submission_path, 'w') as submission_file:
+        submission_file.write('key,fare_amount\n')
+        for record_batch in iter_feather_batches(test_file_path, batch_size, columns=['key'] + feature_columns):
+            batch_df = record_batch.to_pandas()
+            prediction_result = predict_function(batch_df[feature_columns])
+            submission_df = pd.DataFrame({'key': batch_df['key'], 'fare_amount': prediction_result})
+            decode_key_column(submission_df).to_csv(submission_file, header=False, index=False)
+            row_num += batch_df.shape[0]
+            elapsed = (dt.datetime.now() - start_time).total_seconds()
+            logging.debug('%d rows predicted, %.0f rows/sec', row_num, row_num / max(elapsed, 1e-6))
+    os.replace(temp_submission_path, submission_path)
+    return row_num
+
 
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser()
@@ -29,6 +64,17 @@ if __name__ == '__main__':
     arg_parser.add_argument('--model_md5',
                             type=str,
                             default='d15b9ea9c10a60b1693411d8335eb1ea')
+    arg_parser.add_argument('--ensemble_size',
+                            type=int,
+                            default=0)
+    arg_parser.add_argument('--model_memory_mb',
+                            type=int,
+                            default=1024)
+    arg_parser.add_argument('--streaming',
+                            action='store_true')
+    arg_parser.add_argument('--batch_size',
+                            type=int,
+                            default=1_000_000)
     FLAGS, _ = arg_parser.parse_known_args()
 
     train_data_dir = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.train_data_dir)
@@ -42,26 +88,55 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=LOG_FILE_PATH)
 
     test_file_path = os.path.join(train_data_dir, FLAGS.test_data)
-    test_df = pd.read_feather(test_file_path)
-    test_df['fare_amount'] = np.nan
-    test_buffer = xgb.DMatrix(test_df.drop(['key', 'fare_amount'], axis=1))
 
     logging.debug('Loading model...')
-    model_filename = 'xgb_' + FLAGS.model_md5 + '.model'
-    model_path = os.path.join(model_dir, model_filename)
-    bst = xgb.Booster({'nthread': 12})
-    bst.load_model(model_path)
-    logging.debug('done!')
-
-    logging.debug('Predicting test dataset...')
-    prediction_result = bst.predict(test_buffer)
-    test_df.loc[:, 'fare_amount'] = prediction_result
+    if FLAGS.ensemble_size > 0:
+        # blend the best saved models of history.records, weighted by 1 / rmse
+        ranked_models = rank_models_by_rmse(model_dir, FLAGS.ensemble_size)
+        if len(ranked_models) == 0:
+            raise ValueError('no saved model in %s' % (model_dir,))
+        model_md5_list = [model_md5 for model_md5, _ in ranked_models]
+        weights = get_inverse_rmse_weights([rmse for _, rmse in ranked_models])
+        logging.debug('ensemble: %s', list(zip(model_md5_list, weights)))
+        model_registry = ModelRegistry(model_dir, FLAGS.model_memory_mb, nthread=12)
+        feature_columns = model_registry.get_feature_names(model_md5_list)
+        predict_function = lambda data_frame: model_registry.predict(data_frame, model_md5_list, weights)
+        submission_md5_str = 'ensemble_' + hashlib.md5(' '.join(model_md5_list).encode()).hexdigest()
+    else:
+        model_filename = 'xgb_' + FLAGS.model_md5 + '.model'
+        model_path = os.path.join(model_dir, model_filename)
+        bst = xgb.Booster({'nthread': 12})
+        bst.load_model(model_path)
+        feature_columns = bst.feature_names
+        predict_function = lambda data_frame: bst.inplace_predict(data_frame)
+        submission_md5_str = FLAGS.model_md5
     logging.debug('done!')
 
-    logging.debug('Saving submission file...')
-    submission_filename = 'submission_' + FLAGS.model_md5 + '.csv'
+    submission_filename = 'submission_' + submission_md5_str + '.csv'
     submission_path = os.path.join(train_data_dir, submission_filename)
-    test_df = test_df.filter(items=['key', 'fare_amount'])
-    test_df.to_csv(submission_path, index=False)
-    logging.debug('%s done!', submission_filename)
 
+    if FLAGS.streaming:
+        logging.debug('Predicting test dataset by batches of %d rows...', FLAGS.batch_size)
+        start_time = dt.datetime.now()
+        row_num = predict_by_batches(predict_function, feature_columns, test_file_path, submission_path,
+                                     FLAGS.batch_size)
+        elapsed = dt.datetime.now() - start_time
+        logging.debug('%s done! %d rows in %s, %.0f rows/sec', submission_filename, row_num, elapsed,
+                      row_num / max(elapsed.total_seconds(), 1e-6))
+    else:
+        if feature_columns is None:
+            test_df = read_feather_columns(test_file_path)
+        else:
+            test_df = read_feather_columns(test_file_path, ['key'] + feature_columns)
+        test_df['fare_amount'] = np.nan
+
+        logging.debug('Predicting test dataset...')
+        prediction_result = predict_function(test_df.drop(['key', 'fare_amount'], axis=1))
+        test_df.loc[:, 'fare_amount'] = prediction_result
+        logging.debug('done!')
+
+        logging.debug('Saving submission file...')
+        test_df = test_df.filter(items=['key', 'fare_amount'])
+        test_df = decode_key_column(test_df)
+        test_df.to_csv(submission_path, index=False)
+        logging.debug('%s done!', submission_filename)
@@ -0,0 +1,158 @@
+# -*- coding:utf-8 -*-
+import os
+import time
+import queue
+import logging
+import threading
+import collections
+import numpy as np
+import xgboost as xgb
+from concurrent.futures import Future
+from model_training import read_history_records, model_exists
+
+
+def load_booster(model_dir, model_md5, nthread=None):
+    model_path = os.path.join(model_dir, 'xgb_' + model_md5 + '.model')
+    booster = xgb.Booster({'nthread': nthread} if nthread is not None else None)
+    booster.load_model(model_path)
+    logging.debug('load model: %s', model_path)
+    return booster
+
+
+def rank_models_by_rmse(model_dir, top_n=None):
+    '''
+    :return: list of (md5, rmse) of the saved models in history.records, best first
+    '''
+    history = read_history_records(model_dir)
+    ranked = sorted([(md5, rmse) for md5, rmse in history.items() if model_exists(model_dir, md5)],
+                    key=lambda item: item[1])
+    return ranked if top_n is None else ranked[:top_n]
+
+
+def get_inverse_rmse_weights(rmse_list):
+    weights = 1 / np.asarray(rmse_list, dtype=np.float64)
+    return weights / weights.sum()
+
+
+class ModelRegistry(object):
+    '''
+    load Boosters on demand and keep the recently used ones resident, the least recently used
+    models are dropped once the model files held in memory exceed `memory_limit_mb`
+    '''
+
+    def __init__(self, model_dir, memory_limit_mb=1024, nthread=None):
+        self.__model_dir = model_dir
+        self.__memory_limit = memory_limit_mb << 20
+        self.__nthread = nthread
+        # md5 -> (booster, size in bytes), least recently used first
+        self.__boosters = collections.OrderedDict()
+        self.__memory_used = 0
+        self.__lock = threading.Lock()
+
+    def get_booster(self, model_md5):
+        with self.__lock:
+            if model_md5 in self.__boosters:
+                self.__boosters.move_to_end(model_md5)
+                return self.__boosters[model_md5][0]
+
+            booster = load_booster(self.__model_dir, model_md5, self.__nthread)
+            size = os.path.getsize(os.path.join(self.__model_dir, 'xgb_' + model_md5 + '.model'))
+            self.__boosters[model_md5] = (booster, size)
+            self.__memory_used += size
+            # the model just loaded always stays
+            while self.__memory_used > self.__memory_limit and len(self.__boosters) > 1:
+                evicted_md5, (_, evicted_size) = self.__boosters.popitem(last=False)
+                self.__memory_used -= evicted_size
+                logging.debug('evict model: %s', evicted_md5)
+            return booster
+
+    def get_loaded_models(self):
+        with self.__lock:
+            return list(self.__boosters.keys())
+
+    def get_feature_names(self, model_md5_list):
+        '''
+        :return: the feature names shared by every model of `model_md5_list`, models trained on another
+                 feature set or category vocabulary can not be blended and raise ValueError
+        '''
+        feature_names = self.get_booster(model_md5_list[0]).feature_names
+        for model_md5 in model_md5_list[1:]:
+            model_feature_names = self.get_booster(model_md5).feature_names
+            if model_feature_names != feature_names:
+                raise ValueError('model %s has other features than %s: %s missing, %s extra' % (
+                    model_md5, model_md5_list[0],
+                    [name for name in feature_names or [] if name not in (model_feature_names or [])],
+                    [name for name in model_feature_names or [] if name not in (feature_names or [])]))
+        return feature_names
+
+    def predict(self, features, model_md5_list, weights=None):
+        '''
+        score one feature matrix with every model of `model_md5_list`
+        :param features: 2-d array or DataFrame, shared by all the models
+        :param weights: one weight per model, equal weights by default
+        :return: float32 array, weighted average of the model predictions
+        '''
+        if not hasattr(features, 'columns'):
+            features = np.asarray(features, dtype=np.float32)
+        prediction_list = [self.get_booster(model_md5).inplace_predict(features) for model_md5 in model_md5_list]
+        return np.average(np.stack(prediction_list), axis=0, weights=weights).astype(np.float32)
+
+
+class MicroBatchPredictor(object):
+    '''
+    keep one Booster resident and group concurrent requests into small batches: rows submitted by
+    several threads are stacked and scored with one predict call, either when `max_batch_size` rows
+    are waiting or `max_wait_ms` after the first of them arrived
+    '''
+
+    def __init__(self, booster, max_batch_size=256, max_wait_ms=2):
+        self.__booster = booster
+        self.__feature_names = booster.feature_names
+        self.__max_batch_size = max_batch_size
+        self.__max_wait = max_wait_ms / 1000
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def get_feature_names(self):
+        return self.__feature_names
+
+    def submit(self, features):
+        '''
+        :param features: 2-d array, one row per trip, columns in the order of get_feature_names()
+        :return: Future of the predicted fares
+        '''
+        future = Future()
+        self.__queue.put((np.asarray(features, dtype=np.float32), future))
+        return future
+
+    def predict(self, features):
+        return self.submit(features).result()
+
+    def __run(self):
+        while True:
+            pending = [self.__queue.get()]
+            row_num = pending[0][0].shape[0]
+            # the batch is scored max_wait after its first request, however many requests arrive meanwhile
+            deadline = time.monotonic() + self.__max_wait
+            try:
+                while row_num < self.__max_batch_size:
+                    item = self.__queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    pending.append(item)
+                    row_num += item[0].shape[0]
+            except queue.Empty:
+                pass
+            self.__predict_batch(pending)
+
+    def __predict_batch(self, pending):
+        try:
+            features = np.concatenate([item[0] for item in pending], axis=0)
+            prediction = self.__booster.inplace_predict(features)
+        except Exception as exception:
+            for _, future in pending:
+                future.set_exception(exception)
+            return
+        offset = 0
+        for item_features, future in pending:
+            future.set_result(prediction[offset:offset + item_features.shape[0]])
+            offset += item_features.shape[0]
@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+import time
+import threading
+import collections
+import datetime as dt
+from datetime_features import DATETIME_FORMAT
+
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+class RoutePredictionCache(object):
+    '''
+    remember the fare predicted for a route: pickup / dropoff coordinates rounded to
+    `coordinate_precision` degree, pickup time floored to `time_bucket_minutes` and passenger count.
+    entries expire after `ttl_seconds`, the least recently used ones are dropped beyond `max_size`
+    '''
+
+    def __init__(self, coordinate_precision=0.001, time_bucket_minutes=60, ttl_seconds=600, max_size=100_000):
+        self.__coordinate_precision = coordinate_precision
+        self.__time_bucket_seconds = int(time_bucket_minutes * 60)
+        self.__ttl_seconds = ttl_seconds
+        self.__max_size = max_size
+        # key -> (prediction, expire time), least recently used first
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def get_key(self, pickup_datetime, pickup_longitude, pickup_latitude,
+                dropoff_longitude, dropoff_latitude, passenger_count, model_md5=None):
+        '''
+        :param pickup_datetime: raw string ('2009-06-15 17:26:21 UTC') or datetime, naive means UTC
+        '''
+        if isinstance(pickup_datetime, str):
+            pickup_datetime = dt.datetime.strptime(pickup_datetime, DATETIME_FORMAT)
+        elif pickup_datetime.tzinfo is not None:
+            pickup_datetime = pickup_datetime.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        time_bucket = int((pickup_datetime - EPOCH).total_seconds()) // self.__time_bucket_seconds
+        return (model_md5, time_bucket,
+                round(float(pickup_longitude) / self.__coordinate_precision),
+                round(float(pickup_latitude) / self.__coordinate_precision),
+                round(float(dropoff_longitude) / self.__coordinate_precision),
+                round(float(dropoff_latitude) / self.__coordinate_precision),
+                int(passenger_count))
+
+    def get(self, key):
+        '''
+        :return: the cached prediction, None if the route is unknown or expired
+        '''
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self.__entries[key]
+                self.__misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return entry[0]
+
+    def put(self, key, prediction):
+        with self.__lock:
+            self.__entries[key] = (prediction, time.monotonic() + self.__ttl_seconds)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+
+    def get_stats(self):
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {'size': len(self.__entries),
+                    'hits': self.__hits,
+                    'misses': self.__misses,
+                    'evictions': self.__evictions,
+                    'hit_rate': self.__hits / lookups if lookups > 0 else 0.0}
@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+import os
+import re
+import logging
+import argparse
+import datetime as dt
+import pyarrow as pa
+from dataset_io import iter_raw_csv_chunks, iter_feather_batches, write_feather_table
+from dataset_sampler import ALLOCATIONS, ReservoirSampler, AirportStrata, get_year_month_strata
+
+STRATIFICATIONS = ['none', 'year_month', 'airport']
+
+
+def iter_input_tables(input_path_list, batch_size, block_size):
+    for input_path in input_path_list:
+        logging.debug('sampling %s', input_path)
+        if input_path.endswith('.feather'):
+            for record_batch in iter_feather_batches(input_path, batch_size):
+                yield pa.Table.from_batches([record_batch])
+        else:
+            for table in iter_raw_csv_chunks(input_path, batch_size, block_size):
+                yield table
+
+
+if __name__ == '__main__':
+    # one streaming pass over the raw training csv or the chunk files of split-dataset-into-chunks.py,
+    # a uniform or stratified sample of the raw rows is written as feather for quick experiments
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--data_path',
+                            type=str,
+                            default='../data')
+    arg_parser.add_argument('--input_dir',
+                            type=str,
+                            default='raw-data')
+    arg_parser.add_argument('--output_dir',
+                            type=str,
+                            default='data-for-processing')
+    arg_parser.add_argument('--train_data',
+                            type=str,
+                            default='train.csv')
+    arg_parser.add_argument('--from_chunks',
+                            action='store_true',
+                            help='read the chunk_*_train files of output_dir instead of the raw csv')
+    arg_parser.add_argument('--sample_size',
+                            type=int,
+                            default=1_000_000)
+    arg_parser.add_argument('--stratify',
+                            type=str,
+                            choices=STRATIFICATIONS,
+                            default='none')
+    arg_parser.add_argument('--allocation',
+                            type=str,
+                            choices=ALLOCATIONS,
+                            default='proportional')
+    arg_parser.add_argument('--seed',
+                            type=int,
+                            default=0)
+    arg_parser.add_argument('--batch_size',
+                            type=int,
+                            default=1_000_000)
+    arg_parser.add_argument('--block_size',
+                            type=int,
+                            default=64 << 20)
+    arg_parser.add_argument('--output_filename',
+                            type=str,
+                            default=None)
+    FLAGS, _ = arg_parser.parse_known_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    output_data_dir = os.path.join(FLAGS.data_path, FLAGS.output_dir)
+    if FLAGS.from_chunks:
+        chunk_files = sorted(file for file in os.listdir(output_data_dir)
+                             if re.match(r'chunk_\d+_train\.(feather|csv)$', file) is not None)
+        input_path_list = [os.path.join(output_data_dir, file) for file in chunk_files]
+    else:
+        input_path_list = [os.path.join(FLAGS.data_path, FLAGS.input_dir, FLAGS.train_data)]
+    if FLAGS.output_filename is None:
+        output_filename = 'sample_%d_%s_%s_seed_%d.feather' % (FLAGS.sample_size, FLAGS.stratify,
+                                                              FLAGS.allocation, FLAGS.seed)
+    else:
+        output_filename = FLAGS.output_filename
+    output_file_path = os.path.join(output_data_dir, output_filename)
+    start_time = dt.datetime.now()
+
+    if FLAGS.stratify == 'year_month':
+        get_strata = get_year_month_strata
+    elif FLAGS.stratify == 'airport':
+        get_strata = AirportStrata()
+    else:
+        get_strata = None
+    sampler = ReservoirSampler(FLAGS.sample_size, FLAGS.seed, FLAGS.allocation)
+    for table in iter_input_tables(input_path_list, FLAGS.batch_size, FLAGS.block_size):
+        sampler.add(table, None if get_strata is None else get_strata(table))
+    sampler.log_summary()
+
+    sample_table = sampler.get_sample()
+    logging.debug('saving %d rows to %s', sample_table.num_rows, output_file_path)
+    write_feather_table(sample_table, output_file_path)
+    logging.debug('done in time %s' % (dt.datetime.now() - start_time,))
@@ -0,0 +1,177 @@
+# -*- coding:utf-8 -*-
+import os
+import json
+import logging
+import argparse
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prediction import load_booster, MicroBatchPredictor
+from trip_featurizer import TripFeaturizer
+from prediction_cache import RoutePredictionCache
+
+# fields of a raw trip record, turned into the model features by TripFeaturizer
+TRIP_FIELDS = ['pickup_datetime', 'pickup_longitude', 'pickup_latitude',
+               'dropoff_longitude', 'dropoff_latitude', 'passenger_count']
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    '''
+    POST /predict {"model_md5": "...", "records": [{"<feature>": value, ...}, ...]}
+    -> {"model_md5": "...", "fare_amount": [...]}, `model_md5` may be left out to use the default model.
+    a record is either the model features or a raw trip with the TRIP_FIELDS
+    ('pickup_datetime' as '2009-06-15 17:26:21 UTC', coordinates in degree), raw trips are answered
+    from `prediction_cache` when it is enabled
+    '''
+    predictors = dict()
+    featurizers = dict()
+    default_model_md5 = None
+    prediction_cache = None
+
+    def do_GET(self):
+        if self.path == '/health':
+            content = {'models': list(self.predictors.keys())}
+            if self.prediction_cache is not None:
+                content['cache'] = self.prediction_cache.get_stats()
+            self.__send_json(200, content)
+        else:
+            self.__send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.__send_json(404, {'error': 'not found'})
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(content_length))
+            model_md5 = request.get('model_md5', self.default_model_md5)
+            if model_md5 not in self.predictors:
+                self.__send_json(404, {'error': 'unknown model %s' % (model_md5,)})
+                return
+            predictor = self.predictors[model_md5]
+            records = request['records']
+            prediction = [None] * len(records)
+            cache_keys = [self.__get_cache_key(record, model_md5) for record in records]
+            for index, cache_key in enumerate(cache_keys):
+                if cache_key is not None:
+                    prediction[index] = self.prediction_cache.get(cache_key)
+            pending_index = [index for index, value in enumerate(prediction) if value is None]
+            features = [self.__get_features(records[index], predictor, self.featurizers.get(model_md5))
+                        for index in pending_index]
+            features = np.asarray(features, dtype=np.float32)
+            feature_num = len(predictor.get_feature_names())
+            if len(pending_index) > 0 and features.shape != (len(pending_index), feature_num):
+                raise ValueError('expected %d features per record, got shape %s' % (feature_num, features.shape))
+        except (ValueError, KeyError, TypeError) as exception:
+            self.__send_json(400, {'error': 'invalid request: %s' % (exception,)})
+            return
+
+        if len(pending_index) > 0:
+            try:
+                pending_prediction = predictor.predict(features).tolist()
+            except Exception as exception:
+                logging.exception('prediction of %d records failed', len(pending_index))
+                self.__send_json(500, {'error': 'prediction failed: %s' % (exception,)})
+                return
+            for index, value in zip(pending_index, pending_prediction):
+                prediction[index] = value
+                if cache_keys[index] is not None:
+                    self.prediction_cache.put(cache_keys[index], value)
+        self.__send_json(200, {'model_md5': model_md5, 'fare_amount': prediction})
+
+    def __get_cache_key(self, record, model_md5):
+        if self.prediction_cache is None or 'pickup_datetime' not in record:
+            return None
+        return self.prediction_cache.get_key(*[record[name] for name in TRIP_FIELDS], model_md5=model_md5)
+
+    def __get_features(self, record, predictor, featurizer):
+        if 'pickup_datetime' in record:
+            if featurizer is None:
+                raise ValueError('the model does not accept raw trips')
+            return featurizer.transform_one(*[record[name] for name in TRIP_FIELDS])
+        return [record[name] for name in predictor.get_feature_names()]
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+    def __send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--prj_dir',
+                            type=str,
+                            default='../')
+    arg_parser.add_argument('--model_dir',
+                            type=str,
+                            default='model')
+    arg_parser.add_argument('--model_md5',
+                            type=str,
+                            nargs='+',
+                            default=['d15b9ea9c10a60b1693411d8335eb1ea'])
+    arg_parser.add_argument('--host',
+                            type=str,
+                            default='127.0.0.1')
+    arg_parser.add_argument('--port',
+                            type=int,
+                            default=8000)
+    arg_parser.add_argument('--nthread',
+                            type=int,
+                            default=4)
+    arg_parser.add_argument('--max_batch_size',
+                            type=int,
+                            default=256)
+    arg_parser.add_argument('--max_wait_ms',
+                            type=float,
+                            default=2)
+    arg_parser.add_argument('--cache_size',
+                            type=int,
+                            default=0)
+    arg_parser.add_argument('--cache_coordinate_precision',
+                            type=float,
+                            default=0.001)
+    arg_parser.add_argument('--cache_time_bucket_minutes',
+                            type=float,
+                            default=60)
+    arg_parser.add_argument('--cache_ttl_seconds',
+                            type=float,
+                            default=600)
+    arg_parser.add_argument('--log_filename',
+                            type=str,
+                            default=None)
+    FLAGS, _ = arg_parser.parse_known_args()
+
+    model_dir = os.path.join(FLAGS.prj_dir, FLAGS.model_dir)
+
+    LOG_FORMAT = '[%(asctime)s] [%(lineno)d] [%(levelname)s] %(message)s'
+    if FLAGS.log_filename is not None:
+        LOG_FILE_PATH = os.path.join(model_dir, FLAGS.log_filename)
+    else:
+        LOG_FILE_PATH = None
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=LOG_FILE_PATH)
+
+    # every model is loaded once and stays resident for the lifetime of the server
+    for model_md5 in FLAGS.model_md5:
+        booster = load_booster(model_dir, model_md5, FLAGS.nthread)
+        PredictionRequestHandler.predictors[model_md5] = MicroBatchPredictor(booster,
+                                                                             FLAGS.max_batch_size,
+                                                                             FLAGS.max_wait_ms)
+        try:
+            PredictionRequestHandler.featurizers[model_md5] = TripFeaturizer(booster.feature_names)
+        except ValueError as exception:
+            logging.debug('%s accepts feature records only: %s', model_md5, exception)
+    PredictionRequestHandler.default_model_md5 = FLAGS.model_md5[0]
+    if FLAGS.cache_size > 0:
+        PredictionRequestHandler.prediction_cache = RoutePredictionCache(FLAGS.cache_coordinate_precision,
+                                                                         FLAGS.cache_time_bucket_minutes,
+                                                                         FLAGS.cache_ttl_seconds,
+                                                                         FLAGS.cache_size)
+
+    server = ThreadingHTTPServer((FLAGS.host, FLAGS.port), PredictionRequestHandler)
+    logging.debug('serving %s on %s:%d', FLAGS.model_md5, FLAGS.host, FLAGS.port)
+    server.serve_forever()
@@ -2,8 +2,11 @@
 import os
 import logging
 import argparse
+import numpy as np
 import pandas as pd
 import datetime as dt
+import pyarrow as pa
+from dataset_io import iter_raw_csv_chunks, write_feather_table
 
 
 if __name__ == '__main__':
@@ -30,6 +33,9 @@ if __name__ == '__main__':
     arg_parser.add_argument('--chunk_size',
                             type=int,
                             default=5000000)
+    arg_parser.add_argument('--block_size',
+                            type=int,
+                            default=64 << 20)
     FLAGS, _ = arg_parser.parse_known_args()
 
     raw_data_dir = os.path.join(FLAGS.data_path, FLAGS.input_dir)
@@ -38,32 +44,38 @@ if __name__ == '__main__':
     output_data_dir = os.path.join(FLAGS.data_path, FLAGS.output_dir)
     start_time = dt.datetime.now()
 
-    csv_reader = pd.read_csv(raw_data_path, chunksize=FLAGS.chunk_size)
-    for index, chunk_df in enumerate(csv_reader):
-        if FLAGS.output_data_formation == 'feather':
-            _, chunk_file_name = os.path.split(raw_data_path)
-            chunk_file_name_base, _ = os.path.splitext(chunk_file_name)
+    if FLAGS.output_data_formation == 'feather':
+        # typed, multi-threaded arrow ingestion, every chunk is written as soon as it is complete
+        _, chunk_file_name = os.path.split(raw_data_path)
+        chunk_file_name_base, _ = os.path.splitext(chunk_file_name)
+        row_offset = 0
+        for index, chunk_table in enumerate(iter_raw_csv_chunks(raw_data_path, FLAGS.chunk_size, FLAGS.block_size)):
             chunk_file_name = 'chunk_%03d_%s.feather'%(index, chunk_file_name_base)
-        else:
-            chunk_file_name = 'chunk_%03d_%s'%(index, FLAGS.train_data)
+            chunk_file_path = os.path.join(output_data_dir, chunk_file_name)
+            logging.debug('saving %s'%(chunk_file_name))
 
-        chunk_file_path = os.path.join(output_data_dir, chunk_file_name)
-        logging.debug('saving %s'%(chunk_file_name))
-
-        if FLAGS.output_data_formation == 'feather':
-            chunk_df = chunk_df.reset_index()
-            chunk_df.to_feather(chunk_file_path)
-        else:
+            row_index = pa.array(np.arange(row_offset, row_offset + chunk_table.num_rows, dtype=np.int64))
+            chunk_table = chunk_table.add_column(0, 'index', row_index)
+            write_feather_table(chunk_table, chunk_file_path)
+            row_offset += chunk_table.num_rows
+            end_time = dt.datetime.now()
+            logging.debug('done in time %s'%(end_time-start_time,))
+    else:
+        csv_reader = pd.read_csv(raw_data_path, chunksize=FLAGS.chunk_size)
+        for index, chunk_df in enumerate(csv_reader):
+            chunk_file_name = 'chunk_%03d_%s'%(index, FLAGS.train_data)
+            chunk_file_path = os.path.join(output_data_dir, chunk_file_name)
+            logging.debug('saving %s'%(chunk_file_name))
             chunk_df.to_csv(chunk_file_path, index=False)
-        end_time = dt.datetime.now()
-        logging.debug('done in time %s'%(end_time-start_time,))
+            end_time = dt.datetime.now()
+            logging.debug('done in time %s'%(end_time-start_time,))
 
     if FLAGS.output_data_formation == 'feather':
         output_filename_base, _ = os.path.splitext(FLAGS.test_data)
         output_filename = '%s.feather'%(output_filename_base,)
         output_file_path = os.path.join(output_data_dir, output_filename)
-        df = pd.read_csv(test_data_path)
+        test_table = pa.concat_tables(iter_raw_csv_chunks(test_data_path, FLAGS.chunk_size, FLAGS.block_size))
         logging.debug('saving %s' % (output_filename))
-        df.to_feather(output_file_path)
+        write_feather_table(test_table, output_file_path)
         end_time = dt.datetime.now()
         logging.debug('done in time %s' % (end_time - start_time,))
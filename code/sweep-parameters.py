@@ -0,0 +1,131 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import json
+import logging
+import argparse
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from model_training import load_parameters_from_json, archive_parameters, write_history_to_file, train_model, \
+    save_model, expand_parameter_grid, get_model_md5, add_vocabulary_to_extra, read_history_records, model_exists
+from category_vocabulary import VOCABULARY_FILENAME
+from xgb_dataset import load_dataset_file, load_train_validate_dmatrix, get_dataset_fingerprint, get_feature_columns, \
+    DMatrixPool
+
+
+def run_trial(param, param_md5_str, dmatrix_pool, model_dir, nthread, vocabulary_path=None):
+    start_time = dt.datetime.now()
+    with dmatrix_pool.acquire() as (train_data, validate_data):
+        xgb_model, progress_info = train_model(param, train_data, validate_data, nthread=nthread, verbose_eval=False)
+    save_model(xgb_model, model_dir, param_md5_str, vocabulary_path)
+    rmse = progress_info['eval']['rmse'][-1]
+    write_history_to_file(model_dir, param_md5_str, rmse)
+    return param_md5_str, rmse, dt.datetime.now() - start_time
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--prj_dir',
+                            type=str,
+                            default='../')
+    arg_parser.add_argument('--data_dir',
+                            type=str,
+                            default='data')
+    arg_parser.add_argument('--model_dir',
+                            type=str,
+                            default='model')
+    arg_parser.add_argument('--train_data_dir',
+                            type=str,
+                            default='data-for-training')
+    arg_parser.add_argument('--log_filename',
+                            type=str,
+                            default=None)
+    arg_parser.add_argument('--param_filenames',
+                            type=str,
+                            nargs='*',
+                            default=[])
+    arg_parser.add_argument('--param_filename',
+                            type=str,
+                            default='param.json')
+    arg_parser.add_argument('--grid_filename',
+                            type=str,
+                            default=None)
+    arg_parser.add_argument('--num_workers',
+                            type=int,
+                            default=2)
+    arg_parser.add_argument('--nthread_budget',
+                            type=int,
+                            default=os.cpu_count())
+    arg_parser.add_argument('--split_seed',
+                            type=int,
+                            default=None)
+    FLAGS, _ = arg_parser.parse_known_args()
+
+    train_data_dir = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.train_data_dir)
+    model_dir = os.path.join(FLAGS.prj_dir, FLAGS.model_dir)
+
+    LOG_FORMAT = '[%(asctime)s] [%(lineno)d] [%(levelname)s] %(message)s'
+    if FLAGS.log_filename is not None:
+        LOG_FILE_PATH = os.path.join(train_data_dir, FLAGS.log_filename)
+    else:
+        LOG_FILE_PATH = None
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=LOG_FILE_PATH)
+
+    param_list = []
+    for param_filename in FLAGS.param_filenames:
+        param_list.append(load_parameters_from_json(os.path.join(model_dir, param_filename)))
+    if FLAGS.grid_filename is not None:
+        base_param = load_parameters_from_json(os.path.join(model_dir, FLAGS.param_filename))
+        with open(os.path.join(model_dir, FLAGS.grid_filename), 'r') as json_file:
+            grid = json.load(json_file)
+        param_list.extend(expand_parameter_grid(base_param, grid))
+    if len(param_list) == 0:
+        raise ValueError('nothing to sweep, give --param_filenames and/or --grid_filename')
+
+    if FLAGS.split_seed is None:
+        split_seed = param_list[0]['model_param']['seed']
+    else:
+        split_seed = FLAGS.split_seed
+
+    data_file_path = os.path.join(train_data_dir, load_dataset_file(train_data_dir))
+    data_fingerprint = get_dataset_fingerprint([data_file_path])
+    feature_columns = get_feature_columns(data_file_path)
+    vocabulary_path = os.path.join(train_data_dir, VOCABULARY_FILENAME)
+    history = read_history_records(model_dir)
+
+    # (param, param_md5_str) of every run which is not trained yet
+    trial_list = []
+    for param in param_list:
+        # every run is trained on the split of split_seed, whatever its own seed is
+        if param['model_param']['seed'] == split_seed:
+            extra = None
+        else:
+            extra = {'split_seed': split_seed}
+        param_md5_str = get_model_md5(param, data_fingerprint, feature_columns,
+                                      add_vocabulary_to_extra(extra, vocabulary_path))
+        if model_exists(model_dir, param_md5_str) and param_md5_str in history:
+            logging.debug('skip %s, rmse=%f', param_md5_str, history[param_md5_str])
+            continue
+        archive_parameters(param, model_dir, param_md5_str)
+        trial_list.append((param, param_md5_str))
+    if len(trial_list) == 0:
+        logging.debug('every model is trained already')
+        sys.exit(0)
+
+    # one train / validate DMatrix pair per concurrent run, runs must not share a DMatrix, see DMatrixPool
+    dmatrix_pool = DMatrixPool(lambda: load_train_validate_dmatrix(data_file_path, split_seed,
+                                                                   cache_dir=os.path.join(train_data_dir,
+                                                                                          'dmatrix-cache')))
+
+    num_workers = max(1, min(FLAGS.num_workers, len(trial_list)))
+    nthread = max(1, FLAGS.nthread_budget // num_workers)
+    logging.debug('%d runs, %d concurrent, %d threads each', len(trial_list), num_workers, nthread)
+
+    start_time = dt.datetime.now()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(run_trial, param, param_md5_str, dmatrix_pool, model_dir, nthread, vocabulary_path)
+                   for param, param_md5_str in trial_list]
+        for index, future in enumerate(as_completed(futures)):
+            param_md5_str, rmse, elapsed = future.result()
+            logging.debug('[%d/%d] %s: rmse=%f in %s', index + 1, len(futures), param_md5_str, rmse, elapsed)
+    logging.debug('done in %s', dt.datetime.now() - start_time)
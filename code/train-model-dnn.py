@@ -2,11 +2,11 @@
 import logging
 import argparse
 import numpy as np
-import pandas as pd
 import tensorflow as tf
 from pathlib import Path
 from tensorflow import keras
 from sklearn.model_selection import train_test_split
+from dataset_io import get_feather_columns, read_feather_columns
 
 
 class PrintDot(keras.callbacks.Callback):
@@ -20,15 +20,16 @@ class DNNModel(object):
         self.__training_dataset_path = training_dataset_path
         self.__testing_dataset_path = testing_dataset_path
 
-        raw_data_frame = pd.read_feather(self.__training_dataset_path)
+        feature_columns = [column for column in get_feather_columns(self.__training_dataset_path)
+                           if column not in ['fare_amount', 'key']]
+        raw_data_frame = read_feather_columns(self.__training_dataset_path, feature_columns + ['fare_amount'])
         raw_data_label = raw_data_frame['fare_amount']
-        raw_data_frame = raw_data_frame.drop(['fare_amount', 'key'], axis=1)
+        raw_data_frame = raw_data_frame.drop(['fare_amount'], axis=1)
         self.__training_data_frame, self.__validation_data_frame, \
         self.__training_data_label, self.__validation_data_label = \
         train_test_split(raw_data_frame, raw_data_label, test_size=0.01)
 
-        self.__testing_data_frame = pd.read_feather(self.__testing_dataset_path)
-        self.__testing_data_frame = self.__testing_data_frame.drop(['fare_amount', 'key'], axis=1)
+        self.__testing_data_frame = read_feather_columns(self.__testing_dataset_path, feature_columns)
         logging.debug('done!')
         logging.debug(f'self.__training_data_frame.shape: {self.__training_data_frame.shape}')
         logging.debug(f'self.__training_data_label.shape: {self.__training_data_label.shape}')
@@ -1,54 +1,13 @@
 # -*- coding:utf-8 -*-
 import os
-import re
-import json
-import shutil
-import hashlib
 import logging
 import argparse
-import pandas as pd
-import xgboost as xgb
-import datetime as dt
-from sklearn.model_selection import train_test_split
-
-
-def load_parameters_from_json(model_param_path):
-    model_param_dir, model_param_filename = os.path.split(model_param_path)
-    with open(model_param_path, 'r') as json_file:
-        param = json.load(json_file)
-
-    with open(model_param_path, 'rb') as json_file:
-        json_md5_obj = hashlib.md5()
-        json_md5_obj.update(json_file.read() + str(dt.datetime.now()).encode())
-        json_md5_str = json_md5_obj.hexdigest()
-
-    archive_json_filename = 'param_' + json_md5_str + '.json'
-    if not os.path.exists(os.path.join(model_param_dir, archive_json_filename)):
-        os.chdir(model_param_dir)
-        shutil.copyfile(model_param_filename, archive_json_filename)
-    return param, json_md5_str
-
-
-def load_dataset_file(train_data_dir):
-    file_list = os.listdir(train_data_dir)
-    reg_exp = r'cleaned_train.feather'
-    for file in file_list:
-        if re.match(reg_exp, file) is not None:
-            return file
-    return None
-
-
-def split_train_validate_dataset(data_file_list):
-    train_file_list = data_file_list[:-2]
-    validate_file_list = data_file_list[-2:]
-    return train_file_list, validate_file_list
-
-
-def write_history_to_file(model_dir, json_md5_str, result):
-    log_file_path = os.path.join(model_dir, 'history.records')
-    with open(log_file_path, 'a') as file_handler:
-        content = '%s\t%s\t%f\n'%(dt.datetime.now(), json_md5_str, result)
-        file_handler.write(content)
+from model_training import load_parameters_from_json, write_history_to_file, train_model, save_model, \
+    cross_validate, get_model_md5, add_vocabulary_to_extra, archive_parameters, read_history_records, model_exists
+from category_vocabulary import VOCABULARY_FILENAME
+from xgb_dataset import build_external_memory_dmatrix, load_train_validate_dmatrix, load_dataset_dmatrix, \
+    load_dataset_file, load_dataset_file_list, split_train_validate_dataset, get_dataset_fingerprint, \
+    get_feature_columns
 
 
 if __name__ == '__main__':
@@ -71,6 +30,24 @@ if __name__ == '__main__':
     arg_parser.add_argument('--param_filename',
                             type=str,
                             default='param.json')
+    arg_parser.add_argument('--external_memory',
+                            action='store_true')
+    arg_parser.add_argument('--validate_chunks',
+                            type=int,
+                            default=2)
+    arg_parser.add_argument('--no_dmatrix_cache',
+                            action='store_true')
+    arg_parser.add_argument('--force',
+                            action='store_true')
+    arg_parser.add_argument('--cv_folds',
+                            type=int,
+                            default=0)
+    arg_parser.add_argument('--num_workers',
+                            type=int,
+                            default=1)
+    arg_parser.add_argument('--nthread_budget',
+                            type=int,
+                            default=os.cpu_count())
     FLAGS, _ = arg_parser.parse_known_args()
 
     train_data_dir = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.train_data_dir)
@@ -84,40 +61,66 @@ if __name__ == '__main__':
         LOG_FILE_PATH = None
     logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=LOG_FILE_PATH)
 
-    param, param_md5_str = load_parameters_from_json(model_param_path)
-
-    data_file = load_dataset_file(train_data_dir)
-    model_path = os.path.join(model_dir, 'xgb_'+param_md5_str+'.model')
-    model_raw_path = os.path.join(model_dir, 'xgb_'+param_md5_str+'.model.raw.txt')
-    logging.debug('data filename: %s', data_file)
-
-    data_file_path = os.path.join(train_data_dir, data_file)
-    data_df = pd.read_feather(data_file_path)
-
-    train_df, validate_df = train_test_split(data_df, test_size=0.05, shuffle=True, random_state=param['model_param']['seed'])
-    logging.debug(train_df.shape)
-    logging.debug(validate_df.shape)
-
-    train_data = xgb.DMatrix(train_df.drop(columns=['key', 'fare_amount'], axis=1), label=train_df['fare_amount'])
-
-    validate_data = xgb.DMatrix(validate_df.drop(columns=['key', 'fare_amount'], axis=1),
-                                label=validate_df['fare_amount'])
-    eval_list = [(validate_data, 'eval')]
-    num_round = param['num_round']
-    early_stop_rounds = param['early_stop_rounds']
-    progress_info = dict()
-
-    logging.debug('training model...')
-    xgb_model = xgb.train(param['model_param'],
-                          train_data,
-                          num_round,
-                          eval_list,
-                          early_stopping_rounds=early_stop_rounds,
-                          evals_result=progress_info)
-    logging.debug('done!')
+    param = load_parameters_from_json(model_param_path)
+    history = read_history_records(model_dir)
+    if FLAGS.no_dmatrix_cache:
+        dmatrix_cache_dir = None
+    else:
+        dmatrix_cache_dir = os.path.join(train_data_dir, 'dmatrix-cache')
 
-    xgb_model.save_model(model_path)
-    xgb_model.dump_model(model_raw_path)
-    logging.debug('save model: %s', model_path)
-    logging.debug('save model: %s', model_raw_path)
-    write_history_to_file(model_dir, param_md5_str, progress_info['eval']['rmse'][-1])
+    if FLAGS.external_memory:
+        data_file_list = load_dataset_file_list(train_data_dir)
+        data_file_path_list = [os.path.join(train_data_dir, file) for file in data_file_list]
+        extra = {'validate_chunks': FLAGS.validate_chunks}
+    else:
+        data_file_path_list = [os.path.join(train_data_dir, load_dataset_file(train_data_dir))]
+        extra = {'cv_folds': FLAGS.cv_folds} if FLAGS.cv_folds > 1 else None
+    logging.debug('data files: %s', data_file_path_list)
+    vocabulary_path = os.path.join(train_data_dir, VOCABULARY_FILENAME)
+    extra = add_vocabulary_to_extra(extra, vocabulary_path)
+
+    # the same parameters, data and features always give the same md5
+    param_md5_str = get_model_md5(param,
+                                  get_dataset_fingerprint(data_file_path_list),
+                                  get_feature_columns(data_file_path_list[0]),
+                                  extra)
+    archive_parameters(param, model_dir, param_md5_str)
+    logging.debug('md5: %s', param_md5_str)
+
+    if FLAGS.cv_folds > 1:
+        if not FLAGS.force and param_md5_str in history:
+            logging.debug('skip, cv rmse of %s is already recorded: %f', param_md5_str, history[param_md5_str])
+        else:
+            dataset = load_dataset_dmatrix(data_file_path_list[0], cache_dir=dmatrix_cache_dir)
+            logging.debug('%d-fold cross validation on %d x %d', FLAGS.cv_folds, dataset.num_row(), dataset.num_col())
+            rmse_mean, rmse_std, fold_result_list = cross_validate(param, dataset, FLAGS.cv_folds,
+                                                                   FLAGS.num_workers, FLAGS.nthread_budget)
+            for fold, (rmse, elapsed) in enumerate(fold_result_list):
+                logging.debug('fold %d: rmse=%f in %s', fold, rmse, elapsed)
+            logging.debug('cv rmse: mean=%f std=%f', rmse_mean, rmse_std)
+            write_history_to_file(model_dir, param_md5_str, rmse_mean)
+    elif not FLAGS.force and model_exists(model_dir, param_md5_str) and param_md5_str in history:
+        logging.debug('skip, model xgb_%s.model already exists, rmse=%f', param_md5_str, history[param_md5_str])
+    else:
+        if FLAGS.external_memory:
+            # stream the cleaned chunk files, only one chunk is held in memory at a time
+            train_file_path_list, validate_file_path_list = split_train_validate_dataset(data_file_path_list,
+                                                                                         FLAGS.validate_chunks)
+            logging.debug('train files: %s', train_file_path_list)
+            logging.debug('validate files: %s', validate_file_path_list)
+
+            cache_dir = os.path.join(train_data_dir, 'xgb-cache')
+            train_data = build_external_memory_dmatrix(train_file_path_list, cache_dir, 'train')
+            validate_data = build_external_memory_dmatrix(validate_file_path_list, cache_dir, 'validate')
+        else:
+            train_data, validate_data = load_train_validate_dmatrix(data_file_path_list[0],
+                                                                    param['model_param']['seed'],
+                                                                    cache_dir=dmatrix_cache_dir)
+        logging.debug('train data: %d x %d', train_data.num_row(), train_data.num_col())
+        logging.debug('validate data: %d x %d', validate_data.num_row(), validate_data.num_col())
+        logging.debug('training model...')
+        xgb_model, progress_info = train_model(param, train_data, validate_data)
+        logging.debug('done!')
+
+        save_model(xgb_model, model_dir, param_md5_str, vocabulary_path)
+        write_history_to_file(model_dir, param_md5_str, progress_info['eval']['rmse'][-1])
@@ -0,0 +1,150 @@
+# -*- coding:utf-8 -*-
+import os
+import numpy as np
+
+# link function from the summed margin to the prediction of every objective a TreeEnsemble can compute
+OBJECTIVE_LINKS = {
+    'reg:squarederror': 'identity',
+    'reg:linear': 'identity',
+    'reg:squaredlogerror': 'identity',
+    'reg:pseudohubererror': 'identity',
+    'reg:absoluteerror': 'identity',
+    'reg:logistic': 'logistic',
+    'binary:logistic': 'logistic',
+    'count:poisson': 'log',
+    'reg:gamma': 'log',
+    'reg:tweedie': 'log',
+}
+
+
+class TreeEnsemble(object):
+    '''
+    a boosted tree model as flat arrays, one entry per node of every tree:
+    feature index, threshold, left (yes), right (no), missing child and leaf value.
+    leaves point to themselves, so every row walks `max_depth` steps and ends on its leaf.
+    `base_score` is in margin space, the summed margin goes through `link` (see OBJECTIVE_LINKS).
+    only needs numpy, save_model() writes it as `xgb_<md5>.model.npz` next to the model
+    '''
+
+    def __init__(self, feature_names, base_score, roots, feature_index, threshold, left, right, missing, value,
+                 max_depth, link='identity'):
+        if link not in ['identity', 'logistic', 'log']:
+            raise ValueError('unknown link function %s' % (link,))
+        self.feature_names = list(feature_names)
+        self.__base_score = float(base_score)
+        self.__link = str(link)
+        self.__roots = np.asarray(roots, dtype=np.int64)
+        self.__feature_index = np.asarray(feature_index, dtype=np.int64)
+        self.__threshold = np.asarray(threshold, dtype=np.float32)
+        self.__left = np.asarray(left, dtype=np.int64)
+        self.__right = np.asarray(right, dtype=np.int64)
+        self.__missing = np.asarray(missing, dtype=np.int64)
+        self.__value = np.asarray(value, dtype=np.float32)
+        self.__max_depth = int(max_depth)
+
+    def get_feature_names(self):
+        return self.feature_names
+
+    def get_tree_num(self):
+        return self.__roots.shape[0]
+
+    def predict(self, features):
+        '''
+        :param features: one row or 2-d array of rows, columns in the order of get_feature_names(), NaN is missing
+        :return: float32 array, one prediction per row
+        '''
+        features = np.asarray(features, dtype=np.float32)
+        if features.ndim == 1:
+            features = features[None, :]
+        rows = np.arange(features.shape[0])[:, None]
+        nodes = np.repeat(self.__roots[None, :], features.shape[0], axis=0)
+        for _ in range(self.__max_depth):
+            x = features[rows, self.__feature_index[nodes]]
+            nodes = np.where(np.isnan(x), self.__missing[nodes],
+                             np.where(x < self.__threshold[nodes], self.__left[nodes], self.__right[nodes]))
+        margin = self.__value[nodes].sum(axis=1, dtype=np.float64) + self.__base_score
+        if self.__link == 'logistic':
+            return (1 / (1 + np.exp(-margin))).astype(np.float32)
+        if self.__link == 'log':
+            return np.exp(margin).astype(np.float32)
+        return margin.astype(np.float32)
+
+    def save(self, path):
+        np.savez(path,
+                 feature_names=np.array(self.feature_names),
+                 base_score=np.array(self.__base_score),
+                 roots=self.__roots,
+                 feature_index=self.__feature_index,
+                 threshold=self.__threshold,
+                 left=self.__left,
+                 right=self.__right,
+                 missing=self.__missing,
+                 value=self.__value,
+                 max_depth=np.array(self.__max_depth),
+                 link=np.array(self.__link))
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as arrays:
+            return TreeEnsemble(arrays['feature_names'].tolist(), arrays['base_score'], arrays['roots'],
+                                arrays['feature_index'], arrays['threshold'], arrays['left'], arrays['right'],
+                                arrays['missing'], arrays['value'], arrays['max_depth'],
+                                # files compiled before the link was saved are all identity models
+                                arrays['link'].item() if 'link' in arrays.files else 'identity')
+
+
+def parse_model_json(model_json):
+    '''
+    :param model_json: the JSON form of a gbtree model (Booster.save_raw('json')), parsed with json.loads
+    :return: TreeEnsemble
+    '''
+    learner = model_json['learner']
+    if learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError('only gbtree models can be compiled, got %s' % (learner['gradient_booster']['name'],))
+    objective = learner['objective']['name']
+    if objective not in OBJECTIVE_LINKS:
+        raise ValueError('objective %s can not be compiled, supported: %s' % (objective, ', '.join(OBJECTIVE_LINKS)))
+    if int(learner['learner_model_param'].get('num_target', 1)) != 1:
+        raise ValueError('only single target models can be compiled')
+    link = OBJECTIVE_LINKS[objective]
+    feature_num = int(learner['learner_model_param']['num_feature'])
+    feature_names = learner.get('feature_names') or ['f%d' % index for index in range(feature_num)]
+    # e.g. '5E-1' or '[1.1345E1]', saved in prediction space and turned into a margin here
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    if link == 'logistic':
+        base_score = np.log(base_score / (1 - base_score))
+    elif link == 'log':
+        base_score = np.log(base_score)
+
+    roots = []
+    feature_index, threshold, left, right, missing, value = [], [], [], [], [], []
+    max_depth = 0
+    for tree in learner['gradient_booster']['model']['trees']:
+        offset = len(value)
+        roots.append(offset)
+        depth = [0] * len(tree['left_children'])
+        for node_id, (left_child, right_child) in enumerate(zip(tree['left_children'], tree['right_children'])):
+            if left_child == -1:
+                # leaves point to themselves, their split_conditions entry holds the leaf value
+                feature_index.append(0)
+                threshold.append(0)
+                left.append(offset + node_id)
+                right.append(offset + node_id)
+                missing.append(offset + node_id)
+                value.append(tree['split_conditions'][node_id])
+                continue
+            # children always come after their parent
+            depth[left_child] = depth[right_child] = depth[node_id] + 1
+            max_depth = max(max_depth, depth[node_id] + 1)
+            feature_index.append(tree['split_indices'][node_id])
+            threshold.append(tree['split_conditions'][node_id])
+            left.append(offset + left_child)
+            right.append(offset + right_child)
+            missing.append(offset + (left_child if tree['default_left'][node_id] else right_child))
+            value.append(0.0)
+    return TreeEnsemble(feature_names, base_score, roots, feature_index, threshold, left, right, missing, value,
+                        max_depth, link)
+
+
+def load_tree_ensemble(model_dir, model_md5):
+    return TreeEnsemble.load(os.path.join(model_dir, 'xgb_' + model_md5 + '.model.npz'))
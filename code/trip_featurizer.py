@@ -0,0 +1,286 @@
+# -*- coding:utf-8 -*-
+import re
+import math
+import pytz
+import numpy as np
+import datetime as dt
+from datetime_features import DATETIME_FORMAT, LOCAL_TIMEZONE, decompose_local_datetime
+from landmark_distance import RADIUS_EARTH, LandmarkDistanceEngine
+from geofence import get_new_york_geofence
+
+# (name, longitude, latitude) in degree, the landmarks of DataCleaner
+LANDMARKS = [
+    ('jfk', -73.778889, 40.639722),
+    ('ewr', -74.168611, 40.6925),
+    ('lga', -73.872611, 40.77725),
+    ('liberty', -74.0445, 40.6892),
+    ('nyc', -74.0063889, 40.7141667),
+]
+
+# upper bounds of the pickup hour of time class 0 - 3, the rest is class 4
+TIME_CLASS_HOURS = [8, 12, 16, 20]
+
+BASE_FEATURES = ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude', 'passenger_count',
+                 'pickup_year', 'pickup_days_sin', 'pickup_days_cos', 'pickup_seconds_sin', 'pickup_seconds_cos',
+                 'pickup_weekday_sin', 'pickup_weekday_cos', 'pickup_time_class',
+                 'haver_dist', 'bear_dist', 'mha_flag'] + [name + '_dist' for name, _, _ in LANDMARKS]
+
+DUMMY_FEATURE_PATTERN = re.compile(r'^(pickup_year|pickup_time_class)_(\d+)$')
+
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+class TripFeaturizer(object):
+    '''
+    turn raw trips (UTC pickup time, coordinates in degree, passenger count) into the feature vector
+    of DataCleaner + generate-dataset-for-training.py without building DataFrames.
+    `feature_names` is the column order the model was trained with (Booster.feature_names), one-hot
+    columns like `pickup_year_2012` or `pickup_time_class_3` are derived from the base features.
+    transform_one() is plain python for a single trip, transform() is numpy for a small batch
+    '''
+
+    def __init__(self, feature_names, radius_earth=RADIUS_EARTH):
+        self.__feature_names = list(feature_names)
+        self.__radius_earth = radius_earth
+        self.__timezone = pytz.timezone(LOCAL_TIMEZONE)
+
+        self.__landmark_engine = LandmarkDistanceEngine(radius_earth)
+        self.__landmarks = []
+        for name, longitude, latitude in LANDMARKS:
+            longitude = (longitude * np.pi) / 180
+            latitude = (latitude * np.pi) / 180
+            self.__landmark_engine.register_landmark(name, longitude=longitude, latitude=latitude)
+            self.__landmarks.append((longitude, latitude, math.cos(latitude)))
+        self.__geofence = get_new_york_geofence()
+        self.__manhattan_id = self.__geofence.get_zone_id('manhattan')
+
+        # (base feature, one-hot category or None) of every output column
+        self.__columns = [self.__compile_column(name) for name in self.__feature_names]
+
+    def get_feature_names(self):
+        return self.__feature_names
+
+    def transform_one(self, pickup_datetime, pickup_longitude, pickup_latitude,
+                      dropoff_longitude, dropoff_latitude, passenger_count):
+        '''
+        :param pickup_datetime: raw string ('2009-06-15 17:26:21 UTC') or datetime, naive means UTC
+        :return: list of floats in the order of get_feature_names()
+        '''
+        values = self.__get_trip_features(pickup_datetime, float(pickup_longitude), float(pickup_latitude),
+                                          float(dropoff_longitude), float(dropoff_latitude), passenger_count)
+        return [float(values[base]) if category is None else float(values[base] == category)
+                for base, category in self.__columns]
+
+    def transform(self, pickup_datetime, pickup_longitude, pickup_latitude,
+                  dropoff_longitude, dropoff_latitude, passenger_count):
+        '''
+        :param pickup_datetime: datetime64 array (UTC) or sequence of raw strings / datetimes
+        :return: float64 array of shape (n_trips, n_features)
+        '''
+        values = self.__get_batch_features(pickup_datetime,
+                                           np.asarray(pickup_longitude, dtype=np.float64),
+                                           np.asarray(pickup_latitude, dtype=np.float64),
+                                           np.asarray(dropoff_longitude, dtype=np.float64),
+                                           np.asarray(dropoff_latitude, dtype=np.float64),
+                                           np.asarray(passenger_count, dtype=np.float64))
+        result = np.empty((values['pickup_longitude'].shape[0], len(self.__columns)), dtype=np.float64)
+        for index, (base, category) in enumerate(self.__columns):
+            if category is None:
+                result[:, index] = values[base]
+            else:
+                result[:, index] = values[base] == category
+        return result
+
+    def __compile_column(self, name):
+        if name in BASE_FEATURES:
+            return name, None
+        matched = DUMMY_FEATURE_PATTERN.match(name)
+        if matched is None:
+            raise ValueError(f'feature {name} cannot be generated from a raw trip')
+        return matched.group(1), int(matched.group(2))
+
+    def __parse_utc_datetime(self, value):
+        '''
+        :return: naive datetime holding the UTC time
+        '''
+        if isinstance(value, str):
+            return dt.datetime.strptime(value, DATETIME_FORMAT)
+        if isinstance(value, np.datetime64):
+            return EPOCH + dt.timedelta(seconds=int(value.astype('datetime64[s]').astype(np.int64)))
+        if value.tzinfo is not None:
+            return value.astimezone(pytz.utc).replace(tzinfo=None)
+        return value
+
+    def __get_utc_offset(self, utc_seconds):
+        utc_datetime = pytz.utc.localize(EPOCH + dt.timedelta(seconds=int(utc_seconds)))
+        return int(utc_datetime.astimezone(self.__timezone).utcoffset().total_seconds())
+
+    def __get_trip_features(self, pickup_datetime, pickup_longitude, pickup_latitude,
+                            dropoff_longitude, dropoff_latitude, passenger_count):
+        local_datetime = pytz.utc.localize(self.__parse_utc_datetime(pickup_datetime)).astimezone(self.__timezone)
+        days_in_year = local_datetime.timetuple().tm_yday - 1
+        seconds_in_day = local_datetime.hour * 3600 + local_datetime.minute * 60 + local_datetime.second
+        weekday = local_datetime.weekday()
+        time_class = len([bound for bound in TIME_CLASS_HOURS if local_datetime.hour >= bound])
+
+        mha_flag = self.__geofence.locate_one(pickup_longitude, pickup_latitude) == self.__manhattan_id and \
+            self.__geofence.locate_one(dropoff_longitude, dropoff_latitude) == self.__manhattan_id
+
+        pickup_longitude = pickup_longitude / 180 * np.pi
+        pickup_latitude = pickup_latitude / 180 * np.pi
+        dropoff_longitude = dropoff_longitude / 180 * np.pi
+        dropoff_latitude = dropoff_latitude / 180 * np.pi
+        longitude_delta = dropoff_longitude - pickup_longitude
+        latitude_delta = dropoff_latitude - pickup_latitude
+        pickup_latitude_cos = math.cos(pickup_latitude)
+        dropoff_latitude_cos = math.cos(dropoff_latitude)
+
+        values = {
+            'pickup_longitude': pickup_longitude,
+            'pickup_latitude': pickup_latitude,
+            'dropoff_longitude': dropoff_longitude,
+            'dropoff_latitude': dropoff_latitude,
+            'passenger_count': passenger_count,
+            'pickup_year': local_datetime.year,
+            'pickup_days_sin': math.sin(2 * np.pi * days_in_year / 365),
+            'pickup_days_cos': math.cos(2 * np.pi * days_in_year / 365),
+            'pickup_seconds_sin': math.sin(2 * np.pi * seconds_in_day / 86400),
+            'pickup_seconds_cos': math.cos(2 * np.pi * seconds_in_day / 86400),
+            'pickup_weekday_sin': math.sin(2 * np.pi * weekday / 7),
+            'pickup_weekday_cos': math.cos(2 * np.pi * weekday / 7),
+            'pickup_time_class': time_class,
+            'haver_dist': 2 * self.__radius_earth * math.asin(math.sqrt(
+                math.sin(latitude_delta / 2) ** 2 +
+                pickup_latitude_cos * dropoff_latitude_cos * math.sin(longitude_delta / 2) ** 2)),
+            # same expression as DataCleaner.__get_bearing_distance, parentheses included
+            'bear_dist': math.atan2(math.sin(-longitude_delta * dropoff_latitude_cos),
+                                    math.cos(pickup_latitude * math.sin(dropoff_latitude)) -
+                                    math.sin(pickup_latitude) * dropoff_latitude_cos * math.cos(-longitude_delta)),
+            'mha_flag': int(mha_flag),
+        }
+        for (name, _, _), (longitude, latitude, latitude_cos) in zip(LANDMARKS, self.__landmarks):
+            values[name + '_dist'] = \
+                self.__get_sphere_distance(pickup_latitude, pickup_longitude, pickup_latitude_cos,
+                                           latitude, longitude, latitude_cos) + \
+                self.__get_sphere_distance(dropoff_latitude, dropoff_longitude, dropoff_latitude_cos,
+                                           latitude, longitude, latitude_cos)
+        return values
+
+    def __get_batch_features(self, pickup_datetime, pickup_longitude, pickup_latitude,
+                             dropoff_longitude, dropoff_latitude, passenger_count):
+        pickup_datetime = np.asarray(pickup_datetime)
+        if pickup_datetime.dtype.kind == 'M':
+            utc_seconds = pickup_datetime.astype('datetime64[s]').astype(np.int64)
+        else:
+            utc_seconds = np.array([(self.__parse_utc_datetime(value) - EPOCH) // dt.timedelta(seconds=1)
+                                    for value in pickup_datetime], dtype=np.int64)
+        # US/Eastern changes its offset on whole UTC hours, one lookup per distinct hour is enough
+        hours, inverse = np.unique(utc_seconds // 3600, return_inverse=True)
+        offsets = np.array([self.__get_utc_offset(hour * 3600) for hour in hours], dtype=np.int64)
+        fields = decompose_local_datetime((utc_seconds + offsets[inverse.ravel()]).astype('datetime64[s]'))
+
+        mha_flag = (self.__geofence.locate(pickup_longitude, pickup_latitude) == self.__manhattan_id) & \
+            (self.__geofence.locate(dropoff_longitude, dropoff_latitude) == self.__manhattan_id)
+
+        pickup_longitude = pickup_longitude / 180 * np.pi
+        pickup_latitude = pickup_latitude / 180 * np.pi
+        dropoff_longitude = dropoff_longitude / 180 * np.pi
+        dropoff_latitude = dropoff_latitude / 180 * np.pi
+        longitude_delta = dropoff_longitude - pickup_longitude
+        latitude_delta = dropoff_latitude - pickup_latitude
+
+        values = {
+            'pickup_longitude': pickup_longitude,
+            'pickup_latitude': pickup_latitude,
+            'dropoff_longitude': dropoff_longitude,
+            'dropoff_latitude': dropoff_latitude,
+            'passenger_count': passenger_count,
+            'pickup_year': fields['year'],
+            'pickup_days_sin': np.sin(2 * np.pi * fields['days_in_year'] / 365),
+            'pickup_days_cos': np.cos(2 * np.pi * fields['days_in_year'] / 365),
+            'pickup_seconds_sin': np.sin(2 * np.pi * fields['seconds_in_day'] / 86400),
+            'pickup_seconds_cos': np.cos(2 * np.pi * fields['seconds_in_day'] / 86400),
+            'pickup_weekday_sin': np.sin(2 * np.pi * fields['weekday'] / 7),
+            'pickup_weekday_cos': np.cos(2 * np.pi * fields['weekday'] / 7),
+            'pickup_time_class': np.searchsorted(TIME_CLASS_HOURS, fields['hour'], side='right'),
+            'haver_dist': 2 * self.__radius_earth * np.arcsin(np.sqrt(
+                np.sin(latitude_delta / 2) ** 2 +
+                np.cos(pickup_latitude) * np.cos(dropoff_latitude) * np.sin(longitude_delta / 2) ** 2)),
+            'bear_dist': np.arctan2(np.sin(-longitude_delta * np.cos(dropoff_latitude)),
+                                    np.cos(pickup_latitude * np.sin(dropoff_latitude)) -
+                                    np.sin(pickup_latitude) * np.cos(dropoff_latitude) * np.cos(-longitude_delta)),
+            'mha_flag': mha_flag.astype(np.int64),
+        }
+        distance = self.__landmark_engine.compute(pickup_latitude, pickup_longitude,
+                                                  dropoff_latitude, dropoff_longitude)
+        for index, column in enumerate(self.__landmark_engine.get_column_names()):
+            values[column] = distance[:, index]
+        return values
+
+    def __get_sphere_distance(self, latitude, longitude, latitude_cos,
+                              landmark_latitude, landmark_longitude, landmark_latitude_cos):
+        return 2 * self.__radius_earth * math.asin(math.sqrt(
+            math.sin((landmark_latitude - latitude) / 2) ** 2 +
+            latitude_cos * landmark_latitude_cos * math.sin((landmark_longitude - longitude) / 2) ** 2))
+
+
+def get_landmark_engine(radius_earth=RADIUS_EARTH):
+    '''
+    LandmarkDistanceEngine with the LANDMARKS registered
+    '''
+    landmark_engine = LandmarkDistanceEngine(radius_earth)
+    for name, longitude, latitude in LANDMARKS:
+        landmark_engine.register_landmark(name, longitude=(longitude * np.pi) / 180, latitude=(latitude * np.pi) / 180)
+    return landmark_engine
+
+
+def append_cyclic_datetime_features(data_frame):
+    '''
+    the sin / cos of the pickup day in year, second in day and weekday and `pickup_time_class`, computed
+    from the calendar columns of datetime_features.extract_datetime_fields
+    '''
+    data_frame['pickup_days_sin'] = np.sin(2 * np.pi * data_frame['pickup_days_in_year'] / 365)
+    data_frame['pickup_days_cos'] = np.cos(2 * np.pi * data_frame['pickup_days_in_year'] / 365)
+
+    data_frame['pickup_seconds_sin'] = np.sin(2 * np.pi * data_frame['pickup_seconds_in_day'] / 86400)
+    data_frame['pickup_seconds_cos'] = np.cos(2 * np.pi * data_frame['pickup_seconds_in_day'] / 86400)
+
+    data_frame['pickup_weekday_sin'] = np.sin(2 * np.pi * data_frame['pickup_weekday'] / 7)
+    data_frame['pickup_weekday_cos'] = np.cos(2 * np.pi * data_frame['pickup_weekday'] / 7)
+
+    data_frame['pickup_time_class'] = np.searchsorted(TIME_CLASS_HOURS, data_frame['pickup_hour'].values,
+                                                      side='right').astype(np.int64)
+    return data_frame
+
+
+def append_coordinate_features(data_frame, landmark_engine, geofence, radius_earth=RADIUS_EARTH):
+    '''
+    `pickup_mha`, `dropoff_mha` and `mha_flag` from the coordinates in degree, then the coordinates are
+    converted to radians in place and `longitude_delta`, `latitude_delta`, `haver_dist`, `bear_dist` and
+    the landmark distances of `landmark_engine` are appended
+    '''
+    manhattan_id = geofence.get_zone_id('manhattan')
+    pickup_mha = geofence.locate(data_frame['pickup_longitude'].values,
+                                 data_frame['pickup_latitude'].values) == manhattan_id
+    dropoff_mha = geofence.locate(data_frame['dropoff_longitude'].values,
+                                  data_frame['dropoff_latitude'].values) == manhattan_id
+    data_frame['pickup_mha'] = pickup_mha.astype(int)
+    data_frame['dropoff_mha'] = dropoff_mha.astype(int)
+    data_frame['mha_flag'] = (pickup_mha & dropoff_mha).astype(int)
+
+    for column in ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']:
+        data_frame[column] = data_frame[column] / 180 * np.pi
+
+    data_frame['longitude_delta'] = data_frame['dropoff_longitude'] - data_frame['pickup_longitude']
+    data_frame['latitude_delta'] = data_frame['dropoff_latitude'] - data_frame['pickup_latitude']
+
+    pickup_latitude = data_frame['pickup_latitude']
+    dropoff_latitude = data_frame['dropoff_latitude']
+    longitude_delta = data_frame['longitude_delta']
+    data_frame['haver_dist'] = 2 * radius_earth * np.arcsin(np.sqrt(
+        np.sin(data_frame['latitude_delta'] / 2) ** 2 +
+        np.cos(pickup_latitude) * np.cos(dropoff_latitude) * np.sin(longitude_delta / 2) ** 2))
+    data_frame['bear_dist'] = np.arctan2(np.sin(-longitude_delta * np.cos(dropoff_latitude)),
+                                         np.cos(pickup_latitude * np.sin(dropoff_latitude)) -
+                                         np.sin(pickup_latitude) * np.cos(dropoff_latitude) * np.cos(-longitude_delta))
+    return landmark_engine.append_distance_columns(data_frame)
@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+import numpy as np
+import pandas as pd
+
+# a key is '<YYYY-MM-DD HH:MM:SS>.<up to 9 digits>' (the part from '.' on may be missing), encoded as
+# int64: seconds since KEY_EPOCH << 31 | number of fraction digits << 27 | fraction value (< 2 ** 27)
+KEY_EPOCH = np.datetime64('2000-01-01T00:00:00', 's')
+KEY_DATETIME_LENGTH = 19
+KEY_MAX_FRACTION_DIGITS = 9
+FRACTION_BITS = 27
+DIGITS_BITS = 4
+
+BLOCK_SIZE = 1_000_000
+
+
+def encode_keys(keys, validate=True):
+    '''
+    :param keys: sequence of key strings
+    :param validate: decode the codes again and compare, raises ValueError on the first key which
+                     does not round-trip exactly
+    :return: int64 array
+    '''
+    keys = np.asarray(keys, dtype=str)
+    codes = np.empty(keys.shape[0], dtype=np.int64)
+    for start in range(0, keys.shape[0], BLOCK_SIZE):
+        block = keys[start:start + BLOCK_SIZE]
+        codes[start:start + BLOCK_SIZE] = _encode_block(block)
+        if validate:
+            mismatch = np.flatnonzero(decode_keys(codes[start:start + BLOCK_SIZE]) != block)
+            if mismatch.shape[0] > 0:
+                raise ValueError('key %r can not be encoded' % (str(block[mismatch[0]]),))
+    return codes
+
+
+def _encode_block(keys):
+    lengths = np.char.str_len(keys)
+    if keys.shape[0] == 0:
+        return np.empty(0, dtype=np.int64)
+    if lengths.min() < KEY_DATETIME_LENGTH or lengths.max() > KEY_DATETIME_LENGTH + 1 + KEY_MAX_FRACTION_DIGITS:
+        raise ValueError('keys must have %d to %d characters' %
+                         (KEY_DATETIME_LENGTH, KEY_DATETIME_LENGTH + 1 + KEY_MAX_FRACTION_DIGITS))
+    # one row of unicode code points per key, padded with 0
+    width = keys.dtype.itemsize // 4
+    digits = keys.view(np.uint32).reshape(-1, width).astype(np.int64) - ord('0')
+
+    def get_number(first, last):
+        number = np.zeros(keys.shape[0], dtype=np.int64)
+        for position in range(first, last):
+            number = number * 10 + digits[:, position]
+        return number
+
+    months = (get_number(0, 4) - 1970) * 12 + get_number(5, 7) - 1
+    seconds = (months.astype('datetime64[M]').astype('datetime64[s]') - KEY_EPOCH).astype(np.int64) + \
+        (get_number(8, 10) - 1) * 86400 + get_number(11, 13) * 3600 + get_number(14, 16) * 60 + get_number(17, 19)
+
+    fraction_digits = np.maximum(lengths - KEY_DATETIME_LENGTH - 1, 0)
+    fraction = np.zeros(keys.shape[0], dtype=np.int64)
+    for position in range(KEY_DATETIME_LENGTH + 1, width):
+        in_fraction = position < lengths
+        fraction[in_fraction] = fraction[in_fraction] * 10 + digits[in_fraction, position]
+    if seconds.min() < 0:
+        raise ValueError('keys before %s can not be encoded' % (KEY_EPOCH,))
+    if fraction.max() >= (1 << FRACTION_BITS):
+        raise ValueError('key fractions must be below %d' % (1 << FRACTION_BITS,))
+    return (seconds << (DIGITS_BITS + FRACTION_BITS)) | (fraction_digits << FRACTION_BITS) | fraction
+
+
+def decode_keys(codes):
+    '''
+    :return: array of the original key strings
+    '''
+    codes = np.asarray(codes, dtype=np.int64)
+    seconds = KEY_EPOCH + (codes >> (DIGITS_BITS + FRACTION_BITS))
+    fraction_digits = (codes >> FRACTION_BITS) & ((1 << DIGITS_BITS) - 1)
+    fraction = codes & ((1 << FRACTION_BITS) - 1)
+
+    keys = np.char.replace(np.datetime_as_string(seconds, unit='s'), 'T', ' ').astype(
+        'U%d' % (KEY_DATETIME_LENGTH + 1 + KEY_MAX_FRACTION_DIGITS,))
+    for digit_num in np.unique(fraction_digits):
+        if digit_num == 0:
+            continue
+        selected = fraction_digits == digit_num
+        keys[selected] = np.char.add(np.char.add(keys[selected], '.'),
+                                     np.char.zfill(fraction[selected].astype(str), int(digit_num)))
+    return keys
+
+
+def encode_key_column(data_frame, column='key'):
+    '''
+    replace the key strings of `data_frame` by their int64 codes, already encoded keys are left as they are
+    '''
+    if column in data_frame.columns and not pd.api.types.is_integer_dtype(data_frame[column]):
+        data_frame[column] = encode_keys(data_frame[column].values)
+    return data_frame
+
+
+def decode_key_column(data_frame, column='key'):
+    '''
+    turn int64 key codes back into the original strings, before writing an output file
+    '''
+    if column in data_frame.columns and pd.api.types.is_integer_dtype(data_frame[column]):
+        data_frame[column] = decode_keys(data_frame[column].values)
+    return data_frame
@@ -0,0 +1,192 @@
+# -*- coding:utf-8 -*-
+import os
+import json
+import copy
+import random
+import logging
+import argparse
+import numpy as np
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from model_training import load_parameters_from_json, archive_parameters, write_history_to_file, train_model, \
+    expand_parameter_grid, get_model_md5, add_vocabulary_to_extra, read_history_records
+from category_vocabulary import VOCABULARY_FILENAME
+from xgb_dataset import load_dataset_file, load_train_validate_dmatrix, get_dataset_fingerprint, get_feature_columns, \
+    DMatrixPool
+
+# the staged procedure of document/TUNE-PARAMETER.md, every stage keeps the best values of the previous ones
+TUNING_STAGES = [
+    {'max_depth': [4, 6, 8, 10, 12], 'min_child_weight': [1, 3, 5, 7, 9]},
+    {'gamma': [0, 0.1, 0.2, 0.3, 0.4, 0.5]},
+    {'subsample': [0.5, 0.6, 0.7, 0.8, 0.9, 1.0], 'colsample_bytree': [0.3, 0.5, 0.7, 0.9, 1.0]},
+    {'alpha': [0, 0.01, 0.1, 1, 10], 'lambda': [0.1, 1, 5, 10, 50]},
+    {'eta': [0.3, 0.2, 0.1, 0.05, 0.03]},
+]
+
+
+def get_rung_schedule(min_rounds, max_rounds, reduction_factor):
+    '''
+    :return: list of (num_round, data fraction), the last rung trains max_rounds on the full data
+    '''
+    rung_num = int(np.floor(np.log(max_rounds / min_rounds) / np.log(reduction_factor))) + 1
+    schedule = []
+    for rung in range(rung_num):
+        num_round = min(max_rounds, int(min_rounds * reduction_factor ** rung))
+        fraction = 1.0 / reduction_factor ** (rung_num - 1 - rung)
+        schedule.append((num_round, fraction))
+    schedule[-1] = (max_rounds, 1.0)
+    return schedule
+
+
+def run_trial(param, param_md5_str, dmatrix_pool, row_index, model_dir, nthread):
+    '''
+    :param row_index: sorted training rows of the rung, None for all of them
+    '''
+    archive_parameters(param, model_dir, param_md5_str)
+    with dmatrix_pool.acquire() as (train_data, validate_data):
+        # the slice is a DMatrix of this trial only
+        if row_index is not None:
+            train_data = train_data.slice(row_index)
+        _, progress_info = train_model(param, train_data, validate_data, nthread=nthread, verbose_eval=False)
+    rmse = progress_info['eval']['rmse'][-1]
+    write_history_to_file(model_dir, param_md5_str, rmse)
+    return param_md5_str, rmse
+
+
+def successive_halving(param_list, dmatrix_pool, model_dir, schedule, reduction_factor,
+                       row_order, num_workers, nthread, data_fingerprint, feature_columns, history,
+                       vocabulary_path=None):
+    '''
+    give every configuration the first rung, keep the best 1 / reduction_factor of them for the next
+    rung with more rounds and more data, until one rung is left. trials already recorded in
+    `history` (same parameters, rounds, data and rung) are not trained again
+    :return: (best param, rmse)
+    '''
+    candidates = param_list
+    ranked = []
+    for rung, (num_round, fraction) in enumerate(schedule):
+        row_num = max(1, int(len(row_order) * fraction))
+        row_index = np.sort(row_order[:row_num]) if row_num < len(row_order) else None
+
+        rmse_list = [None] * len(candidates)
+        pending_trial_list = []
+        for index, param in enumerate(candidates):
+            rung_param = copy.deepcopy(param)
+            rung_param['num_round'] = num_round
+            extra = {'fraction': fraction, 'row_order_seed': rung_param['model_param']['seed']}
+            param_md5_str = get_model_md5(rung_param, data_fingerprint, feature_columns,
+                                          add_vocabulary_to_extra(extra, vocabulary_path))
+            if param_md5_str in history:
+                rmse_list[index] = history[param_md5_str]
+            else:
+                pending_trial_list.append((index, rung_param, param_md5_str))
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(
+                lambda trial: run_trial(trial[1], trial[2], dmatrix_pool, row_index, model_dir, nthread),
+                pending_trial_list))
+        for (index, _, _), (param_md5_str, rmse) in zip(pending_trial_list, results):
+            rmse_list[index] = rmse
+            history[param_md5_str] = rmse
+        ranked = sorted(zip(candidates, rmse_list), key=lambda item: item[1])
+        logging.debug('rung %d: %d configs, %d rounds, %d rows, best rmse=%f',
+                      rung, len(candidates), num_round, row_num, ranked[0][1])
+
+        keep_num = max(1, len(candidates) // reduction_factor)
+        candidates = [param for param, _ in ranked[:keep_num]]
+    return ranked[0]
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--prj_dir',
+                            type=str,
+                            default='../')
+    arg_parser.add_argument('--data_dir',
+                            type=str,
+                            default='data')
+    arg_parser.add_argument('--model_dir',
+                            type=str,
+                            default='model')
+    arg_parser.add_argument('--train_data_dir',
+                            type=str,
+                            default='data-for-training')
+    arg_parser.add_argument('--log_filename',
+                            type=str,
+                            default=None)
+    arg_parser.add_argument('--param_filename',
+                            type=str,
+                            default='param.json')
+    arg_parser.add_argument('--output_param_filename',
+                            type=str,
+                            default='param_tuned.json')
+    arg_parser.add_argument('--min_rounds',
+                            type=int,
+                            default=10)
+    arg_parser.add_argument('--max_rounds',
+                            type=int,
+                            default=300)
+    arg_parser.add_argument('--reduction_factor',
+                            type=int,
+                            default=3)
+    arg_parser.add_argument('--max_configs',
+                            type=int,
+                            default=None)
+    arg_parser.add_argument('--num_workers',
+                            type=int,
+                            default=2)
+    arg_parser.add_argument('--nthread_budget',
+                            type=int,
+                            default=os.cpu_count())
+    FLAGS, _ = arg_parser.parse_known_args()
+
+    train_data_dir = os.path.join(FLAGS.prj_dir, FLAGS.data_dir, FLAGS.train_data_dir)
+    model_dir = os.path.join(FLAGS.prj_dir, FLAGS.model_dir)
+
+    LOG_FORMAT = '[%(asctime)s] [%(lineno)d] [%(levelname)s] %(message)s'
+    if FLAGS.log_filename is not None:
+        LOG_FILE_PATH = os.path.join(train_data_dir, FLAGS.log_filename)
+    else:
+        LOG_FILE_PATH = None
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=LOG_FILE_PATH)
+
+    best_param = load_parameters_from_json(os.path.join(model_dir, FLAGS.param_filename))
+    seed = best_param['model_param']['seed']
+
+    data_file_path = os.path.join(train_data_dir, load_dataset_file(train_data_dir))
+    data_fingerprint = get_dataset_fingerprint([data_file_path])
+    feature_columns = get_feature_columns(data_file_path)
+    history = read_history_records(model_dir)
+    # one train / validate DMatrix pair per concurrent trial, trials must not share a DMatrix, see DMatrixPool
+    dmatrix_pool = DMatrixPool(lambda: load_train_validate_dmatrix(data_file_path, seed,
+                                                                   cache_dir=os.path.join(train_data_dir,
+                                                                                          'dmatrix-cache')))
+    with dmatrix_pool.acquire() as (train_data, _):
+        # nested subsamples, the rows of a rung are a superset of the rows of the previous rung
+        row_order = np.random.RandomState(seed).permutation(train_data.num_row())
+
+    schedule = get_rung_schedule(FLAGS.min_rounds, FLAGS.max_rounds, FLAGS.reduction_factor)
+    nthread = max(1, FLAGS.nthread_budget // FLAGS.num_workers)
+    logging.debug('rung schedule (num_round, fraction): %s', schedule)
+
+    start_time = dt.datetime.now()
+    best_rmse = None
+    for stage, stage_grid in enumerate(TUNING_STAGES):
+        param_list = expand_parameter_grid(best_param, {'model_param': stage_grid})
+        if FLAGS.max_configs is not None and len(param_list) > FLAGS.max_configs:
+            param_list = random.Random(seed + stage).sample(param_list, FLAGS.max_configs)
+
+        stage_param, stage_rmse = successive_halving(param_list, dmatrix_pool, model_dir, schedule,
+                                                     FLAGS.reduction_factor, row_order, FLAGS.num_workers, nthread,
+                                                     data_fingerprint, feature_columns, history,
+                                                     os.path.join(train_data_dir, VOCABULARY_FILENAME))
+        # the final rung of every stage runs max_rounds on the full data, so stages are comparable
+        if best_rmse is None or stage_rmse < best_rmse:
+            best_param, best_rmse = stage_param, stage_rmse
+        logging.debug('stage %d done: %s rmse=%f',
+                      stage, {name: best_param['model_param'].get(name) for name in stage_grid}, best_rmse)
+
+    output_param_path = os.path.join(model_dir, FLAGS.output_param_filename)
+    with open(output_param_path, 'w') as json_file:
+        json.dump(best_param, json_file, indent=2)
+    logging.debug('best rmse=%f, saved %s in %s', best_rmse, output_param_path, dt.datetime.now() - start_time)
@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+import logging
+import collections
+import numpy as np
+
+
+class RangeRule(object):
+    '''
+    flag the rows whose `column` is outside [low, high] (NaN is outside), a bound left as None is open
+    '''
+
+    def __init__(self, name, column, low=None, high=None, flag=1, priority=0, low_inclusive=True,
+                 high_inclusive=True):
+        self.name = name
+        self.columns = [column]
+        self.flag = flag
+        self.priority = priority
+        self.__column = column
+        self.__low = low
+        self.__high = high
+        self.__low_inclusive = low_inclusive
+        self.__high_inclusive = high_inclusive
+
+    def get_violation(self, arrays):
+        values = arrays[self.__column]
+        inside = ~np.isnan(values)
+        if self.__low is not None:
+            inside &= (values >= self.__low) if self.__low_inclusive else (values > self.__low)
+        if self.__high is not None:
+            inside &= (values <= self.__high) if self.__high_inclusive else (values < self.__high)
+        return ~inside
+
+
+class EqualityRule(object):
+    '''
+    flag the rows where every column of `values` ({column: value}) equals its value
+    '''
+
+    def __init__(self, name, values, flag=1, priority=0):
+        self.name = name
+        self.columns = list(values.keys())
+        self.flag = flag
+        self.priority = priority
+        self.__values = values
+
+    def get_violation(self, arrays):
+        violation = None
+        for column, value in self.__values.items():
+            equal = arrays[column] == value
+            violation = equal if violation is None else violation & equal
+        return violation
+
+
+class BoundingBoxRule(object):
+    '''
+    flag the rows whose (longitude, latitude) point lies outside the box, or inside it with `inside=True`
+    '''
+
+    def __init__(self, name, longitude_column, latitude_column, longitude_range, latitude_range, flag=1, priority=0,
+                 inside=False):
+        self.name = name
+        self.columns = [longitude_column, latitude_column]
+        self.flag = flag
+        self.priority = priority
+        self.__longitude_column = longitude_column
+        self.__latitude_column = latitude_column
+        self.__longitude_range = longitude_range
+        self.__latitude_range = latitude_range
+        self.__inside = inside
+
+    def get_violation(self, arrays):
+        longitude = arrays[self.__longitude_column]
+        latitude = arrays[self.__latitude_column]
+        in_box = (longitude >= self.__longitude_range[0]) & (longitude <= self.__longitude_range[1]) & \
+                 (latitude >= self.__latitude_range[0]) & (latitude <= self.__latitude_range[1])
+        return in_box if self.__inside else ~in_box
+
+
+class ValidationRuleSet(object):
+    '''
+    evaluate every rule over the column arrays and write the flag column once: a row gets the flag of
+    the highest priority rule it violates (the first declared one among equal priorities) and
+    `default_flag` when it violates none. rules on columns the frame does not have are skipped
+    '''
+
+    def __init__(self, rules, flag_column, default_flag=0):
+        self.__rules = sorted(rules, key=lambda rule: -rule.priority)
+        self.__flag_column = flag_column
+        self.__default_flag = default_flag
+
+    def get_rule_names(self):
+        return [rule.name for rule in self.__rules]
+
+    def apply(self, data_frame):
+        '''
+        :return: (data_frame, rejection counts), the counts map every rule name to the number of rows
+                 whose flag it decided
+        '''
+        rules = [rule for rule in self.__rules if all(column in data_frame.columns for column in rule.columns)]
+        counts = collections.OrderedDict((rule.name, 0) for rule in self.__rules)
+        if len(rules) == 0:
+            data_frame[self.__flag_column] = self.__default_flag
+            return data_frame, counts
+
+        columns = set(column for rule in rules for column in rule.columns)
+        arrays = {column: data_frame[column].values for column in columns}
+        violations = np.stack([rule.get_violation(arrays) for rule in rules])
+        flagged = violations.any(axis=0)
+        deciding_rule = violations.argmax(axis=0)
+
+        flags = np.array([rule.flag for rule in rules])
+        data_frame[self.__flag_column] = np.where(flagged, flags[deciding_rule], self.__default_flag)
+        for rule, count in zip(rules, np.bincount(deciding_rule[flagged], minlength=len(rules))):
+            counts[rule.name] = int(count)
+        return data_frame, counts
+
+
+def log_rejection_counts(counts, row_num=None):
+    for name, count in counts.items():
+        if row_num:
+            logging.debug('rule %s: %d rows (%.3f%%)', name, count, 100.0 * count / row_num)
+        else:
+            logging.debug('rule %s: %d rows', name, count)
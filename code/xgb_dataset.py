@@ -0,0 +1,191 @@
+# -*- coding:utf-8 -*-
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import contextlib
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+from dataset_io import get_feather_columns, read_feather_columns, get_file_fingerprint
+
+NON_FEATURE_COLUMNS = ['key', 'fare_amount']
+
+
+class FeatherChunkIter(xgb.DataIter):
+    '''
+    feed a list of feather chunk files to xgboost one file at a time, so only one chunk
+    is held in memory while the DMatrix is built
+    '''
+
+    def __init__(self, file_path_list, cache_prefix=None, label_column='fare_amount'):
+        self.__file_path_list = file_path_list
+        self.__label_column = label_column
+        self.__index = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self.__index == len(self.__file_path_list):
+            return 0
+        file_path = self.__file_path_list[self.__index]
+        logging.debug('loading chunk %s', file_path)
+        data_frame = read_training_data_frame(file_path, self.__label_column)
+        input_data(data=data_frame.drop(columns=NON_FEATURE_COLUMNS, errors='ignore'),
+                   label=data_frame[self.__label_column])
+        self.__index += 1
+        return 1
+
+    def reset(self):
+        self.__index = 0
+
+
+def build_external_memory_dmatrix(file_path_list, cache_dir, cache_name):
+    '''
+    build an external memory DMatrix from feather chunk files, the pages are cached on disk
+    under `cache_dir` so peak memory is bounded by the chunk size instead of the dataset size
+    '''
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    data_iter = FeatherChunkIter(file_path_list, cache_prefix=os.path.join(cache_dir, cache_name))
+    return xgb.DMatrix(data_iter)
+
+
+def load_dataset_file(train_data_dir):
+    file_list = os.listdir(train_data_dir)
+    reg_exp = r'cleaned_train.feather'
+    for file in file_list:
+        if re.match(reg_exp, file) is not None:
+            return file
+    return None
+
+
+def load_dataset_file_list(train_data_dir):
+    file_list = os.listdir(train_data_dir)
+    reg_exp = r'cleaned_chunk_\d+_train\.feather$'
+    data_file_list = []
+    for file in file_list:
+        if re.match(reg_exp, file) is not None:
+            data_file_list.append(file)
+    data_file_list.sort()
+    return data_file_list
+
+
+def split_train_validate_dataset(data_file_list, validate_file_num=2):
+    train_file_list = data_file_list[:-validate_file_num]
+    validate_file_list = data_file_list[-validate_file_num:]
+    return train_file_list, validate_file_list
+
+
+def get_dataset_fingerprint(file_path_list):
+    content = ','.join(get_file_fingerprint(file_path) for file_path in file_path_list)
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def get_feature_columns(file_path):
+    return [column for column in get_feather_columns(file_path) if column not in NON_FEATURE_COLUMNS]
+
+
+def read_training_data_frame(file_path, label_column='fare_amount'):
+    '''
+    the feature and label columns of a training file, `key` is not loaded
+    '''
+    return read_feather_columns(file_path, get_feature_columns(file_path) + [label_column])
+
+
+def get_dmatrix_cache_key(data_file_path, seed, feature_columns, test_size):
+    content = json.dumps({'data': get_file_fingerprint(data_file_path),
+                          'seed': seed,
+                          'features': list(feature_columns),
+                          'test_size': test_size}, sort_keys=True)
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def build_train_validate_dmatrix(data_df, seed, test_size=0.05):
+    train_df, validate_df = train_test_split(data_df, test_size=test_size, shuffle=True, random_state=seed)
+    logging.debug(train_df.shape)
+    logging.debug(validate_df.shape)
+
+    train_data = xgb.DMatrix(train_df.drop(columns=NON_FEATURE_COLUMNS, errors='ignore'),
+                             label=train_df['fare_amount'])
+    validate_data = xgb.DMatrix(validate_df.drop(columns=NON_FEATURE_COLUMNS, errors='ignore'),
+                                label=validate_df['fare_amount'])
+    return train_data, validate_data
+
+
+def load_dataset_dmatrix(data_file_path, cache_dir=None):
+    '''
+    the whole training file as one DMatrix, cached like load_train_validate_dmatrix
+    '''
+    if cache_dir is not None:
+        feature_columns = get_feature_columns(data_file_path)
+        cache_key = get_dmatrix_cache_key(data_file_path, None, feature_columns, 0)
+        cache_path = os.path.join(cache_dir, 'dataset_%s.buffer' % (cache_key,))
+        if os.path.exists(cache_path):
+            logging.debug('load DMatrix cache %s', cache_key)
+            return xgb.DMatrix(cache_path)
+
+    data_df = read_training_data_frame(data_file_path)
+    dataset = xgb.DMatrix(data_df.drop(columns=NON_FEATURE_COLUMNS, errors='ignore'), label=data_df['fare_amount'])
+    del data_df
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        dataset.save_binary(cache_path + '.tmp')
+        os.replace(cache_path + '.tmp', cache_path)
+        logging.debug('save DMatrix cache %s', cache_key)
+    return dataset
+
+
+def load_train_validate_dmatrix(data_file_path, seed, test_size=0.05, cache_dir=None):
+    '''
+    split the training file into train / validate DMatrix, when `cache_dir` is given both are
+    saved as xgboost binary buffers keyed by the file content fingerprint, split seed and feature list,
+    and later calls with the same key load the buffers instead of reading the feather file
+    '''
+    if cache_dir is None:
+        return build_train_validate_dmatrix(read_training_data_frame(data_file_path), seed, test_size)
+
+    feature_columns = get_feature_columns(data_file_path)
+    cache_key = get_dmatrix_cache_key(data_file_path, seed, feature_columns, test_size)
+    train_cache_path = os.path.join(cache_dir, 'train_%s.buffer' % (cache_key,))
+    validate_cache_path = os.path.join(cache_dir, 'validate_%s.buffer' % (cache_key,))
+    if os.path.exists(train_cache_path) and os.path.exists(validate_cache_path):
+        logging.debug('load DMatrix cache %s', cache_key)
+        return xgb.DMatrix(train_cache_path), xgb.DMatrix(validate_cache_path)
+
+    train_data, validate_data = build_train_validate_dmatrix(read_training_data_frame(data_file_path), seed, test_size)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    for dmatrix, cache_path in [(train_data, train_cache_path), (validate_data, validate_cache_path)]:
+        temp_cache_path = cache_path + '.tmp'
+        dmatrix.save_binary(temp_cache_path)
+        os.replace(temp_cache_path, cache_path)
+    logging.debug('save DMatrix cache %s', cache_key)
+    return train_data, validate_data
+
+
+class DMatrixPool(object):
+    '''
+    DMatrix objects for trainings run at the same time in threads. xgboost builds the quantile /
+    histogram index of a DMatrix lazily on first use and without a lock, so two boosters trained at
+    once on one DMatrix can race whatever the tree_method. acquire() hands out a DMatrix (or tuple of
+    them) no other thread holds, made by `load_function` when all existing ones are in use, so a pool
+    used by `num_workers` threads holds at most `num_workers` copies. loads run one at a time, the
+    first one writes the disk cache of load_train_validate_dmatrix and the others read it
+    '''
+
+    def __init__(self, load_function):
+        self.__load_function = load_function
+        self.__free_data = []
+        self.__lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self):
+        with self.__lock:
+            data = self.__free_data.pop() if len(self.__free_data) > 0 else self.__load_function()
+        try:
+            yield data
+        finally:
+            with self.__lock:
+                self.__free_data.append(data)